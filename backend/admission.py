@@ -0,0 +1,151 @@
+"""Admission control.
+
+Caps the number of connections (in total and per IP address), rooms and
+members of a room, and the size of inbound frames. When the event loop
+lags or the process uses too much memory the server sheds load: new
+connections are refused with HTTP 503 and a Retry-After header, new rooms
+with an "overloaded" error carrying retry_after. Connections and rooms
+that exist keep working.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Optional
+
+from websockets.legacy.server import WebSocketServerProtocol
+
+from commands import CommandError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AdmissionPolicy:
+    max_connections: int = 10_000
+    max_connections_per_ip: int = 64
+    max_rooms: int = 2_000
+    room_capacity: int = 500
+    # bytes, larger inbound messages close the connection
+    max_frame: int = 64 * 1024
+    # seconds the event loop may be late before shedding starts
+    max_lag: float = 0.25
+    # resident memory in MB before shedding starts, 0 for no limit
+    max_memory_mb: int = 0
+    # seconds clients are told to wait when shedding
+    retry_after: int = 5
+
+
+def resident_memory_mb() -> float:
+    """Resident memory of the process, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+class LoadMonitor:
+    """Samples event loop lag and memory of the process"""
+
+    def __init__(self, policy: AdmissionPolicy, interval=0.1):
+        self.policy = policy
+        self.interval = interval
+        self.lag = 0.0
+        self.memory_mb = 0.0
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            late = time.perf_counter() - start - self.interval
+            # averaged, a single slow tick should not start shedding
+            self.lag = self.lag * 0.8 + late * 0.2
+            self.memory_mb = resident_memory_mb()
+
+    def overload(self) -> Optional[str]:
+        """Why the server is overloaded, None if it is not"""
+        if self.lag > self.policy.max_lag:
+            return f"event loop lag {self.lag * 1000:.0f} ms"
+        if self.policy.max_memory_mb and self.memory_mb > self.policy.max_memory_mb:
+            return f"memory {self.memory_mb:.0f} MB"
+        return None
+
+
+class Admission:
+    def __init__(self, policy: AdmissionPolicy = None):
+        self.policy = policy or AdmissionPolicy()
+        self.monitor = LoadMonitor(self.policy)
+        self.connections = 0
+        self.per_ip = Counter()
+        self.refused = Counter()
+
+    def refuse_connection(self, ip) -> Optional[str]:
+        """Reason to refuse a new connection from the address, or None"""
+        if self.connections >= self.policy.max_connections:
+            reason = "connection limit"
+        elif self.per_ip[ip] >= self.policy.max_connections_per_ip:
+            reason = "connection limit per address"
+        else:
+            reason = self.monitor.overload()
+        if reason is not None:
+            self.refused["connection"] += 1
+        return reason
+
+    def connected(self, ip):
+        self.connections += 1
+        self.per_ip[ip] += 1
+
+    def disconnected(self, ip):
+        self.connections -= 1
+        self.per_ip[ip] -= 1
+        if self.per_ip[ip] <= 0:
+            del self.per_ip[ip]
+
+    def check_new_room(self, rooms: int):
+        if rooms >= self.policy.max_rooms:
+            self.refused["room"] += 1
+            raise CommandError(f"Cannot create more than {self.policy.max_rooms} rooms", "room_limit")
+        if (reason := self.monitor.overload()) is not None:
+            self.refused["room"] += 1
+            raise CommandError(
+                f"Server is overloaded ({reason}), try again later",
+                "overloaded",
+                retry_after=self.policy.retry_after,
+            )
+
+    def check_capacity(self, room):
+        if len(room.users) >= self.policy.room_capacity:
+            self.refused["member"] += 1
+            raise CommandError(f"Room '{room.name}' is full", "room_full")
+
+    def describe(self):
+        return {
+            "connections": self.connections,
+            "addresses": len(self.per_ip),
+            "lag_ms": round(self.monitor.lag * 1000, 1),
+            "memory_mb": round(self.monitor.memory_mb, 1),
+            "refused": dict(self.refused),
+        }
+
+
+class AdmissionServerProtocol(WebSocketServerProtocol):
+    """Refuses the handshake with 503 Service Unavailable and Retry-After
+    when the admission does not take the connection"""
+
+    def __init__(self, *args, admission: Admission, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.admission = admission
+
+    async def process_request(self, path, request_headers):
+        ip = self.remote_address[0] if self.remote_address else None
+        reason = self.admission.refuse_connection(ip)
+        if reason is not None:
+            logger.warning(f"Refused connection from {ip}: {reason}")
+            headers = [("Retry-After", str(self.admission.policy.retry_after))]
+            return HTTPStatus.SERVICE_UNAVAILABLE, headers, f"{reason}, try again later\n".encode()
+        return await super().process_request(path, request_headers)
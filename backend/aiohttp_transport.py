@@ -0,0 +1,115 @@
+"""Websocket endpoint on the aiohttp application.
+
+With `--transport aiohttp` the static files and the websocket are served
+by one aiohttp application on one port. An upgrade request to "/" or
+"/ws" is a websocket connection, anything else is a file. Connections
+are wrapped in AiohttpWebSocket, which offers the part of the websockets
+protocol API that Session, Lifecycle and the server use, so everything
+above the transport is the same for both.
+
+Differences to the websockets transport: keepalive pings wait half the
+ping interval for the pong (aiohttp heartbeat), and negotiated
+compression applies to every message with aiohttp's settings. The
+compression policy (threshold, window bits, memory level) is not used
+and there are no per-type statistics: aiohttp can not send a message
+uncompressed once deflate is negotiated, compress=0 per send means its
+default.
+"""
+
+import asyncio
+import logging
+
+from aiohttp import WSMsgType, web
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import Close
+
+from codec import SUBPROTOCOLS
+from lifecycle import LifecyclePolicy
+
+logger = logging.getLogger(__name__)
+
+
+class AiohttpWebSocket:
+    """aiohttp WebSocketResponse with the websockets protocol API"""
+
+    extensions = ()
+
+    def __init__(self, ws: web.WebSocketResponse, request: web.Request):
+        self.ws = ws
+        self.remote_address = request.transport.get_extra_info("peername") if request.transport else None
+        self.close_rcvd = None
+
+    @property
+    def subprotocol(self):
+        return self.ws.ws_protocol
+
+    @property
+    def open(self):
+        return not self.ws.closed
+
+    @property
+    def close_sent(self):
+        if isinstance(self.ws.exception(), asyncio.TimeoutError):
+            # heartbeat without a pong, reported like the websockets keepalive
+            return Close(1011, "keepalive ping timeout")
+        return None
+
+    async def send(self, frame):
+        try:
+            if isinstance(frame, str):
+                await self.ws.send_str(frame)
+            else:
+                await self.ws.send_bytes(frame)
+        except ConnectionResetError:
+            raise ConnectionClosed(self.close_rcvd, self.close_sent)
+
+    async def close(self, code=1000, reason=""):
+        await self.ws.close(code=code, message=reason.encode())
+
+    async def __aiter__(self):
+        while True:
+            message = await self.ws.receive()
+            if message.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                yield message.data
+            elif message.type is WSMsgType.CLOSE:
+                self.close_rcvd = Close(message.data, message.extra or "")
+                return
+            elif message.type in (WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                return
+
+
+def upgrade_or(handle_websocket, handle_http):
+    """Handler of a path serving both websocket upgrades and files"""
+
+    async def handle(request: web.Request):
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            return await handle_websocket(request)
+        return await handle_http(request)
+
+    return handle
+
+
+def websocket_handler(server, lifecycle: LifecyclePolicy, max_frame: int):
+    """aiohttp handler running server.handle_connection for every websocket"""
+
+    async def handle_websocket(request: web.Request):
+        admission = server.admission
+        reason = admission.refuse_connection(request.remote)
+        if reason is not None:
+            logger.warning(f"Refused connection from {request.remote}: {reason}")
+            return web.Response(
+                status=503,
+                headers={"Retry-After": str(admission.policy.retry_after)},
+                text=f"{reason}, try again later\n",
+            )
+        ws = web.WebSocketResponse(
+            protocols=SUBPROTOCOLS,
+            heartbeat=lifecycle.ping_interval,
+            timeout=lifecycle.close_timeout,
+            max_msg_size=max_frame,
+        )
+        await ws.prepare(request)
+        await server.handle_connection(AiohttpWebSocket(ws, request), request.path)
+        return ws
+
+    return handle_websocket
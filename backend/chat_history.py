@@ -0,0 +1,211 @@
+"""Chat history of rooms.
+
+The latest messages of every room are kept in a bounded ring, so late
+joiners get them from memory. All messages are also stored in a SQLite
+database in WAL mode: engines append to an in-memory batch and a
+background task commits batches in a worker thread, sending a chat
+message never waits for the disk. Pages older than the ring are read
+from the database.
+
+Messages have ids increasing over all rooms, the id of the oldest message
+of a page is the cursor of the next (older) one. Rooms are stored under a
+key of the room instance, a new room with the name of a removed one does
+not see its messages.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+CHAT_DB_PATH = "chat_history.sqlite3"
+# messages kept in memory per room
+RING_SIZE = 100
+# longer messages are cut, with RING_SIZE this caps the memory of a room
+MAX_TEXT = 1000
+FLUSH_INTERVAL = 0.5
+FLUSH_BATCH = 1000
+# unwritten messages beyond this are dropped when the disk falls behind
+MAX_PENDING = 100_000
+DEFAULT_PAGE = 50
+MAX_PAGE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    ts REAL NOT NULL,
+    sender TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_room_id ON chat (room, id);
+"""
+
+
+class ChatHistoryQuery(BaseModel):
+    # id of the oldest message the client has, None for the latest page
+    before: Optional[int] = None
+    limit: int = Field(default=DEFAULT_PAGE, ge=1, le=MAX_PAGE)
+
+
+class ChatHistoryStore:
+    def __init__(self, path=CHAT_DB_PATH, ring_size=RING_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.ring_size = ring_size
+        self.flush_interval = flush_interval
+        self.rings: Dict[str, Deque[dict]] = {}
+        self.pending: Deque[tuple] = deque()
+        # taken from pending, until their commit finished
+        self.writing: List[tuple] = []
+        self.flusher: Optional[asyncio.Task] = None
+        self.last_id: Optional[int] = None
+        self.dropped = 0
+        self.written = 0
+        # the writer runs in a worker thread, queries in others
+        self.db: Optional[sqlite3.Connection] = None
+        self.db_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        with self.db_lock:
+            if self.db is None:
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(SCHEMA)
+                self.db = db
+            return self.db
+
+    def read_last_id(self) -> int:
+        db = self.connect()
+        with self.db_lock:
+            return db.execute("SELECT coalesce(max(id), 0) FROM chat").fetchone()[0]
+
+    async def open(self):
+        """Open the database and continue the ids of the previous run, off
+        the event loop. Called at startup"""
+        self.last_id = await asyncio.to_thread(self.read_last_id)
+
+    def next_id(self) -> int:
+        if self.last_id is None:
+            # without open(), e.g. in scripts
+            self.last_id = self.read_last_id()
+        self.last_id += 1
+        return self.last_id
+
+    # writing
+
+    def append(self, room: str, sender: Optional[dict], text: str) -> dict:
+        """Keep a message in the ring of the room and queue it for the
+        database, returns the stored message"""
+        message = {"id": self.next_id(), "ts": time.time(), "sender": sender, "text": text[:MAX_TEXT]}
+        ring = self.rings.get(room)
+        if ring is None:
+            ring = self.rings[room] = deque(maxlen=self.ring_size)
+        ring.append(message)
+        if len(self.pending) >= MAX_PENDING:
+            self.pending.popleft()
+            self.dropped += 1
+        self.pending.append((room, message))
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self.flush_later())
+        return message
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        while self.pending:
+            await self.flush()
+
+    async def flush(self):
+        batch = [self.pending.popleft() for _ in range(min(FLUSH_BATCH, len(self.pending)))]
+        if batch:
+            self.writing = batch
+            try:
+                await asyncio.to_thread(self.write_batch, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} chat messages: {e}")
+            finally:
+                self.writing = []
+
+    async def close(self):
+        """Write every queued message, on shutdown"""
+        if self.flusher is not None:
+            # a batch it is writing is committed before it ends
+            await asyncio.gather(self.flusher, return_exceptions=True)
+        while self.pending:
+            await self.flush()
+
+    def write_batch(self, batch: List[tuple]):
+        rows = [
+            (m["id"], room, m["ts"], json.dumps(m["sender"]) if m["sender"] is not None else None, m["text"])
+            for room, m in batch
+        ]
+        db = self.connect()
+        with self.db_lock, db:
+            db.executemany("INSERT OR IGNORE INTO chat (id, room, ts, sender, text) VALUES (?, ?, ?, ?, ?)", rows)
+        self.written += len(rows)
+
+    def forget_room(self, room: str):
+        """Drop the ring of a removed room, its messages stay in the
+        database under the key of the room instance"""
+        self.rings.pop(room, None)
+
+    def describe(self):
+        return {
+            "rooms": len(self.rings),
+            "pending": len(self.pending),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    # reading
+
+    def read_before(self, room: str, before: Optional[int], limit: int) -> List[dict]:
+        db = self.connect()
+        query = "SELECT id, ts, sender, text FROM chat WHERE room = ?"
+        params = [room]
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        with self.db_lock:
+            rows = db.execute(query + " ORDER BY id DESC LIMIT ?", (*params, limit)).fetchall()
+        return [
+            {"id": id, "ts": ts, "sender": json.loads(sender) if sender is not None else None, "text": text}
+            for id, ts, sender, text in rows
+        ]
+
+    async def page(self, room: str, before: Optional[int] = None, limit: int = DEFAULT_PAGE):
+        """Messages older than the cursor, oldest first, and the cursor of
+        the next page, None when there is nothing older"""
+        limit = max(1, min(limit, MAX_PAGE))
+        # one more to know whether there is an older page
+        wanted = limit + 1
+        ring = self.rings.get(room, ())
+        newest = [m for m in ring if before is None or m["id"] < before]
+        if len(newest) >= wanted:
+            page = newest[-wanted:]
+        else:
+            # older than the ring, not yet committed messages are taken from the batches
+            unwritten = [
+                m
+                for r, m in itertools.chain(self.writing, self.pending)
+                if r == room and (before is None or m["id"] < before)
+            ]
+            stored = await asyncio.to_thread(self.read_before, room, before, wanted)
+            merged = {m["id"]: m for m in stored + unwritten + newest}
+            page = [merged[id] for id in sorted(merged)][-wanted:]
+        more = len(page) > limit
+        page = page[-limit:]
+        cursor = page[0]["id"] if more else None
+        return page, cursor
+
+
+default_chat_history = ChatHistoryStore()
@@ -0,0 +1,191 @@
+"""Wire codecs, negotiated per connection through the websocket subprotocol.
+
+- "json": text frames, standard library
+- "json.fast": text frames in the same format, encoded with orjson
+- "msgpack.v1": binary MessagePack frames, well-known keys are replaced
+  with small integers. The key table is sent in the first frame
+
+Codecs whose library is not installed are not offered. A client that asks
+for no subprotocol gets "json".
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+from fragments import Fragment, Spliced, SplicedArray, SplicedObject
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+# index in this list is the integer key on the wire, append only
+MSGPACK_KEYS = [
+    "type", "data", "status", "personal", "seat", "websocket_uid", "expected_actions",
+    "stage", "setup", "playing", "gameName", "seats", "windelay", "info", "name",
+    "gender", "avatar", "ai", "policy", "players", "stack", "bet", "cards", "folded",
+    "lastAction", "isAllIn", "acted", "showCardsAfterFold", "action", "amount",
+    "dealer", "turn", "table", "bank", "small_blind", "total_turns",
+    "last_round_victory", "victory", "winners", "won", "combination", "comments",
+    "cursor", "id", "text", "pts", "guessed", "cards_count", "card", "author",
+    "original", "votes", "current_player", "table_count", "last_round_result",
+    "deck_count", "played", "guess", "room", "game_status", "users", "game",
+    "userCount", "sender", "message", "error", "request", "command",
+    "member_id",
+]
+
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    def loads(self, message):
+        return json.loads(message)
+
+    def from_json(self, text):
+        """Frame for a message that is already serialized as JSON, or spliced"""
+        return str(text)
+
+    def hello(self):
+        """First frame of a connection, if the codec needs one"""
+        return None
+
+    def batch(self, frames: List[str]):
+        """One frame carrying several encoded messages, in order"""
+        return '{"type":"batch","data":[' + ",".join(frames) + "]}"
+
+    def tag(self, key: str, value):
+        """Encoded field for tagged(), computed once per tag"""
+        return "{" + json.dumps(key) + ":" + json.dumps(value) + ","
+
+    def tagged(self, frame: str, tag: str):
+        """Frame of a message with one more top level field"""
+        if frame == "{}":
+            return tag[:-1] + "}"
+        return tag + frame[1:]
+
+
+class FastJsonCodec(JsonCodec):
+    name = "json.fast"
+
+    def dumps(self, obj):
+        # text frames, clients parse them with JSON.parse
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, message):
+        return orjson.loads(message)
+
+
+def map_header(frame: bytes) -> Tuple[int, int]:
+    """Entry count and header length of a packed map"""
+    head = frame[0]
+    if 0x80 <= head <= 0x8F:
+        return head - 0x80, 1
+    if head == 0xDE:
+        return int.from_bytes(frame[1:3], "big"), 3
+    if head == 0xDF:
+        return int.from_bytes(frame[1:5], "big"), 5
+    raise ValueError("Not a packed map")
+
+
+class MsgpackCodec:
+    name = "msgpack.v1"
+    binary = True
+
+    def __init__(self, keys: List[str] = MSGPACK_KEYS):
+        self.keys = keys
+        self.ids: Dict[str, int] = {key: i for i, key in enumerate(keys)}
+
+    def pack_keys(self, obj):
+        if isinstance(obj, dict):
+            ids = self.ids
+            # keys are strings in JSON, keep it so for the ones outside the table
+            return {ids.get(k, k) if isinstance(k, str) else str(k): self.pack_keys(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self.pack_keys(v) for v in obj]
+        return obj
+
+    def unpack_keys(self, obj):
+        if isinstance(obj, dict):
+            keys = self.keys
+            return {keys[k] if isinstance(k, int) else k: self.unpack_keys(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self.unpack_keys(v) for v in obj]
+        return obj
+
+    def dumps(self, obj):
+        return msgpack.packb(self.pack_keys(obj))
+
+    def loads(self, message):
+        if isinstance(message, str):
+            # clients may still send text frames
+            return json.loads(message)
+        return self.unpack_keys(msgpack.unpackb(message, strict_map_key=False))
+
+    def from_json(self, text):
+        # status messages are spliced from JSON fragments, they are converted
+        # part by part, every part once
+        if not isinstance(text, (Fragment, Spliced)):
+            return self.dumps(json.loads(text))
+        if text.encoded is None:
+            text.encoded = {}
+        frame = text.encoded.get(self.name)
+        if frame is None:
+            frame = text.encoded[self.name] = self.pack_parts(text)
+        return frame
+
+    def pack_parts(self, text):
+        if isinstance(text, SplicedObject):
+            head = self.from_json(text.head)
+            count, start = map_header(head)
+            fields = [msgpack.packb(self.ids.get(name, name)) + self.from_json(value) for name, value in text.fields.items()]
+            return msgpack.Packer().pack_map_header(count + len(fields)) + head[start:] + b"".join(fields)
+        if isinstance(text, SplicedArray):
+            items = [self.from_json(item) for item in text.items]
+            return msgpack.Packer().pack_array_header(len(items)) + b"".join(items)
+        return self.dumps(json.loads(text))
+
+    def hello(self):
+        # the key table itself goes with plain string keys
+        return msgpack.packb({"type": "codec", "name": self.name, "keys": self.keys})
+
+    def batch(self, frames: List[bytes]):
+        # {type: "batch", data: [...]} around the already packed messages
+        packer = msgpack.Packer()
+        head = packer.pack_map_header(2) + packer.pack(self.ids["type"]) + packer.pack("batch")
+        return head + packer.pack(self.ids["data"]) + packer.pack_array_header(len(frames)) + b"".join(frames)
+
+    def tag(self, key: str, value):
+        return msgpack.packb(self.ids.get(key, key)) + msgpack.packb(value)
+
+    def tagged(self, frame: bytes, tag: bytes):
+        # one more entry in the map header, the field goes first
+        count, start = map_header(frame)
+        return msgpack.Packer().pack_map_header(count + 1) + tag + frame[start:]
+
+
+def available_codecs() -> Dict[str, object]:
+    codecs = {"json": JsonCodec()}
+    if orjson is not None:
+        codecs["json.fast"] = FastJsonCodec()
+    if msgpack is not None:
+        codecs["msgpack.v1"] = MsgpackCodec()
+    return codecs
+
+
+CODECS = available_codecs()
+
+# offered to clients, most compact first
+SUBPROTOCOLS = [name for name in ("msgpack.v1", "json.fast", "json") if name in CODECS]
+
+
+def codec_for(subprotocol: Optional[str]):
+    return CODECS.get(subprotocol or "json", CODECS["json"])
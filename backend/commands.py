@@ -0,0 +1,141 @@
+"""Table-driven command dispatch.
+
+Every message type is registered with its handler and an input schema. The
+schema is compiled into a pydantic TypeAdapter once, at import time, and
+the payload is validated before the handler runs. Dispatch is a single
+dict lookup; unknown types and invalid payloads raise CommandError.
+Every command counts its calls and the time its handler spends running,
+time it waits (sleeps, I/O, other tasks) is not counted.
+
+    class Engine:
+        commands = CommandRegistry("engine")
+
+        @commands.handler("take_seat", int)
+        async def handle_take_seat(self, room, websocket, userinfo, seat):
+            ...
+
+    await Engine.commands.dispatch(engine, message, room, websocket, userinfo)
+"""
+
+import copy
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+logger = logging.getLogger(__name__)
+
+# marks commands whose handler receives the whole message
+WHOLE_MESSAGE = object()
+
+registries: List["CommandRegistry"] = []
+
+
+class CommandError(Exception):
+    def __init__(self, message, error_type, **details):
+        super().__init__(message)
+        self.error_type = error_type
+        # extra fields of the error message, e.g. retry_after
+        self.details = details
+
+
+class OwnTime:
+    """Awaitable running a coroutine, measures the time spent in its steps
+    and not the time it is suspended"""
+
+    __slots__ = ("coro", "seconds")
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.seconds = 0.0
+
+    def __await__(self):
+        step, value = self.coro.send, None
+        while True:
+            start = time.perf_counter()
+            try:
+                future = step(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.seconds += time.perf_counter() - start
+            try:
+                value = yield future
+                step = self.coro.send
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                step, value = self.coro.throw, e
+
+
+class Command:
+    __slots__ = ("name", "handler", "adapter", "payload", "default", "calls", "seconds")
+
+    def __init__(self, name, handler, schema=None, payload="data", default=None):
+        self.name = name
+        self.handler = handler
+        self.adapter = TypeAdapter(schema) if schema is not None else None
+        self.payload = payload
+        self.default = default
+        self.calls = 0
+        self.seconds = 0.0
+
+    def parse(self, message):
+        if self.payload is None:
+            return None
+        value = message if self.payload is WHOLE_MESSAGE else message.get(self.payload, self.default)
+        if self.adapter is None:
+            return value
+        try:
+            return self.adapter.validate_python(value)
+        except ValidationError as e:
+            raise CommandError(f"Invalid {self.name}: {e.errors(include_url=False)}", "invalid_command")
+
+
+class CommandRegistry:
+    def __init__(self, name, key="type", include: Optional["CommandRegistry"] = None):
+        """include copies the commands of a registry of a base class,
+        they are counted separately"""
+        self.name = name
+        self.key = key
+        self.commands: Dict[str, Command] = {}
+        if include is not None:
+            self.commands = {name: copy.copy(command) for name, command in include.commands.items()}
+        registries.append(self)
+
+    def handler(self, name, schema=None, payload: Any = "data", default=None):
+        """Register the decorated function as the handler of a command.
+        payload is the message key passed to the handler, WHOLE_MESSAGE
+        for the message itself, None for no payload"""
+
+        def register(fn):
+            self.commands[name] = Command(name, fn, schema, payload, default)
+            return fn
+
+        return register
+
+    async def dispatch(self, owner, message, *context):
+        """Validate the payload and call handler(owner, *context, payload)"""
+        command = self.commands.get(message.get(self.key))
+        if command is None:
+            raise CommandError(f"Unknown {self.name} command {message.get(self.key)!r}", "unknown_command")
+        payload = command.parse(message)
+        timed = OwnTime(command.handler(owner, *context, payload))
+        try:
+            return await timed
+        finally:
+            command.calls += 1
+            command.seconds += timed.seconds
+
+    def describe(self):
+        return {
+            name: {"calls": c.calls, "ms": round(c.seconds * 1000, 3)}
+            for name, c in self.commands.items()
+            if c.calls
+        }
+
+
+def describe_all() -> Dict[str, Dict]:
+    return {registry.name: registry.describe() for registry in registries}
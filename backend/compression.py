@@ -0,0 +1,121 @@
+"""Per-message compression policy.
+
+Frames below a size threshold are sent uncompressed (RSV1 unset, allowed
+per message by RFC 7692), larger ones are deflated with the configured
+window and memory level. Bytes saved and time spent compressing are
+counted per message type, the type is set by the Connection right before
+it sends a message.
+"""
+
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict
+
+from websockets import frames
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+
+DEFAULT_THRESHOLD = 256
+# 8 KB window keeps a few previous status frames as dictionary,
+# about 48 KB of zlib state per connection
+DEFAULT_WINDOW_BITS = 13
+DEFAULT_MEM_LEVEL = 6
+
+
+@dataclass
+class KindStats:
+    messages: int = 0
+    compressed: int = 0
+    raw_bytes: int = 0
+    sent_bytes: int = 0
+    cpu: float = 0.0
+
+    def describe(self):
+        return {
+            "messages": self.messages,
+            "compressed": self.compressed,
+            "raw_bytes": self.raw_bytes,
+            "saved_bytes": self.raw_bytes - self.sent_bytes,
+            "cpu_ms": round(self.cpu * 1000, 3),
+        }
+
+
+@dataclass
+class CompressionStats:
+    kinds: Dict[str, KindStats] = field(default_factory=lambda: defaultdict(KindStats))
+
+    def record(self, kind, raw, sent, cpu=0.0, compressed=False):
+        stats = self.kinds[kind]
+        stats.messages += 1
+        stats.raw_bytes += raw
+        stats.sent_bytes += sent
+        stats.cpu += cpu
+        if compressed:
+            stats.compressed += 1
+
+    def describe(self):
+        return {kind: stats.describe() for kind, stats in sorted(self.kinds.items())}
+
+
+@dataclass
+class CompressionPolicy:
+    threshold: int = DEFAULT_THRESHOLD
+    window_bits: int = DEFAULT_WINDOW_BITS
+    mem_level: int = DEFAULT_MEM_LEVEL
+    stats: CompressionStats = field(default_factory=CompressionStats)
+
+
+class PolicyPerMessageDeflate(PerMessageDeflate):
+    def __init__(self, policy: CompressionPolicy, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.policy = policy
+        self.kind = "other"
+        self.skipping = False
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        kind = self.kind
+        size = len(frame.data)
+        if frame.opcode is not frames.OP_CONT:
+            self.kind = "other"
+            self.skipping = size < self.policy.threshold
+        if self.skipping:
+            self.policy.stats.record(kind, size, size)
+            return frame
+        start = time.perf_counter()
+        encoded = super().encode(frame)
+        self.policy.stats.record(kind, size, len(encoded.data), time.perf_counter() - start, compressed=True)
+        return encoded
+
+
+class PolicyDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, policy: CompressionPolicy):
+        super().__init__(
+            server_max_window_bits=policy.window_bits,
+            client_max_window_bits=policy.window_bits,
+            compress_settings={"memLevel": policy.mem_level},
+        )
+        self.policy = policy
+
+    def process_request_params(self, params, accepted_extensions):
+        response, extension = super().process_request_params(params, accepted_extensions)
+        return response, PolicyPerMessageDeflate(
+            self.policy,
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+        )
+
+
+def find_deflate(websocket):
+    """Policy extension negotiated for the connection, if any"""
+    for extension in getattr(websocket, "extensions", []):
+        if isinstance(extension, PolicyPerMessageDeflate):
+            return extension
+    return None
@@ -0,0 +1,195 @@
+"""Connection of one client, messages are encoded with the negotiated codec."""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from websockets.exceptions import ConnectionClosed
+
+from codec import codec_for
+from compression import find_deflate
+
+
+def message_kind(obj) -> str:
+    """Message type used in statistics, e.g. "game.status" """
+    kind = obj.get("type", "other")
+    data = obj.get("data")
+    if isinstance(data, dict) and "type" in data:
+        return f"{kind}.{data['type']}"
+    return kind
+
+
+class Connection:
+    __slots__ = ("websocket", "codec", "deflate", "pending", "buckets")
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.codec = codec_for(websocket.subprotocol)
+        self.deflate = find_deflate(websocket)
+        # frames held back while batching, see batched()
+        self.pending = None
+        # inbound rate limits, created with the first command, see ratelimit.RateLimits
+        self.buckets = None
+
+    @property
+    def remote_address(self):
+        return self.websocket.remote_address
+
+    async def open(self):
+        hello = self.codec.hello()
+        if hello is not None:
+            await self.send_frame(hello, "codec")
+
+    async def send(self, message, kind="text"):
+        """Send a message that is already serialized as JSON, or spliced
+        from serialized fragments"""
+        await self.send_frame(self.codec.from_json(message), kind)
+
+    async def send_json(self, obj):
+        await self.send_frame(self.codec.dumps(obj), message_kind(obj))
+
+    async def send_frame(self, frame, kind="other"):
+        """Send a frame encoded by this connection's codec, see broadcast_json"""
+        if self.pending is not None:
+            self.pending.append((frame, kind))
+            return
+        await self.write_frame(frame, kind)
+
+    async def write_frame(self, frame, kind):
+        if self.deflate is not None:
+            # read by the extension when the frame is written, which
+            # happens before send yields to other tasks
+            self.deflate.kind = kind
+        try:
+            await self.websocket.send(frame)
+        except ConnectionClosed:
+            # the receive loop of this connection ends and releases it, a dead
+            # member must not break broadcasts to the others
+            pass
+
+    def hold(self) -> bool:
+        """Start collecting outgoing frames, False if already collecting"""
+        if self.pending is not None:
+            return False
+        self.pending = []
+        return True
+
+    async def release(self):
+        """Send the collected frames, several of them as one batch frame"""
+        pending, self.pending = self.pending, None
+        if not pending:
+            return
+        if len(pending) == 1:
+            await self.write_frame(*pending[0])
+        else:
+            await self.write_frame(self.codec.batch([frame for frame, _ in pending]), "batch")
+
+    def decode(self, message):
+        return self.codec.loads(message)
+
+    def __aiter__(self):
+        return self.websocket.__aiter__()
+
+    def __repr__(self):
+        return f"Connection({self.remote_address}, {self.codec.name})"
+
+
+class RoomChannel:
+    """Membership of a session in a room it subscribed to, besides the
+    room it has entered. Rooms and engines use it like a session, every
+    message sent through it is tagged with the room name"""
+
+    __slots__ = ("connection", "room", "tag", "uid", "seat")
+
+    def __init__(self, connection: Connection, room):
+        self.connection = connection
+        self.room = room
+        self.tag = connection.codec.tag("room", room.name)
+        # identity and seat in this room, see session.Session
+        self.uid = None
+        self.seat = -1
+
+    @property
+    def codec(self):
+        return self.connection.codec
+
+    @property
+    def info(self):
+        return self.connection.info
+
+    @property
+    def remote_address(self):
+        return self.connection.remote_address
+
+    async def send(self, message, kind="text"):
+        await self.send_frame(self.codec.from_json(message), kind)
+
+    async def send_json(self, obj):
+        await self.send_frame(self.codec.dumps(obj), message_kind(obj))
+
+    async def send_frame(self, frame, kind="other"):
+        await self.connection.send_frame(self.codec.tagged(frame, self.tag), kind)
+
+    def hold(self) -> bool:
+        return self.connection.hold()
+
+    async def release(self):
+        await self.connection.release()
+
+    def __repr__(self):
+        return f"RoomChannel({self.remote_address}, {self.room.name})"
+
+
+async def broadcast_json(connections, obj):
+    """Send obj to every connection, encoding it once per codec"""
+    kind = message_kind(obj)
+    frames = {}
+    sends = []
+    for connection in connections:
+        codec = connection.codec
+        frame = frames.get(codec.name)
+        if frame is None:
+            frame = frames[codec.name] = codec.dumps(obj)
+        sends.append(connection.send_frame(frame, kind))
+    await asyncio.gather(*sends)
+
+
+async def broadcast_batch(connections, objs):
+    """Send several messages to every connection as one batch frame,
+    encoding them once per codec"""
+    if len(objs) == 1:
+        await broadcast_json(connections, objs[0])
+        return
+    frames = {}
+    sends = []
+    for connection in connections:
+        codec = connection.codec
+        frame = frames.get(codec.name)
+        if frame is None:
+            frame = frames[codec.name] = codec.batch([codec.dumps(obj) for obj in objs])
+        sends.append(connection.send_frame(frame, "batch"))
+    await asyncio.gather(*sends)
+
+
+async def broadcast_text(connections, message, kind="text"):
+    """Send a message serialized as JSON, or spliced, to every connection,
+    converting it once per codec"""
+    frames = {}
+    sends = []
+    for connection in connections:
+        codec = connection.codec
+        frame = frames.get(codec.name)
+        if frame is None:
+            frame = frames[codec.name] = codec.from_json(message)
+        sends.append(connection.send_frame(frame, kind))
+    await asyncio.gather(*sends)
+
+
+@asynccontextmanager
+async def batched(connections):
+    """Everything sent to the connections inside the block goes out as a
+    single frame per connection when the block exits"""
+    held = [connection for connection in connections if connection.hold()]
+    try:
+        yield
+    finally:
+        await asyncio.gather(*(connection.release() for connection in held))
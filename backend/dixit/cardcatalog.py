@@ -0,0 +1,95 @@
+"""Process-wide catalog of Dixit cards.
+
+Every card file gets a small integer id, rooms keep only ids: decks are
+arrays of ids, hands are short lists of ids. File names are needed only
+when a view is sent to a client.
+
+Card URLs carry a content hash of the file the static handler serves, the
+hashes are computed once at startup in a worker thread.
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+from array import array
+from functools import lru_cache
+from typing import List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import list_files_sync
+
+from .error import UserCommandError
+
+PUBLIC_PATH = "../multigamews-frontend/public/"
+# served by the static handler
+SERVED_PATH = "../multigamews-frontend/dist_prebuild/"
+DATA_PATH = "dixit_cards/"
+
+# holder of a card that is in the deck or out of the game
+NOBODY = -1
+# holder of a card that lies on the table
+TABLE = -2
+
+
+class CardCatalog:
+    def __init__(self, names, path=SERVED_PATH + DATA_PATH):
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.path = path
+        # content hashes, None until load_versions or for missing files
+        self.versions: List[Optional[str]] = [None] * len(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, name) -> int:
+        card = self.ids.get(name)
+        if card is None:
+            raise UserCommandError(f"Unknown card {name}", "missing card")
+        return card
+
+    def name_of(self, card: int) -> str:
+        return self.names[card]
+
+    def names_of(self, cards):
+        return [self.names[card] for card in cards]
+
+    def hash_files(self) -> List[Optional[str]]:
+        versions = []
+        for name in self.names:
+            try:
+                with open(os.path.join(self.path, name), "rb") as file:
+                    versions.append(hashlib.sha1(file.read()).hexdigest()[:10])
+            except OSError:
+                versions.append(None)
+        return versions
+
+    async def load_versions(self):
+        """Hash the served card files, off the event loop"""
+        self.versions = await asyncio.to_thread(self.hash_files)
+
+    def url_of(self, card: int) -> str:
+        """Versioned URL, safe to cache forever, unversioned when the hash
+        is not known"""
+        version = self.versions[card]
+        if version is None:
+            return f"{DATA_PATH}{self.names[card]}"
+        return f"{DATA_PATH}{self.names[card]}?v={version}"
+
+    def new_deck(self) -> array:
+        return array("H", range(len(self.names)))
+
+    def new_holders(self) -> array:
+        """Who holds each card, indexed by card id"""
+        return array("b", [NOBODY]) * len(self.names)
+
+
+@lru_cache(maxsize=None)
+def get_catalog() -> CardCatalog:
+    names = sorted(
+        os.path.basename(file_path)
+        for file_path in list_files_sync(PUBLIC_PATH + DATA_PATH)
+    )
+    return CardCatalog(names)
@@ -7,13 +7,12 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import math
 import pprint
-from typing import List, Optional
-from pydantic import BaseModel
-from utils import *
+from array import array
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
 import random
 
-PUBLIC_PATH = "../multigamews-frontend/public/"
-DATA_PATH = "dixit_cards/"
+from .cardcatalog import NOBODY, TABLE, get_catalog
 
 CARDS_ON_HANDS = 5
 PHASE_INITIAL = "initial"
@@ -31,9 +30,10 @@ class DixitResult(BaseModel):
 class DixitPlayer(BaseModel):
     seat: int
     pts: int
-    cards: List[str]
+    # card ids, see CardCatalog
+    cards: List[int]
     acted: bool
-    guess: Optional[str]
+    guess: Optional[int]
 
     def reset_acted_state(self):
         self.acted = False
@@ -45,24 +45,27 @@ class DixitPlayer(BaseModel):
     def set_acted(self):
         self.acted = True
 
-    def pick_some_cards(self, deck, count):
-        n = min(count, len(deck))
-        self.cards.extend(deck[:n])
-        del deck[:n]
+    def pick_some_cards(self, deck: array, count, holders: array):
+        """Draw from the end of the deck"""
+        for _ in range(min(count, len(deck))):
+            card = deck.pop()
+            holders[card] = self.seat
+            self.cards.append(card)
 
-    def take_chosen_card(self, chosen: str, original: bool):
-        if not chosen in self.cards:
+    def take_chosen_card(self, chosen: int, original: bool, holders: array):
+        if holders[chosen] != self.seat:
             raise UserCommandError(
                 f"Card {chosen} is not found in user {self.model_dump()}",
                 "missing card",
             )
         self.cards.remove(chosen)
+        holders[chosen] = TABLE
         self.acted = True
         return card_handle(chosen, self.seat, original)
 
 
 class TableCardHandle(BaseModel):
-    card: str
+    card: int
     author: int
     original: bool
     votes: List[int] = []
@@ -72,20 +75,31 @@ def card_handle(card, author, original):
     return TableCardHandle(card=card, author=author, original=original)
 
 
-def find_first_by_predicate(predicate, iterable):
-    for item in iterable:
-        if predicate(item):
-            return item
-    raise ValueError("No item found in the iterable that satisfies the predicate.")
-
-
 class DixitGameState(BaseModel):
     status: str
     players: List[Optional[DixitPlayer]]
     current_player: int
     table: List[TableCardHandle]
     last_round_result: Optional[DixitResult]
-    deck: List[str]
+    # card ids, the next card to draw is the last one
+    deck: array
+    # seat holding each card, NOBODY or TABLE, indexed by card id
+    holders: array
+    # table cards by card id
+    table_by_card: Dict[int, TableCardHandle] = Field(default={}, exclude=True)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def put_on_table(self, handle: TableCardHandle):
+        self.table.append(handle)
+        self.table_by_card[handle.card] = handle
+
+    def clear_table(self):
+        for handle in self.table:
+            self.holders[handle.card] = NOBODY
+        self.table.clear()
+        self.table_by_card.clear()
 
     def move_to_next_available_player(self):
         self.current_player += 1
@@ -99,9 +113,21 @@ class DixitGameState(BaseModel):
             if player != None:
                 if len(player.cards) < CARDS_ON_HANDS:
                     player.pick_some_cards(
-                        self.deck, CARDS_ON_HANDS - len(player.cards)
+                        self.deck, CARDS_ON_HANDS - len(player.cards), self.holders
                     )
 
+    def upcoming_cards(self) -> Dict[int, List[int]]:
+        """Cards each seat will draw at the next start_phase_1,
+        follows the order of give_cards_to_everyone"""
+        upcoming = {}
+        position = len(self.deck)
+        for player in self.players:
+            if player != None and len(player.cards) < CARDS_ON_HANDS:
+                n = min(CARDS_ON_HANDS - len(player.cards), position)
+                upcoming[player.seat] = [self.deck[position - 1 - i] for i in range(n)]
+                position -= n
+        return upcoming
+
     def reset_users_acted(self):
         for player in self.players:
             if player != None:
@@ -114,7 +140,7 @@ class DixitGameState(BaseModel):
 
     def phase_1_to_2(self, seat, chosen):
         print("Phase 1 to 2")
-        self.table.append(self.players[seat].take_chosen_card(chosen, True))
+        self.put_on_table(self.players[seat].take_chosen_card(chosen, True, self.holders))
         self.status = PHASE2
         self.reset_users_acted()
         self.players[seat].set_acted()
@@ -127,14 +153,14 @@ class DixitGameState(BaseModel):
 
     def are_all_users_guessed(self):
         for player in self.players:
-            if player != None and (not player.guess) and (player.seat != self.current_player):
+            if player != None and player.guess is None and (player.seat != self.current_player):
                 print(f"Waiting for player {player.model_dump()}")
                 return False
         return True
 
     def start_phase_1(self):
         self.reset_users_acted()
-        self.table.clear()
+        self.clear_table()
         self.move_to_next_available_player()
         self.give_cards_to_everyone()
         self.status = PHASE1
@@ -145,11 +171,13 @@ class DixitGameState(BaseModel):
         self.status = PHASE3
 
     def phase_2_act(self, seat, chosen):
-        self.table.append(self.players[seat].take_chosen_card(chosen, False))
+        self.put_on_table(self.players[seat].take_chosen_card(chosen, False, self.holders))
         if self.are_all_users_acted():
             self.start_phase_3()
 
     def phase_3_act(self, seat, chosen):
+        if chosen not in self.table_by_card:
+            raise UserCommandError(f"Card {chosen} is not on the table", "missing card")
         player: DixitPlayer = self.players[seat]
         player.guess = chosen
         if self.are_all_users_guessed():
@@ -160,7 +188,7 @@ class DixitGameState(BaseModel):
         self.last_round_result = DixitResult(players_guessed_correctly=[], players_guessed_incorrectly=[])
         for user in [user for user in self.players if user != None and user.seat != self.current_player]:
             guess = user.guess
-            card = find_first_by_predicate(lambda x: x.card == guess, self.table)
+            card = self.table_by_card[guess]
             card.votes.append(user.seat)
             if card.original:
                 print(f"User {user.seat} guessed right")
@@ -181,18 +209,16 @@ class DixitAction(BaseModel):
 
 
 def init_dixit_game_state(max_players: int):
+    catalog = get_catalog()
     state = DixitGameState(
         status=PHASE_INITIAL,
         players=[None] * max_players,
         table=[],
         last_round_result=None,
-        deck=[],
+        deck=catalog.new_deck(),
+        holders=catalog.new_holders(),
         current_player=0,
     )
-    state.deck = [
-        os.path.basename(file_path)
-        for file_path in list_files_sync(PUBLIC_PATH + DATA_PATH)
-    ]
     random.shuffle(state.deck)
     return state
 
@@ -211,21 +237,22 @@ def process_user_action(state: DixitGameState, action: DixitAction):
     print(f"User action: {action}")
     if state.players[action.seat] == None:
         raise UserCommandError(f"User {action.seat} does not exist", "wrong user")
+    chosen = get_catalog().id_of(action.chosen)
     if state.status == PHASE1:
         if state.current_player != action.seat:
             raise UserCommandError(
                 f"Action {action.model_dump()} is not allowed for this user in phase 1",
                 "wrong user",
             )
-        state.phase_1_to_2(action.seat, action.chosen)
+        state.phase_1_to_2(action.seat, chosen)
     elif state.status == PHASE2:
         if state.players[action.seat].acted:
             raise UserCommandError(f"User {action.seat} already acted", "wrong user")
-        state.phase_2_act(action.seat, action.chosen)
+        state.phase_2_act(action.seat, chosen)
     elif state.status == PHASE3:
-        if state.players[action.seat].guess:
+        if state.players[action.seat].guess is not None:
             raise UserCommandError(f"User {action.seat} already guessed", "wrong user")
-        state.phase_3_act(action.seat, action.chosen)
+        state.phase_3_act(action.seat, chosen)
     else:
         raise UserCommandError(f"Unnown phase of the game", "wrong phase")
 
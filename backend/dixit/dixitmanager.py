@@ -1,14 +1,18 @@
 import asyncio
-from dataclasses import asdict
 import json
 import logging
-from typing import List, Optional
+from typing import Annotated, Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field, validator
 
+from dixit.cardcatalog import get_catalog
+from dixit.dixitprojection import project_personal, public_json, status_frame
 from dixit.error import UserCommandError
 import utils
 from dixit.dixitgame import (
+    PHASE1,
+    PHASE2,
+    PHASE3,
     PHASE_INITIAL,
     PHASE_RESULTS,
     DixitAction,
@@ -17,13 +21,19 @@ from dixit.dixitgame import (
     process_user_action,
     start,
 )
-from game_engine import GameEngine, UserInfo
+from commands import CommandRegistry
+from fragments import FragmentCache, TrackedModel
+from game_engine import SeatedGameEngine, UserInfo
 
 
 logger = logging.getLogger(__name__)
 
+SEATS = 10
 
-class Seat(BaseModel):
+SeatIndex = Annotated[int, Field(ge=0, lt=SEATS)]
+
+
+class Seat(TrackedModel):
     websocket_uid: str
     info: UserInfo
 
@@ -43,65 +53,34 @@ class DixitGameSetup(BaseModel):
     playing: DixitGameState = None
 
 
-class DixitGameStatusPersonal(BaseModel):
-    websocket_uid: str
-    seat: int
-
-
-class DixitGameStatusMessageData(BaseModel):
-    type: str = Field(default="status", alias="type")
-    status: DixitGameSetup
-    personal: Optional[DixitGameStatusPersonal]
-
-    class Config:
-        allow_population_by_field_name = True
-
-
-class DixitGameStatusMessage(BaseModel):
-    type: str = Field(default="game", alias="type")
-    data: DixitGameStatusMessageData
-
-    class Config:
-        allow_population_by_field_name = True
-
-
 def create_new_setup():
-    setup_data = {"seats": [None] * 10, "playing": init_dixit_game_state(10)}
+    setup_data = {"seats": [None] * SEATS, "playing": init_dixit_game_state(SEATS)}
     setup = DixitGameSetup(**setup_data)
     return setup
 
 
-class DixitGameEngine(GameEngine):
-    def __init__(self):
+class DixitGameEngine(SeatedGameEngine):
+    commands = CommandRegistry("dixit", include=SeatedGameEngine.commands)
+
+    def __init__(self, tick_interval=None, spectators=None, chat_window=None):
+        super().__init__(tick_interval, spectators, chat_window)
         self.state = create_new_setup()
-        self.websocket_uid_mapping = {}
+        self.fragments = FragmentCache()
 
     def game_name(self):
         return "dixit"
 
-    def userinfo_to_dict(self, userinfo):
-        if userinfo is None:
-            return None
-        return asdict(userinfo)
-
-    async def broadcast_room_state(self, room):
-        # logger.info(
-        #     f"Sending DIXIT update to {room.users} users: {self.state.model_dump()}"
-        # )
-        state_json = DixitGameStatusMessage(
-            **{
-                "type": "game",
-                "data": {"type": "status", "personal": None, "status": self.state},
-            }
-        ).model_dump_json()
-
-        for user in room.users:
-            await self.send_status(user)
+    async def send_room_state(self, room):
+        # public part is the same for everybody, serialize it once
+        public = self.public_json()
+        for user in self.players_of(room):
+            await self.send_status(user, public)
+        await self.spectator_feed.publish(room)
 
     def get_personal_status(self, websocket):
         seat = self.user_index_by_websocket(websocket)
         websocket_uid = self.get_websocket_uid_mapping(websocket)
-        return {"seat": seat, "websocket_uid": websocket_uid, "expected_actions": []}
+        return project_personal(self.state, seat, websocket_uid)
 
     async def game_start(self, room, websocket):
         """Handle game start command"""
@@ -114,7 +93,7 @@ class DixitGameEngine(GameEngine):
                     "message": f"Cannot start game that is in {self.state.playing.status} state",
                 },
             }
-            await websocket.send(json.dumps(error))
+            await websocket.send_json(error)
             return
         self.state.playing = start(self.state.playing, self.state.seats)
         await self.broadcast_room_state(room)
@@ -130,6 +109,8 @@ class DixitGameEngine(GameEngine):
             process_user_action(self.state.playing, action)
             await self.broadcast_room_state(room)
             if self.state.playing.status == PHASE_RESULTS:
+                # let clients load the next cards while they look at the results
+                await self.send_prefetch_hints(room)
                 # we are in victory state, we have to run next round after pause
                 await asyncio.sleep(self.state.windelay)
                 self.state.playing.start_phase_1()
@@ -139,50 +120,65 @@ class DixitGameEngine(GameEngine):
                 "type": "game",
                 "data": {"type": "error", "error": err.error_type, "message": f"{err}"},
             }
-            await websocket.send(json.dumps(error))
+            await websocket.send_json(error)
 
-    async def send_status(self, websocket):
-        """Send status message to specific recipient"""
-        state_share = self.state
-        state_json = DixitGameStatusMessage(
-            **{
-                "type": "game",
-                "data": {
-                    "type": "status",
-                    "personal": self.get_personal_status(websocket),
-                    "status": state_share,
-                },
-            }
-        ).model_dump_json()
-        await websocket.send(state_json)
+    async def send_prefetch_hints(self, room):
+        upcoming = self.state.playing.upcoming_cards()
+        catalog = get_catalog()
+        for user in room.users:
+            seat = self.user_index_by_websocket(user)
+            if seat not in upcoming:
+                continue
+            cards = [
+                {"card": catalog.name_of(card), "url": catalog.url_of(card)}
+                for card in upcoming[seat]
+            ]
+            await user.send_json({"type": "game", "data": {"type": "prefetch", "cards": cards}})
+
+    def public_json(self):
+        return public_json(self.state, self.fragments, self.state_version)
+
+    def spectator_json(self):
+        return status_frame(self.public_json(), project_personal(self.state, -1, None))
+
+    async def send_status(self, websocket, public=None):
+        """Send public view and recipient's own hand to specific recipient"""
+        if self.user_index_by_websocket(websocket) < 0:
+            await self.spectator_feed.send_to(websocket)
+            return
+        if public is None:
+            public = self.public_json()
+        await websocket.send(status_frame(public, self.get_personal_status(websocket)), kind="game.status")
 
     async def get_status(self, websocket, userinfo: UserInfo):
         logger.info(f"User {userinfo.name} requested poker game status, sending...")
         await self.send_status(websocket)
 
-    def get_websocket_uid_mapping(self, websocket):
-        """Mapping between non-serializable websocket objects
-        and serializable simplified UIDs that consist of 16
-        alphanumeric characters"""
-        if websocket in self.websocket_uid_mapping:
-            return self.websocket_uid_mapping[websocket]
-        genereated = utils.generate_random_string(16)
-        self.websocket_uid_mapping[websocket] = genereated
-        return genereated
-
-    def user_index_by_websocket(self, websocket):
-        """Get user seat, return -1 if the user has no seat"""
-        uid = self.get_websocket_uid_mapping(websocket)
-        for i, seat in enumerate(self.state.seats):
-            if seat and seat.websocket_uid == uid:
-                return i
-        return -1
-
-    async def user_list_changed(self, room, added, removed):
-        for user in removed:
-            undex = self.user_index_by_websocket(user)
-            if undex >= 0:
-                self.state.seats[undex] = None
+    @property
+    def seats(self):
+        return self.state.seats
+
+    def in_game(self):
+        return self.state.playing.status != PHASE_INITIAL
+
+    def awaited_seats(self):
+        """Seats the current phase waits for"""
+        playing = self.state.playing
+        players = [player for player in playing.players if player is not None]
+        if playing.status == PHASE1:
+            return [playing.current_player]
+        if playing.status == PHASE2:
+            return [player.seat for player in players if not player.acted]
+        if playing.status == PHASE3:
+            return [player.seat for player in players if player.guess is None and player.seat != playing.current_player]
+        return []
+
+    def stuck(self):
+        awaited = self.awaited_seats()
+        return bool(awaited) and not any(self.is_live(self.seats[i]) for i in awaited)
+
+    async def reset_game(self, room):
+        self.state.playing = init_dixit_game_state(SEATS)
         await self.broadcast_room_state(room)
 
     async def update_setup(self, updates, room):
@@ -193,54 +189,39 @@ class DixitGameEngine(GameEngine):
     async def take_seat(self, room, websocket, userinfo: UserInfo, seat_index):
         """Handle take seat command"""
         logger.info(f"User {userinfo.name} takes seat {seat_index}")
-        self.state.seats[seat_index] = Seat(
-            websocket_uid=self.get_websocket_uid_mapping(websocket),
-            info=self.userinfo_to_dict(userinfo),
-            ai=False,
+        self.set_seat(
+            seat_index,
+            Seat(
+                websocket_uid=self.get_websocket_uid_mapping(websocket),
+                info=self.userinfo_to_dict(userinfo),
+                ai=False,
+            ),
         )
         await self.broadcast_room_state(room)
 
-    async def handle_message(self, room, websocket, message, userinfo):
-        """Handle game message"""
-        if message.get("type") == "get_status":
-            await self.get_status(websocket, userinfo)
-        if message.get("type") == "action":
-            await self.game_player_command(
-                room,
-                websocket,
-                DixitAction.model_validate(message.get("data")),
-                self.user_index_by_websocket(websocket),
-            )
-        if message.get("type") == "start":
-            await self.game_start(room, websocket)
-        if message.get("type") == "change_options":
-            if self.state.stage != "setup":
-                await utils.send_error(
-                    websocket, "Cannot change options while not in setup state"
-                )
-            else:
-                await self.update_setup(message.get("data"), room)
-        if message.get("type") == "take_seat":
-            seat_to_take = message.get("data")
-            # free any seat if it was already taken by this user
-            taken = self.user_index_by_websocket(websocket)
-            if taken >= 0:
-                self.state.seats[taken] = None
-            await self.take_seat(room, websocket, userinfo, seat_to_take)
-
-        if message.get("type") == "chat":
-            text = message.get("text")
-            if text:
-                for user in room.users:
-                    await user.send(
-                        json.dumps(
-                            {
-                                "type": "game",
-                                "data": {
-                                    "type": "chat",
-                                    "sender": self.userinfo_to_dict(userinfo),
-                                    "text": f"{text}",
-                                },
-                            }
-                        )
-                    )
+    # commands
+
+    @commands.handler("get_status")
+    async def handle_get_status(self, room, websocket, userinfo, _):
+        await self.get_status(websocket, userinfo)
+
+    @commands.handler("action", DixitAction)
+    async def handle_action(self, room, websocket, userinfo, action):
+        await self.game_player_command(room, websocket, action, self.user_index_by_websocket(websocket))
+
+    @commands.handler("start")
+    async def handle_start(self, room, websocket, userinfo, _):
+        await self.game_start(room, websocket)
+
+    @commands.handler("change_options", Dict[str, Any])
+    async def handle_change_options(self, room, websocket, userinfo, options):
+        if self.state.stage != "setup":
+            await utils.send_error(websocket, "Cannot change options while not in setup state")
+        else:
+            await self.update_setup(options, room)
+
+    @commands.handler("take_seat", SeatIndex)
+    async def handle_take_seat(self, room, websocket, userinfo, seat_to_take):
+        # free any seat if it was already taken by this user
+        self.free_seat_of(websocket)
+        await self.take_seat(room, websocket, userinfo, seat_to_take)
@@ -0,0 +1,143 @@
+"""What Dixit clients are allowed to see.
+
+The public view is the same for everyone in the room and is serialized
+once per broadcast: scores, phase, table and vote tallies, the deck only
+as a count. The personal view carries the recipient's own hand.
+"""
+
+import json
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from dixit.cardcatalog import get_catalog
+from dixit.dixitgame import PHASE2, PHASE_RESULTS, DixitGameState, DixitResult
+from fragments import FragmentCache, SplicedObject, splice_object
+
+
+class DixitPublicPlayer(BaseModel):
+    seat: int
+    pts: int
+    acted: bool
+    guessed: bool
+    cards_count: int
+
+
+class DixitPublicCard(BaseModel):
+    card: str
+    # author, original flag and votes are revealed with the results
+    author: int = -1
+    original: bool = False
+    votes: List[int] = []
+
+
+class DixitPublicState(BaseModel):
+    status: str
+    players: List[Optional[DixitPublicPlayer]]
+    current_player: int
+    table: List[DixitPublicCard]
+    table_count: int
+    last_round_result: Optional[DixitResult]
+    deck_count: int
+
+
+class DixitPublicSetup(BaseModel):
+    seats: list
+    windelay: int
+    playing: Optional[DixitPublicState]
+
+
+class DixitGameStatusPersonal(BaseModel):
+    websocket_uid: str
+    seat: int
+    cards: List[str] = []
+    # card this player put on the table in the current round
+    played: Optional[str] = None
+    guess: Optional[str] = None
+
+
+# Projections are built from state that is already valid, the outbound
+# models are constructed without validation. Client input is validated
+# where it is parsed (DixitAction.model_validate).
+
+
+def project_state(state: DixitGameState) -> DixitPublicState:
+    names = get_catalog().names
+    if state.status == PHASE2:
+        # cards are face down until everybody has played
+        table = []
+    elif state.status == PHASE_RESULTS:
+        table = [
+            DixitPublicCard.model_construct(card=names[h.card], author=h.author, original=h.original, votes=h.votes)
+            for h in state.table
+        ]
+    else:
+        table = [DixitPublicCard.model_construct(card=names[h.card]) for h in state.table]
+    return DixitPublicState.model_construct(
+        status=state.status,
+        players=[
+            DixitPublicPlayer.model_construct(
+                seat=p.seat,
+                pts=p.pts,
+                acted=p.acted,
+                guessed=p.guess is not None,
+                cards_count=len(p.cards),
+            )
+            if p
+            else None
+            for p in state.players
+        ],
+        current_player=state.current_player,
+        table=table,
+        table_count=len(state.table),
+        last_round_result=state.last_round_result,
+        deck_count=len(state.deck),
+    )
+
+
+def project_public(setup) -> DixitPublicSetup:
+    return DixitPublicSetup.model_construct(
+        # connection ids of other players are nobody's business
+        seats=[seat.model_dump(exclude={"websocket_uid"}) if seat else None for seat in setup.seats],
+        windelay=setup.windelay,
+        playing=project_state(setup.playing) if setup.playing else None,
+    )
+
+
+def public_json(setup, fragments: FragmentCache, version) -> SplicedObject:
+    """Serialized project_public(setup), seats and game state are cached
+    separately: seats by identity, the game state by the given version"""
+    playing = setup.playing
+    return splice_object(
+        json.dumps({"windelay": setup.windelay}, separators=(",", ":")),
+        {
+            "seats": fragments.items(
+                "seats", setup.seats, lambda seat, _: seat.model_dump_json(exclude={"websocket_uid"})
+            ),
+            "playing": fragments.get(
+                "playing", playing, lambda: project_state(playing).model_dump_json(), version=version
+            ),
+        },
+    )
+
+
+def project_personal(setup, seat: int, websocket_uid: str) -> DixitGameStatusPersonal:
+    personal = DixitGameStatusPersonal.model_construct(websocket_uid=websocket_uid, seat=seat)
+    state = setup.playing
+    if seat < 0 or state is None or seat >= len(state.players) or state.players[seat] is None:
+        return personal
+    player = state.players[seat]
+    catalog = get_catalog()
+    personal.cards = catalog.names_of(player.cards)
+    if player.guess is not None:
+        personal.guess = catalog.name_of(player.guess)
+    played = next((h.card for h in state.table if h.author == seat), None)
+    if played is not None:
+        personal.played = catalog.name_of(played)
+    return personal
+
+
+def status_frame(public_json: SplicedObject, personal: DixitGameStatusPersonal) -> SplicedObject:
+    """Splice the shared public view and a personal view into one message"""
+    data = splice_object('{"type":"status"}', {"status": public_json, "personal": personal.model_dump_json()})
+    return splice_object('{"type":"game"}', {"data": data})
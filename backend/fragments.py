@@ -0,0 +1,144 @@
+"""Pre-serialized JSON fragments of game state.
+
+Status messages are assembled by splicing JSON strings of state sub-trees.
+A fragment is serialized again only when its sub-tree has changed: models
+derived from TrackedModel count attribute assignments in a version, list
+slots are compared by identity and version of the item they hold.
+
+Spliced values keep their parts and are joined to text when sent as
+JSON. Binary codecs encode them part by part instead, every fragment once
+per version, see codec.MsgpackCodec.from_json.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, PrivateAttr
+
+
+class TrackedModel(BaseModel):
+    """Model that knows when its own fields were assigned.
+
+    In-place changes of lists and dicts are not seen, replace the value or
+    call touch() after them. Nested models track themselves.
+    """
+
+    _version: int = PrivateAttr(default=0)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # going through pydantic private attribute handling is several times slower
+        self.__pydantic_private__["_version"] += 1
+
+    def touch(self):
+        self.__pydantic_private__["_version"] += 1
+
+    @property
+    def version(self) -> int:
+        return self.__pydantic_private__["_version"]
+
+
+class Fragment(str):
+    """Serialized JSON of a cached sub-tree, codecs keep their encoding of
+    it in `encoded` (codec name -> frame)"""
+
+    encoded: Optional[Dict[str, object]] = None
+
+
+class Spliced:
+    """Serialized JSON value made of serialized parts. The text is joined
+    when str() is first called on it, binary codecs encode the parts and
+    keep the result in `encoded` like for a Fragment"""
+
+    __slots__ = ("text", "encoded")
+
+    def __init__(self):
+        self.text = None
+        self.encoded = None
+
+    def __str__(self):
+        if self.text is None:
+            self.text = self.join()
+        return self.text
+
+    def join(self) -> str:
+        raise NotImplementedError
+
+
+class SplicedObject(Spliced):
+    __slots__ = ("head", "fields")
+
+    def __init__(self, head: str, fields: Dict[str, object]):
+        super().__init__()
+        self.head = head
+        self.fields = fields
+
+    def join(self):
+        tail = ",".join(f'"{name}":{value}' for name, value in self.fields.items())
+        head = str(self.head)
+        if head == "{}":
+            return "{" + tail + "}"
+        return head[:-1] + "," + tail + "}"
+
+
+class SplicedArray(Spliced):
+    __slots__ = ("items",)
+
+    def __init__(self, items: List[object]):
+        super().__init__()
+        self.items = items
+
+    def join(self):
+        return "[" + ",".join(map(str, self.items)) + "]"
+
+
+def splice_object(head_json, fields: Dict[str, object]):
+    """Add already serialized fields to a serialized JSON object"""
+    if not fields:
+        return head_json
+    return SplicedObject(head_json, fields)
+
+
+def splice_array(items: List[object]) -> SplicedArray:
+    """JSON array of already serialized items"""
+    return SplicedArray(items)
+
+
+class FragmentCache:
+    def __init__(self):
+        # (part, slot) -> (owner, version, {variant: json})
+        self.fragments: Dict[Tuple[str, int], Tuple[object, object, Dict[object, str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, part: str, owner, render: Callable[[], str], variant=None, slot=0, version=None) -> str:
+        """JSON of a sub-tree, rendered again when another object is in its
+        place or the object has changed. Untracked owners pass a version"""
+        if owner is None:
+            return "null"
+        if version is None and isinstance(owner, TrackedModel):
+            version = owner.version
+        cached = self.fragments.get((part, slot))
+        if cached is None or cached[0] is not owner or cached[1] != version:
+            cached = (owner, version, {})
+            self.fragments[(part, slot)] = cached
+        variants = cached[2]
+        value = variants.get(variant)
+        if value is None:
+            self.misses += 1
+            value = variants[variant] = Fragment(render())
+        else:
+            self.hits += 1
+        return value
+
+    def items(self, part: str, items: List, render: Callable[[object, object], str], variant_of: Optional[Callable[[int, object], object]] = None) -> str:
+        """JSON array of a list, every slot is cached separately. Items are
+        compared by identity and version, they must be TrackedModel or
+        never change in place"""
+        parts = []
+        for i, item in enumerate(items):
+            variant = variant_of(i, item) if variant_of and item is not None else None
+            parts.append(self.get(part, item, lambda item=item, variant=variant: render(item, variant), variant, slot=i))
+        return splice_array(parts)
+
+    def clear(self):
+        self.fragments.clear()
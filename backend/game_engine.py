@@ -1,39 +1,357 @@
-import json
+import asyncio
 import logging
+from collections import Counter
 from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+from chat_history import ChatHistoryQuery, default_chat_history
+from commands import CommandError, CommandRegistry
+from connection import broadcast_batch, broadcast_json, broadcast_text
+import utils
 
 # Set the default log level to "debug"
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(slots=True)
 class UserInfo:
     name: str
     gender: int = 0  # 0 for unknown, -1 for male, 1 for female
     avatar: str = ""
 
+
+class RoomTicker:
+    """Coalesces state broadcasts of one room, at most one per interval"""
+
+    def __init__(self, interval, flush):
+        self.interval = interval
+        self.flush = flush
+        self.dirty = False
+        self.task = None
+        self.flushes = 0
+        self.requests = 0
+
+    def request(self):
+        self.requests += 1
+        self.dirty = True
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        try:
+            while self.dirty:
+                # collect everything that changes during the window
+                await asyncio.sleep(self.interval)
+                self.dirty = False
+                self.flushes += 1
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Room tick failed: {e}")
+        finally:
+            self.task = None
+
+
+@dataclass
+class SpectatorPolicy:
+    # seconds between two updates of the spectator view, 0 sends every change
+    interval: float = 0.0
+    # seconds the spectator view lags behind the game
+    delay: float = 0.0
+
+
+class SpectatorFeed:
+    """Status shared by all members of a room who have no seat.
+
+    The view is serialized once per update and the same frame goes to every
+    spectator, at most once per policy.interval and policy.delay seconds
+    after it was taken.
+    """
+
+    def __init__(self, policy: SpectatorPolicy, render, audience):
+        self.policy = policy
+        # () -> status message as JSON
+        self.render = render
+        # room -> connections of the spectators
+        self.audience = audience
+        self.timer = None
+        self.last_push = 0.0
+        self.latest = None
+        self.tasks = set()
+        self.pushes = 0
+
+    async def publish(self, room):
+        """Schedule an update, changes until it is taken are coalesced"""
+        if self.timer is not None:
+            return
+        if not self.policy.interval and not self.policy.delay:
+            await self.push(room)
+            return
+        loop = asyncio.get_running_loop()
+        wait = max(0.0, self.last_push + self.policy.interval - loop.time())
+        self.timer = loop.call_later(wait, self.spawn, lambda: self.push(room))
+
+    async def push(self, room):
+        self.timer = None
+        loop = asyncio.get_running_loop()
+        self.last_push = loop.time()
+        self.pushes += 1
+        frame = self.render()
+        if self.policy.delay:
+            loop.call_later(self.policy.delay, self.spawn, lambda: self.send(room, frame))
+        else:
+            await self.send(room, frame)
+
+    async def send(self, room, frame):
+        self.latest = frame
+        await broadcast_text(self.audience(room), frame, "game.status")
+
+    async def send_to(self, websocket):
+        """Current view for one spectator, the last one sent if delayed.
+        Nothing before the first delayed view, the live one would give away
+        what the others see only later"""
+        if not self.policy.delay:
+            frame = self.render()
+        elif self.latest is not None:
+            frame = self.latest
+        else:
+            return
+        await websocket.send(frame, kind="game.status")
+
+    def spawn(self, make):
+        task = asyncio.create_task(self.guarded(make()))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def guarded(self, coro):
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"Spectator update failed: {e}")
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
 class GameEngine:
+    # commands of every game, subclasses include them in their own registry
+    commands = CommandRegistry("game")
+    chat_history = default_chat_history
+    # attributes shared between rooms, not counted in the memory of a room
+    shared = ("chat_history",)
+
+    def __init__(self, tick_interval=None, chat_window=None):
+        # seconds, None broadcasts every change immediately
+        self.tick_interval = tick_interval
+        self.ticker = None
+        # seconds, chat messages within the window are sent as one frame
+        self.chat_window = chat_window
+        self.chat_ticker = None
+        self.chat_outbox = []
+        # every change of the state is broadcast, so broadcasts count versions
+        self.state_version = 0
+
     async def handle_message(self, room, websocket, message, userinfo):
-        raise NotImplementedError("Subclasses must implement this method.")
+        """Dispatch game message to the handler registered for its type"""
+        try:
+            await self.commands.dispatch(self, message, room, websocket, userinfo)
+        except CommandError as err:
+            await websocket.send_json(
+                {"type": "game", "data": {"type": "error", "error": err.error_type, "message": f"{err}", **err.details}}
+            )
     
     def game_name(self):
         return None
+
+    def userinfo_to_dict(self, userinfo):
+        if userinfo is None:
+            return None
+        return asdict(userinfo)
     
     async def user_list_changed(self, room, added, removed):
         pass
 
+    async def broadcast_room_state(self, room):
+        """Send state to the room now, or with the next tick if ticks are enabled"""
+        self.state_version += 1
+        if not self.tick_interval:
+            await self.send_room_state(room)
+            return
+        if self.ticker is None:
+            self.ticker = RoomTicker(self.tick_interval, lambda: self.send_room_state(room))
+        self.ticker.request()
+
+    async def send_room_state(self, room):
+        pass
+
+    def reap_orphans(self, room) -> Dict[str, int]:
+        """Free state kept for members who are not in the room any more,
+        returns how many entries of each kind were freed"""
+        return {}
+
+    def stuck(self) -> bool:
+        """A game is running that nobody in the room can move on"""
+        return False
+
+    async def reset_game(self, room):
+        """Drop the running game, back to setup"""
+        pass
+
+    @commands.handler("chat", str, payload="text", default="")
+    async def handle_chat(self, room, websocket, userinfo, text):
+        if text:
+            message = self.chat_history.append(room.history_key, self.userinfo_to_dict(userinfo), text)
+            await self.send_chat(room, {"type": "game", "data": {"type": "chat", **message}})
+
+    async def send_chat(self, room, message):
+        """Broadcast a chat message now, or with the others of its window"""
+        if not self.chat_window:
+            await broadcast_json(room.users, message)
+            return
+        self.chat_outbox.append(message)
+        if self.chat_ticker is None:
+            self.chat_ticker = RoomTicker(self.chat_window, lambda: self.flush_chat(room))
+        self.chat_ticker.request()
+
+    async def flush_chat(self, room):
+        messages, self.chat_outbox = self.chat_outbox, []
+        if messages:
+            await broadcast_batch(room.users, messages)
+
+    @commands.handler("chat_history", Optional[ChatHistoryQuery])
+    async def handle_chat_history(self, room, websocket, userinfo, query):
+        query = query or ChatHistoryQuery()
+        messages, cursor = await self.chat_history.page(room.history_key, query.before, query.limit)
+        await websocket.send_json(
+            {"type": "game", "data": {"type": "chat_history", "cursor": cursor, "messages": messages}}
+        )
+
+class SeatedGameEngine(GameEngine):
+    """Game with seats taken by sessions.
+
+    Seats are addressed by serializable uids of sessions. A session knows
+    its uid and its seat, seats know the uid and uids are indexed to
+    sessions and seats, so lookups do not scan the seats. Seats must be
+    changed with set_seat() to keep both sides right.
+    """
+
+    def __init__(self, tick_interval=None, spectators: SpectatorPolicy = None, chat_window=None):
+        super().__init__(tick_interval, chat_window)
+        self.websocket_by_uid: Dict[str, Any] = {}
+        self.seat_by_uid: Dict[str, int] = {}
+        self.spectator_feed = SpectatorFeed(spectators or SpectatorPolicy(), self.spectator_json, self.spectators_of)
+
+    @property
+    def seats(self) -> list:
+        raise NotImplementedError("Subclasses must implement this property.")
+
+    def spectator_json(self):
+        """Status message for members without a seat, the same for all of
+        them, serialized as JSON or spliced"""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def players_of(self, room):
+        return [user for user in room.users if self.user_index_by_websocket(user) >= 0]
+
+    def spectators_of(self, room):
+        return [user for user in room.users if self.user_index_by_websocket(user) < 0]
+
+    def live_members_of(self, room):
+        """Members who may see the game as it happens"""
+        if self.spectator_feed.policy.delay:
+            return self.players_of(room)
+        return list(room.users)
+
+    def in_game(self) -> bool:
+        return False
+
+    def is_live(self, seat) -> bool:
+        """The seat is a bot or is held by a member of the room"""
+        return seat is not None and (getattr(seat, "ai", False) or seat.websocket_uid in self.websocket_by_uid)
+
+    def orphan_seats(self):
+        """Seats of people who left, freed only between games"""
+        if self.in_game():
+            return []
+        return [i for i, seat in enumerate(self.seats) if seat is not None and not self.is_live(seat)]
+
+    def reap_orphans(self, room):
+        freed = Counter()
+        for uid, websocket in list(self.websocket_by_uid.items()):
+            if websocket not in room.users:
+                del self.websocket_by_uid[uid]
+                freed["uids"] += 1
+        for uid, index in list(self.seat_by_uid.items()):
+            seat = self.seats[index]
+            if seat is None or seat.websocket_uid != uid:
+                del self.seat_by_uid[uid]
+                freed["seat_indexes"] += 1
+        for index in self.orphan_seats():
+            self.set_seat(index, None)
+            freed["seats"] += 1
+        return dict(freed)
+
+    def get_websocket_uid_mapping(self, websocket):
+        """Serializable UID of the session, 16 alphanumeric characters,
+        given on first use"""
+        uid = websocket.uid
+        if uid is None:
+            uid = websocket.uid = utils.generate_random_string(16)
+        if uid not in self.websocket_by_uid:
+            self.websocket_by_uid[uid] = websocket
+        return uid
+
+    def user_index_by_websocket(self, websocket):
+        """Get user seat, return -1 if the user has no seat"""
+        return websocket.seat
+
+    def seat_index_by_uid(self, websocket_uid):
+        return self.seat_by_uid.get(websocket_uid, -1)
+
+    def websocket_by_seat(self, index):
+        """Connection sitting at the seat, None for empty seats and bots"""
+        seat = self.seats[index]
+        if seat is None:
+            return None
+        return self.websocket_by_uid.get(seat.websocket_uid)
+
+    def set_seat(self, index, seat):
+        seats = self.seats
+        previous = seats[index]
+        if previous is not None and self.seat_by_uid.get(previous.websocket_uid) == index:
+            del self.seat_by_uid[previous.websocket_uid]
+            if (websocket := self.websocket_by_uid.get(previous.websocket_uid)) is not None:
+                websocket.seat = -1
+        seats[index] = seat
+        if seat is not None:
+            self.seat_by_uid[seat.websocket_uid] = index
+            if (websocket := self.websocket_by_uid.get(seat.websocket_uid)) is not None:
+                websocket.seat = index
+
+    def free_seat_of(self, websocket):
+        """Free the seat of this user, returns its index or -1"""
+        index = self.user_index_by_websocket(websocket)
+        if index >= 0:
+            self.set_seat(index, None)
+        return index
+
+    def forget(self, websocket):
+        """Drop the session from the indexes, its seat must be freed before"""
+        if websocket.uid is not None:
+            self.websocket_by_uid.pop(websocket.uid, None)
+        websocket.seat = -1
+
+    async def user_list_changed(self, room, added, removed):
+        for user in removed:
+            self.free_seat_of(user)
+            self.forget(user)
+        await self.broadcast_room_state(room)
+
+
 class ChatGameEngine(GameEngine):
+    commands = CommandRegistry("chat", include=GameEngine.commands)
+
     def game_name(self):
         return "chat"
-    
-    def userinfo_to_dict(self, userinfo):
-        if userinfo is None:
-            return None
-        return asdict(userinfo)
-     
-    async def handle_message(self, room, websocket, message, userinfo):
-        if message.get('type') == 'chat':
-            text = message.get('text')
-            if text:
-                for user in room.users:
-                    await user.send(json.dumps({"type": "game", "data": {"type": "chat", "sender": self.userinfo_to_dict(userinfo), "text": f"{text}"}}))
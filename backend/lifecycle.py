@@ -0,0 +1,146 @@
+"""Connection lifecycle.
+
+Dead peers are found by websocket keepalive: a ping every `ping_interval`
+seconds, a connection whose pong is later than `ping_timeout` is closed.
+The websocket library ends the receive loop of a failed connection only
+after `close_timeout`, the reaper releases sessions of connections that
+are not open any more on its next scan.
+Live but idle clients are closed after a timeout that depends on what the
+session holds: nothing (lobby), a seat, or only membership of rooms
+(spectating). Idle means no inbound message, pongs do not count.
+
+A session is released exactly once, by the first of: the receive loop
+ending, the reaper finding its connection closing, or the idle timeout.
+Releasing marks the session released, messages still queued on its
+connection are dropped, and runs the cleanup hooks right away, so seats
+and engine state are freed without waiting for the closing handshake
+with a peer that may never answer.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Set
+
+logger = logging.getLogger(__name__)
+
+CleanupHook = Callable[[object], Awaitable[None]]
+
+# close code sent to clients closed by the idle reaper
+IDLE_CLOSE_CODE = 4000
+
+
+@dataclass
+class LifecyclePolicy:
+    # seconds between keepalive pings and to wait for the pong, None disables pings
+    ping_interval: float = 10.0
+    ping_timeout: float = 10.0
+    # seconds to wait for the closing handshake
+    close_timeout: float = 2.0
+    # seconds without an inbound message, 0 for no limit
+    lobby_idle: float = 1800.0
+    seated_idle: float = 600.0
+    spectating_idle: float = 3600.0
+    # seconds between idle scans
+    check_interval: float = 2.0
+
+    def idle_timeout(self, state) -> float:
+        return getattr(self, f"{state}_idle")
+
+
+def session_state(session) -> str:
+    """"seated" with a seat in any room, "spectating" in rooms without a
+    seat, "lobby" in no room"""
+    channels = session.watched().values()
+    if session.seat >= 0 or any(channel.seat >= 0 for channel in channels):
+        return "seated"
+    if session.room is not None or channels:
+        return "spectating"
+    return "lobby"
+
+
+def disconnect_reason(websocket) -> str:
+    """Why the receive loop of a websocket ended"""
+    if websocket.close_sent is not None and websocket.close_sent.reason == "keepalive ping timeout":
+        return "ping_timeout"
+    if websocket.close_rcvd is None:
+        return "dropped"
+    return "closed"
+
+
+class Lifecycle:
+    def __init__(self, policy: LifecyclePolicy = None):
+        self.policy = policy or LifecyclePolicy()
+        # open sessions, released ones are removed before their hooks run
+        self.sessions: Set = set()
+        self.hooks: List[CleanupHook] = []
+        # releases by reason: closed, dropped, ping_timeout, idle_lobby, ...
+        self.released = Counter()
+        self.closing: Set[asyncio.Task] = set()
+
+    def on_cleanup(self, hook: CleanupHook):
+        """Register a coroutine called with every released session, in
+        registration order"""
+        self.hooks.append(hook)
+        return hook
+
+    def opened(self, session):
+        session.last_seen = time.monotonic()
+        self.sessions.add(session)
+
+    @staticmethod
+    def touch(session):
+        session.last_seen = time.monotonic()
+
+    async def release(self, session, reason) -> bool:
+        """Run the cleanup hooks of the session, False if it was released before"""
+        if session not in self.sessions:
+            return False
+        self.sessions.remove(session)
+        session.released = True
+        self.released[reason] += 1
+        for hook in self.hooks:
+            try:
+                await hook(session)
+            except Exception as e:
+                logger.error(f"Cleanup of {session} failed in {hook.__qualname__}: {e}")
+        return True
+
+    async def reap(self, session, reason):
+        """Release the session now and close its websocket in the background"""
+        if not await self.release(session, reason):
+            return
+        logger.info(f"Reaped {session}: {reason}")
+        task = asyncio.create_task(session.websocket.close(IDLE_CLOSE_CODE, reason))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    def expired(self, now):
+        for session in self.sessions:
+            if not session.websocket.open:
+                yield session, disconnect_reason(session.websocket)
+                continue
+            state = session_state(session)
+            timeout = self.policy.idle_timeout(state)
+            if timeout and now - session.last_seen > timeout:
+                yield session, f"idle_{state}"
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.policy.check_interval)
+            for session, reason in list(self.expired(time.monotonic())):
+                if reason.startswith("idle_"):
+                    await self.reap(session, reason)
+                else:
+                    # already closing
+                    await self.release(session, reason)
+
+    def describe(self):
+        return {
+            "sessions": len(self.sessions),
+            "states": dict(Counter(map(session_state, self.sessions))),
+            "released": dict(self.released),
+            "closing": len(self.closing),
+        }
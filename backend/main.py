@@ -1,14 +1,35 @@
+import argparse
 import asyncio
+import functools
 import pathlib
 import random
-from typing import Dict, List, Optional
+import signal
+from typing import List, Literal, Optional, Set
+from dixit.cardcatalog import get_catalog
 from dixit.dixitmanager import DixitGameEngine
+from poker.hand_history import default_hand_history
 from poker.pokergame import PokerGameEngine
+from ratelimit import DEFAULT_LIMITS, RateLimits, parse_limit
+from reaper import Reaper, ReaperPolicy
 from room import Room, generate_user_info
+from session import Session
 import websockets
-import json
 import logging
-from game_engine import ChatGameEngine, GameEngine, UserInfo
+from admission import Admission, AdmissionPolicy, AdmissionServerProtocol
+from aiohttp_transport import upgrade_or, websocket_handler
+from chat_history import CHAT_DB_PATH, default_chat_history
+from codec import SUBPROTOCOLS
+from commands import WHOLE_MESSAGE, CommandError, CommandRegistry, describe_all
+from lifecycle import Lifecycle, LifecyclePolicy, disconnect_reason
+from compression import (
+    DEFAULT_MEM_LEVEL,
+    DEFAULT_THRESHOLD,
+    DEFAULT_WINDOW_BITS,
+    CompressionPolicy,
+    PolicyDeflateFactory,
+)
+from connection import RoomChannel
+from game_engine import ChatGameEngine, GameEngine, SpectatorPolicy, UserInfo
 from dataclasses import dataclass, asdict
 import utils
 import pprint
@@ -17,6 +38,12 @@ import traceback
 
 import aiohttp_cors
 from aiohttp import web
+from pydantic import BaseModel
+
+try:
+    import uvloop
+except ImportError:  # optional
+    uvloop = None
 
 PUBLIC_PATH = "../multigamews-frontend/public/"
 AVATAR_PATH = "avatars/"
@@ -49,6 +76,11 @@ logging.basicConfig(level=logging.INFO)
 # logger = logging.getLogger(__name__)
 
 
+class CreateRoom(BaseModel):
+    name: str
+    game: Literal["chat", "poker", "dixit"] = "chat"
+
+
 @dataclass
 class UserStatus:
     info: UserInfo
@@ -56,47 +88,72 @@ class UserStatus:
     game_status: Optional[any]
 
 
+DEFAULT_MAX_SUBSCRIPTIONS = 8
+DEFAULT_CHAT_WINDOW_MS = 50
+
+
 class WebSocketServer:
-    def __init__(self):
+    def __init__(
+        self,
+        tick_interval=None,
+        compression: Optional[CompressionPolicy] = None,
+        spectators: Optional[SpectatorPolicy] = None,
+        max_subscriptions=DEFAULT_MAX_SUBSCRIPTIONS,
+        rate_limits: Optional[RateLimits] = None,
+        chat_window=None,
+        admission: Optional[Admission] = None,
+        lifecycle: Optional[Lifecycle] = None,
+        reaper: Optional[Reaper] = None,
+    ):
+        self.tick_interval = tick_interval
+        self.compression = compression or CompressionPolicy()
+        self.spectators = spectators or SpectatorPolicy()
         self.rooms: List[Room] = []
-        self.userRoomMapping: Dict[any, Optional[Room]] = {}
-        self.userInfoMapping: Dict[any, Optional[UserInfo]] = {}
+        self.max_subscriptions = max_subscriptions
+        self.rate_limits = rate_limits or RateLimits()
+        self.chat_window = chat_window
+        self.admission = admission or Admission()
+        self.lifecycle = lifecycle or Lifecycle()
+        self.lifecycle.on_cleanup(self.handle_disconnect)
+        # connected clients, a session knows its info, room and watched rooms
+        self.sessions: Set[Session] = self.lifecycle.sessions
+        self.reaper = reaper or Reaper()
         self.admins = []
         self.log_forever = True
 
-    def get_user_info(self, websocket) -> UserInfo:
-        if not (websocket in self.userInfoMapping):
-            self.userInfoMapping[websocket] = generate_user_info()
-        return self.userInfoMapping[websocket]
-
-    async def new_user_connects(self, websocket):
-        self.userRoomMapping[websocket] = None
+    async def new_user_connects(self, websocket: Session):
         await self.send_user_status(websocket)
         await asyncio.sleep(1)
         await self.send_room_list(websocket)
 
     async def remove_room(self, room: Room):
+        if room not in self.rooms:
+            # the last members left at the same time
+            return
         self.rooms.remove(room)
+        default_chat_history.forget_room(room.history_key)
 
     async def broadcast_rooms(self):
-        users_outside = [
-            websocket
-            for websocket in self.userRoomMapping.keys()
-            if self.userRoomMapping[websocket] is None
-        ]
+        users_outside = [session for session in self.sessions if session.room is None]
         logger.info(f"Broadcasting room changes to {len(users_outside)} users")
         await asyncio.gather(*(self.send_room_list(user) for user in users_outside))
 
-    async def user_leave_room(self, websocket, room: Optional[Room]):
-        self.userRoomMapping[websocket] = None
+    async def user_leave_room(self, websocket: Session, room: Optional[Room]):
+        websocket.room = None
         if room:
-            await room.remove(websocket)
-            if room.should_be_removed():
-                await self.remove_room(room)
+            await self.remove_member(room, websocket)
 
-    async def user_change_room(self, websocket, room: Optional[Room]):
-        if (prev := self.userRoomMapping.get(websocket)) is not None:
+    async def remove_member(self, room: Room, member):
+        await room.remove(member)
+        if room.should_be_removed():
+            await self.remove_room(room)
+
+    async def user_change_room(self, websocket: Session, room: Optional[Room]):
+        if (prev := websocket.room) is not None:
             await self.user_leave_room(websocket, prev)
+        if room is not None and room.name in websocket.watched():
+            # entering a watched room, it is not watched any more
+            await self.unsubscribe(websocket, room.name)
 
         # check if the room exists now
         if room is not None and not room in self.rooms:
@@ -106,29 +163,54 @@ class WebSocketServer:
             )
             room = None
 
-        self.userRoomMapping[websocket] = room
+        websocket.room = room
         if room:
-            await room.add(websocket, self.get_user_info(websocket))
+            await room.add(websocket)
         await self.send_user_status(websocket)
         await self.broadcast_rooms()
 
-    async def send_user_status(self, websocket):
-        info = self.get_user_info(websocket)
-        room = self.userRoomMapping.get(websocket)
+    async def subscribe(self, websocket: Session, room_name):
+        channels = websocket.watched()
+        room = self.room_by_name(room_name)
+        if room is None:
+            raise CommandError(f"Cannot subscribe to room '{room_name}': does not exist", "unknown_room")
+        if room_name in channels or websocket.room is room:
+            raise CommandError(f"Already in room '{room_name}'", "already_subscribed")
+        if len(channels) >= self.max_subscriptions:
+            raise CommandError(f"Cannot watch more than {self.max_subscriptions} rooms", "subscription_limit")
+        self.admission.check_capacity(room)
+        if websocket.channels is None:
+            websocket.channels = {}
+        channel = websocket.channels[room_name] = RoomChannel(websocket, room)
+        await room.add(channel)
+        await channel.send_json({"type": "subscribed", "data": room.status(channel)})
+        await self.broadcast_rooms()
+
+    async def unsubscribe(self, websocket: Session, room_name):
+        channel = websocket.watched().pop(room_name, None)
+        if channel is None:
+            raise CommandError(f"Not subscribed to room '{room_name}'", "not_subscribed")
+        await self.remove_member(channel.room, channel)
+        await websocket.send_json({"type": "unsubscribed", "room": room_name})
+        await self.broadcast_rooms()
+
+    async def send_user_status(self, websocket: Session):
+        info = websocket.info
+        room = websocket.room
         roomname = None
         roomgame = None
         if room:
             roomname = room.name
             roomgame = room.status(websocket)
-        await websocket.send(json.dumps({"type": "status", "data": asdict(UserStatus(info=info, room=roomname, game_status=roomgame))}))
+        await websocket.send_json({"type": "status", "data": asdict(UserStatus(info=info, room=roomname, game_status=roomgame))})
         
     async def get_request(self, websocket, data):
         try:
             result = await self.process_response(websocket, data)
-            await websocket.send(json.dumps({"type": "response", "request": data, "data": result}))
+            await websocket.send_json({"type": "response", "request": data, "data": result})
         except Exception as e:
             logger.error(f"Error while processing request {data}: {e}")
-            await websocket.send(json.dumps({"type": "response", "request": data, "error": f"Error: {e}"}))
+            await websocket.send_json({"type": "response", "request": data, "error": f"Error: {e}"})
         
     async def process_response(self, websocket, data):
         async def avatars():
@@ -138,63 +220,84 @@ class WebSocketServer:
         if data == "avatar_list_9":
             all = await avatars()
             return random.sample(all, 9)
+        if data == "compression_stats":
+            return self.compression.stats.describe()
+        if data == "room_memory":
+            return self.reaper.memory
+        if data == "command_stats":
+            return describe_all()
         else:
             raise ValueError(f"Unknown request: {data}")
 
-    async def handle_disconnect(self, websocket):
+    async def handle_disconnect(self, websocket: Session):
         logger.info(f"Disconnected user {websocket.remote_address}")
-        if (prev := self.userRoomMapping.get(websocket)) is not None:
+        if (prev := websocket.room) is not None:
             await self.user_leave_room(websocket, prev)
-        self.userRoomMapping.pop(websocket)
-        self.userInfoMapping.pop(websocket)
+        channels, websocket.channels = websocket.watched(), None
+        for channel in channels.values():
+            await self.remove_member(channel.room, channel)
         await self.broadcast_rooms()
 
     async def handle_connection(self, websocket, path):
-        logger.info(f"Connection established: {websocket.remote_address}")
-
-        await self.new_user_connects(websocket)
+        websocket = Session(websocket, generate_user_info())
+        logger.info(f"Connection established: {websocket}")
+        ip = websocket.remote_address[0] if websocket.remote_address else None
+        self.admission.connected(ip)
+        self.lifecycle.opened(websocket)
 
         try:
+            await websocket.open()
+            await self.new_user_connects(websocket)
             async for message in websocket:
+                if websocket.released:
+                    # reaped, what it still sent would bring it back into rooms
+                    break
+                self.lifecycle.touch(websocket)
                 try:
                     logger.info(
                         f"Received message from {websocket.remote_address}: {message}"
                     )
-                    data = json.loads(message)
-
-                    message_type = data.get("type")
-                    if message_type == "init":
-                        await self.handle_init_command(websocket, data)
-                    elif message_type == "game":
-                        await self.handle_game_command(websocket, data)
+                    try:
+                        data = websocket.decode(message)
+                    except ValueError:
+                        raise CommandError("Messages must be JSON objects", "bad_message")
+                    if not isinstance(data, dict):
+                        raise CommandError("Messages must be JSON objects", "bad_message")
+                    self.rate_limits.check(websocket, data)
+                    await self.messages.dispatch(self, data, websocket)
+                except CommandError as e:
+                    logger.warning(f"Rejected message from {websocket.remote_address}: {e}")
+                    await utils.send_error(websocket, f"{e}", e.error_type, **e.details)
                 except Exception as e:
                     tb = traceback.format_exc()
                     logger.critical(f"An error occurred: {e}\n{tb}")
         finally:
             logger.warn(f"Connection closed: {websocket.remote_address}")
-            await self.handle_disconnect(websocket)
+            self.admission.disconnected(ip)
+            # nothing to do if the session was reaped before
+            await self.lifecycle.release(websocket, disconnect_reason(websocket.websocket))
+
+    # top level messages
 
+    messages = CommandRegistry("message")
+
+    @messages.handler("init", payload=WHOLE_MESSAGE)
     async def handle_init_command(self, websocket, data):
-        command = data.get("command")
-        if command == "create":
-            await self.create_room(
-                websocket, data.get("name"), data.get("game", "chat")
-            )
-        elif command == "enter":
-            await self.handle_enter_room(websocket, data.get("name"))
-        elif command == "list":
-            await self.send_room_list(websocket)
-        elif command == "change_info":
-            await self.change_user_info(websocket, data.get("data"))
-        elif command == "request":
-            await self.get_request(websocket, data.get("data"))
-        elif command == "get_user_info":
-            await self.send_user_status(websocket)
-
-    async def handle_game_command(self, websocket, data):
-        room = self.userRoomMapping[websocket]
+        await self.init_commands.dispatch(self, data, websocket)
+
+    @messages.handler("game", payload=WHOLE_MESSAGE)
+    async def handle_game_command(self, websocket: Session, data):
+        room = websocket.room
+        if (room_name := data.get("room")) is not None:
+            # command for a watched room, sent on behalf of its channel
+            websocket = websocket.watched().get(room_name)
+            if websocket is None:
+                raise CommandError(f"Not subscribed to room '{room_name}'", "not_subscribed")
+            room = websocket.room
         if room:
             game_engine_data = data.get("data")
+            if game_engine_data is not None and not isinstance(game_engine_data, dict):
+                raise CommandError("Game messages must be JSON objects", "bad_message")
             if game_engine_data:
                 await room.send_game_message(websocket, game_engine_data)
         else:
@@ -203,11 +306,49 @@ class WebSocketServer:
             )
             await utils.send_error(websocket, "Not in any room, cannot send game commands.")
 
-    async def change_user_info(self, websocket, data):
-        room = self.userRoomMapping[websocket]
-        self.userInfoMapping[websocket] = UserInfo(**data)
-        if room:
-            await room.update_info(websocket, self.userInfoMapping[websocket])
+    # init commands
+
+    init_commands = CommandRegistry("init", key="command")
+
+    @init_commands.handler("create", CreateRoom, payload=WHOLE_MESSAGE)
+    async def handle_create(self, websocket, request: CreateRoom):
+        await self.create_room(websocket, request.name, request.game)
+
+    @init_commands.handler("enter", Optional[str], payload="name")
+    async def handle_enter(self, websocket, room_name):
+        await self.handle_enter_room(websocket, room_name)
+
+    @init_commands.handler("subscribe", str, payload="name")
+    async def handle_subscribe(self, websocket, room_name):
+        await self.subscribe(websocket, room_name)
+
+    @init_commands.handler("unsubscribe", str, payload="name")
+    async def handle_unsubscribe(self, websocket, room_name):
+        await self.unsubscribe(websocket, room_name)
+
+    @init_commands.handler("list")
+    async def handle_list(self, websocket, _):
+        await self.send_room_list(websocket)
+
+    @init_commands.handler("change_info", UserInfo)
+    async def handle_change_info(self, websocket, info: UserInfo):
+        await self.change_user_info(websocket, info)
+
+    @init_commands.handler("request", str)
+    async def handle_request(self, websocket, data):
+        await self.get_request(websocket, data)
+
+    @init_commands.handler("get_user_info")
+    async def handle_get_user_info(self, websocket, _):
+        await self.send_user_status(websocket)
+
+    async def change_user_info(self, websocket: Session, info: UserInfo):
+        # channels read the info of their session
+        websocket.info = info
+        if websocket.room:
+            await websocket.room.update_info(websocket)
+        for channel in websocket.watched().values():
+            await channel.room.update_info(channel)
         await self.send_user_status(websocket)
 
     def room_by_name(self, name) -> Optional[Room]:
@@ -221,6 +362,8 @@ class WebSocketServer:
 
         room = self.room_by_name(room_name)
         if room:
+            if websocket.room is not room:
+                self.admission.check_capacity(room)
             await self.user_change_room(websocket, room)
         else:
             logger.error(f"Trying to enter room '{room_name}' that does not exist")
@@ -229,18 +372,17 @@ class WebSocketServer:
         room_list = [
             {"name": room.name, "userCount": len(room.users), "game": room.game_engine.game_name()} for room in self.rooms
         ]
-        await websocket.send(json.dumps({"type": "rooms", "data": room_list}))
+        await websocket.send_json({"type": "rooms", "data": room_list})
         logger.debug(f"Sent room list to {websocket.remote_address}: {room_list}")
 
     async def create_room(self, websocket, room_name, game_type):
         if self.room_by_name(room_name):
-            await websocket.send(
-                json.dumps({"type": "error", "message": "Room already exists."})
-            )
+            await websocket.send_json({"type": "error", "message": "Room already exists."})
             logger.warning(f"Failed to create room (already exists): {room_name}")
         else:
+            self.admission.check_new_room(len(self.rooms))
             game_engine = (
-                create_game_engine(game_type)
+                create_game_engine(game_type, self.tick_interval, self.spectators, self.chat_window)
             )  # Change this line if you have other game engines
             new_room = Room(name=room_name, game_engine=game_engine)
             self.rooms.append(new_room)
@@ -257,32 +399,41 @@ class WebSocketServer:
 
         while True:
             logger.info("---- Logging everything ----------------------------")
-            rooms = pprint.pformat(list(map(lambda rm: rm.describe(), self.rooms)))
-            logger.info("Rooms:" + rooms)
-            users = pprint.pformat(
-                {
-                    key.remote_address: describeOrNone(value)
-                    for key, value in self.userRoomMapping.items()
-                }
-            )
-            logger.info("Users: " + users)
-            info = pprint.pformat(
-                {
-                    key.remote_address: pprint.pformat(value)
-                    for key, value in self.userInfoMapping.items()
-                }
-            )
-            logger.info("UserInfo: " + info)
+            if logger.isEnabledFor(logging.DEBUG):
+                # one line per room and connection
+                rooms = pprint.pformat(list(map(lambda rm: rm.describe(), self.rooms)))
+                logger.debug("Rooms:" + rooms)
+                users = pprint.pformat(
+                    {
+                        session.remote_address: describeOrNone(session.room)
+                        for session in self.sessions
+                    }
+                )
+                logger.debug("Users: " + users)
+                info = pprint.pformat(
+                    {
+                        session.remote_address: pprint.pformat(session.info)
+                        for session in self.sessions
+                    }
+                )
+                logger.debug("UserInfo: " + info)
+            logger.info("Compression: " + pprint.pformat(self.compression.stats.describe()))
+            logger.info("Commands: " + pprint.pformat(describe_all()))
+            logger.info("Chat history: " + pprint.pformat(default_chat_history.describe()))
+            logger.info("Throttled: " + pprint.pformat(self.rate_limits.describe()))
+            logger.info("Admission: " + pprint.pformat(self.admission.describe()))
+            logger.info("Lifecycle: " + pprint.pformat(self.lifecycle.describe()))
+            logger.info("Reaper: " + pprint.pformat(self.reaper.describe()))
             logger.info("---- ---- ---- ---- --- ----------------------------")
             await asyncio.sleep(interval)
 
-def create_game_engine(game_type):
+def create_game_engine(game_type, tick_interval=None, spectators=None, chat_window=None):
     if game_type == "chat":
-        return ChatGameEngine()
+        return ChatGameEngine(chat_window=chat_window)
     elif game_type == "poker":
-        return PokerGameEngine()
+        return PokerGameEngine(tick_interval, spectators, chat_window)
     elif game_type == "dixit":
-        return DixitGameEngine()
+        return DixitGameEngine(tick_interval, spectators, chat_window)
     else:
         raise ValueError(f"Unknown engine {game_type}, no such game type.")
     
@@ -296,30 +447,214 @@ async def handle_http(request):
 async def handle_static(request):
     file_path = static_dir / request.match_info['path']
     if file_path.is_file():
+        if "v" in request.query:
+            # versioned by content hash, see CardCatalog.url_of
+            return web.FileResponse(file_path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
         return web.FileResponse(file_path)
     raise web.HTTPNotFound()
 
-async def main():
-    server = WebSocketServer()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multigame websocket server")
+    parser.add_argument(
+        "--transport",
+        choices=["websockets", "aiohttp"],
+        default="websockets",
+        help="websockets: websocket on --port, static files on --static-port; "
+        "aiohttp: both on --port from one aiohttp application, which deflates every message with "
+        "its own settings, the --compress-* options do not apply",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--static-port", type=int, default=8000)
+    parser.add_argument("--uvloop", action="store_true", help="run on the uvloop event loop")
+    parser.add_argument(
+        "--tick-ms",
+        type=int,
+        default=0,
+        help="coalesce game state broadcasts per room into one every N ms, 0 sends every change",
+    )
+    parser.add_argument(
+        "--compress-threshold",
+        type=int,
+        default=DEFAULT_THRESHOLD,
+        help="messages smaller than this many bytes are sent uncompressed",
+    )
+    parser.add_argument("--compress-window-bits", type=int, default=DEFAULT_WINDOW_BITS, choices=range(9, 16))
+    parser.add_argument("--compress-mem-level", type=int, default=DEFAULT_MEM_LEVEL, choices=range(1, 10))
+    parser.add_argument(
+        "--spectator-ms",
+        type=int,
+        default=0,
+        help="send the shared view of members without a seat at most every N ms, 0 sends every change",
+    )
+    parser.add_argument(
+        "--spectator-delay-ms",
+        type=int,
+        default=0,
+        help="members without a seat see the game N ms late",
+    )
+    parser.add_argument(
+        "--max-subscriptions",
+        type=int,
+        default=DEFAULT_MAX_SUBSCRIPTIONS,
+        help="rooms a connection may watch besides the one it entered",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        action="append",
+        default=[],
+        metavar="COMMAND=RATE/BURST",
+        help="inbound limit per connection, e.g. game.chat=2/5 or *=20/40, repeatable",
+    )
+    parser.add_argument(
+        "--chat-window-ms",
+        type=int,
+        default=DEFAULT_CHAT_WINDOW_MS,
+        help="chat messages of a room within N ms are sent as one frame, 0 sends every message immediately",
+    )
+    defaults = AdmissionPolicy()
+    parser.add_argument("--max-connections", type=int, default=defaults.max_connections)
+    parser.add_argument("--max-connections-per-ip", type=int, default=defaults.max_connections_per_ip)
+    parser.add_argument("--max-rooms", type=int, default=defaults.max_rooms)
+    parser.add_argument("--room-capacity", type=int, default=defaults.room_capacity, help="members of a room, watchers included")
+    parser.add_argument("--max-frame", type=int, default=defaults.max_frame, help="bytes, larger inbound messages close the connection")
+    parser.add_argument(
+        "--shed-lag-ms",
+        type=int,
+        default=int(defaults.max_lag * 1000),
+        help="refuse new connections and rooms while the event loop is this late",
+    )
+    parser.add_argument(
+        "--shed-memory-mb",
+        type=int,
+        default=defaults.max_memory_mb,
+        help="refuse new connections and rooms above this resident memory, 0 for no limit",
+    )
+    lifecycle = LifecyclePolicy()
+    parser.add_argument(
+        "--ping-interval",
+        type=float,
+        default=lifecycle.ping_interval,
+        help="seconds between keepalive pings, 0 disables them",
+    )
+    parser.add_argument(
+        "--ping-timeout",
+        type=float,
+        default=lifecycle.ping_timeout,
+        help="seconds to wait for a pong before the connection is dropped",
+    )
+    parser.add_argument(
+        "--close-timeout",
+        type=float,
+        default=lifecycle.close_timeout,
+        help="seconds to wait for the closing handshake",
+    )
+    parser.add_argument("--lobby-idle", type=float, default=lifecycle.lobby_idle, help="seconds, 0 for no limit")
+    parser.add_argument("--seated-idle", type=float, default=lifecycle.seated_idle, help="seconds, 0 for no limit")
+    parser.add_argument("--spectating-idle", type=float, default=lifecycle.spectating_idle, help="seconds, 0 for no limit")
+    reaper = ReaperPolicy()
+    parser.add_argument("--reap-interval", type=float, default=reaper.interval, help="seconds between orphaned state sweeps")
+    parser.add_argument(
+        "--stuck-after",
+        type=float,
+        default=reaper.stuck_after,
+        help="seconds a game may wait for a seat nobody can act on before it is reset",
+    )
+    parser.add_argument("--chat-db", default=CHAT_DB_PATH, help="SQLite database of the chat history")
+    parser.add_argument("--stats-interval", type=float, default=60, help="seconds between statistics logs, 0 disables them")
+    args = parser.parse_args()
+    if args.uvloop and uvloop is None:
+        parser.error("--uvloop needs the uvloop package")
+    return args
+
+
+async def serve(args):
+    admission = Admission(
+        AdmissionPolicy(
+            max_connections=args.max_connections,
+            max_connections_per_ip=args.max_connections_per_ip,
+            max_rooms=args.max_rooms,
+            room_capacity=args.room_capacity,
+            max_frame=args.max_frame,
+            max_lag=args.shed_lag_ms / 1000,
+            max_memory_mb=args.shed_memory_mb,
+        )
+    )
+    lifecycle = Lifecycle(
+        LifecyclePolicy(
+            ping_interval=args.ping_interval or None,
+            ping_timeout=args.ping_timeout or None,
+            close_timeout=args.close_timeout,
+            lobby_idle=args.lobby_idle,
+            seated_idle=args.seated_idle,
+            spectating_idle=args.spectating_idle,
+        )
+    )
+    # referenced, so that the tasks are not collected
+    monitor = asyncio.create_task(admission.monitor.run())
+    idle_check = asyncio.create_task(lifecycle.run())
+    compression = CompressionPolicy(
+        threshold=args.compress_threshold,
+        window_bits=args.compress_window_bits,
+        mem_level=args.compress_mem_level,
+    )
+    server = WebSocketServer(
+        tick_interval=args.tick_ms / 1000 if args.tick_ms else None,
+        compression=compression,
+        spectators=SpectatorPolicy(interval=args.spectator_ms / 1000, delay=args.spectator_delay_ms / 1000),
+        max_subscriptions=args.max_subscriptions,
+        rate_limits=RateLimits({**DEFAULT_LIMITS, **dict(map(parse_limit, args.rate_limit))}),
+        chat_window=args.chat_window_ms / 1000 if args.chat_window_ms else None,
+        admission=admission,
+        lifecycle=lifecycle,
+        reaper=Reaper(ReaperPolicy(interval=args.reap_interval, stuck_after=args.stuck_after)),
+    )
+    sweeper = asyncio.create_task(server.reaper.run(server))
+    if args.stats_interval:
+        stats = asyncio.create_task(server.log_everything_forever(args.stats_interval))
+    await get_catalog().load_versions()
+    default_chat_history.path = args.chat_db
+    await default_chat_history.open()
+
+    host = '0.0.0.0'
 
     # Create an aiohttp application for serving static files
     app = web.Application()
-    app.router.add_get("/", handle_http)
+    if args.transport == "aiohttp":
+        # the websocket on the same application and port
+        handle_websocket = websocket_handler(server, lifecycle.policy, admission.policy.max_frame)
+        app.router.add_get("/ws", handle_websocket)
+        app.router.add_get("/", upgrade_or(handle_websocket, handle_http))
+    else:
+        app.router.add_get("/", handle_http)
     app.router.add_get('/{path:.*}', handle_static)
 
-    # Start the aiohttp server for serving static files
-
-    host = '0.0.0.0'
-
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, host, 8000)
+    if args.transport == "aiohttp":
+        site = web.TCPSite(runner, host, args.port)
+        await site.start()
+        logger.info(f"Serving static files and websocket at http://{host}:{args.port}/")
+        await asyncio.Event().wait()
+
+    # Start the aiohttp server for serving static files
+    site = web.TCPSite(runner, host, args.static_port)
     await site.start()
-    logger.debug(f"Serving static files from http://localhost:8000/static/")
+    logger.debug(f"Serving static files from http://localhost:{args.static_port}/static/")
 
     # Start the WebSocket server
-    start_server = websockets.serve(server.handle_connection, host, 8765)
-    logger.debug(f"WebSocket server running at ws://{host}:8765/")
+    start_server = websockets.serve(
+        server.handle_connection,
+        host,
+        args.port,
+        subprotocols=SUBPROTOCOLS,
+        extensions=[PolicyDeflateFactory(compression)],
+        max_size=admission.policy.max_frame,
+        ping_interval=lifecycle.policy.ping_interval,
+        ping_timeout=lifecycle.policy.ping_timeout,
+        close_timeout=lifecycle.policy.close_timeout,
+        create_protocol=functools.partial(AdmissionServerProtocol, admission=admission),
+    )
+    logger.debug(f"WebSocket server running at ws://{host}:{args.port}/")
 
     # Gather WebSocket server and aiohttp server
     await asyncio.gather(start_server)
@@ -328,5 +663,25 @@ async def main():
     await asyncio.Event().wait()
 
 
+async def main(args):
+    try:
+        # stop on SIGTERM like on Ctrl+C, so that the finally block runs
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        # not available on Windows
+        pass
+    try:
+        await serve(args)
+    except asyncio.CancelledError:
+        logger.info("Shutting down")
+    finally:
+        # messages and hands not yet written
+        await default_chat_history.close()
+        await default_hand_history.close()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(main(args))
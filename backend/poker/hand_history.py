@@ -0,0 +1,310 @@
+"""Append-only poker hand history.
+
+One NDJSON segment file per day (UTC) of the hand end plus a sidecar
+index file with the offset, room and player uids of every record. Only the index files are read
+on start, records are read from the segments by offset when queried.
+
+Engines append finished hands to an in-memory batch, a background task
+writes batches to disk in a worker thread, off the action hot path. The
+index is shared by the writer and query threads and guarded by a lock.
+Only the latest `max_segments` days are indexed in memory, older segments
+stay on disk for export.
+
+Export:
+
+    python -m poker.hand_history --player <uid> > player.ndjson
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = "hand_history/"
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH = 256
+DEFAULT_PAGE = 50
+MAX_PAGE = 100
+# days of history indexed in memory, None for all
+MAX_SEGMENTS = 30
+
+# (segment name, byte offset) of a record
+Position = Tuple[str, int]
+
+
+class HandSeat(BaseModel):
+    seat: int
+    name: str
+    uid: str
+    stack: int
+
+
+class HandRecord(BaseModel):
+    room: str
+    hand: int
+    ts: float
+    # end of the hand, records are written and indexed in this order
+    finished: Optional[float] = None
+    seats: List[HandSeat]
+    # [seat, street, action, amount]
+    actions: List[list] = []
+    board: List[str] = []
+    # hole cards of the players that went to showdown
+    shown: Dict[int, List[str]] = {}
+    winners: List[int] = []
+    won: int = 0
+    combination: Optional[str] = None
+
+
+def segment_name(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def encode_cursor(position: Position) -> str:
+    return f"{position[0]}:{position[1]}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Position]:
+    """Position of a cursor, ValueError for a malformed one"""
+    if not cursor:
+        return None
+    segment, sep, offset = cursor.rpartition(":")
+    if not sep or not offset.isdigit():
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return segment, int(offset)
+
+
+def insert(positions: List[Position], position: Position):
+    """Keep positions sorted, appending in the usual case"""
+    if not positions or positions[-1] < position:
+        positions.append(position)
+    else:
+        bisect.insort(positions, position)
+
+
+class HandHistoryStore:
+    def __init__(self, path=HISTORY_PATH, flush_interval=FLUSH_INTERVAL, max_segments=MAX_SEGMENTS):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.max_segments = max_segments
+        self.pending: List[HandRecord] = []
+        self.flusher: Optional[asyncio.Task] = None
+        self.loaded = False
+        self.all: List[Position] = []
+        self.by_room: Dict[str, List[Position]] = defaultdict(list)
+        self.by_player: Dict[str, List[Position]] = defaultdict(list)
+        self.segments: List[str] = []
+        # guards the index, writes are serialized by write_lock so that
+        # positions are appended in order
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    # writing
+
+    def append(self, record: HandRecord):
+        """Queue a finished hand, cheap enough for the action path"""
+        self.pending.append(record)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        while self.pending:
+            await self.flush()
+
+    async def flush(self):
+        batch = self.pending[:FLUSH_BATCH]
+        del self.pending[:FLUSH_BATCH]
+        if batch:
+            try:
+                await asyncio.to_thread(self.write_batch, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} hands to history: {e}")
+
+    async def close(self):
+        """Write every queued hand, on shutdown"""
+        if self.flusher is not None:
+            # a batch it is writing is committed before it ends
+            await asyncio.gather(self.flusher, return_exceptions=True)
+        while self.pending:
+            await self.flush()
+
+    def write_batch(self, batch: List[HandRecord]):
+        self.load_index()
+        self.path.mkdir(parents=True, exist_ok=True)
+        by_segment = defaultdict(list)
+        for record in batch:
+            by_segment[segment_name(record.finished or record.ts)].append(record)
+        with self.write_lock:
+            for segment, records in by_segment.items():
+                entries = []
+                with open(self.path / f"{segment}.ndjson", "ab") as data, open(self.path / f"{segment}.idx", "a") as index:
+                    offset = data.tell()
+                    for record in records:
+                        line = record.model_dump_json(exclude_defaults=True).encode() + b"\n"
+                        data.write(line)
+                        players = [seat.uid for seat in record.seats]
+                        index.write(json.dumps({"o": offset, "r": record.room, "u": players}) + "\n")
+                        entries.append(((segment, offset), record.room, players))
+                        offset += len(line)
+                # indexed once written, a query never sees a record that is not on disk
+                with self.lock:
+                    for entry in entries:
+                        self.add_to_index(*entry)
+
+    # index
+
+    def add_to_index(self, position: Position, room, players):
+        """Called with the lock held, players are uids"""
+        segment = position[0]
+        if not self.segments or self.segments[-1] < segment:
+            self.segments.append(segment)
+            if self.max_segments is not None and len(self.segments) > self.max_segments:
+                self.evict(self.segments[-self.max_segments])
+        insert(self.all, position)
+        insert(self.by_room[room], position)
+        for player in players:
+            insert(self.by_player[player], position)
+
+    def evict(self, oldest: str):
+        """Drop the segments before oldest from the index, called with the lock held"""
+        del self.segments[: self.segments.index(oldest)]
+        keep = (oldest, -1)
+        del self.all[: bisect.bisect_left(self.all, keep)]
+        for index in (self.by_room, self.by_player):
+            for key in list(index):
+                positions = index[key]
+                del positions[: bisect.bisect_left(positions, keep)]
+                if not positions:
+                    del index[key]
+
+    def load_index(self):
+        with self.lock:
+            if self.loaded:
+                return
+            if self.path.exists():
+                index_files = sorted(self.path.glob("*.idx"))
+                if self.max_segments is not None:
+                    index_files = index_files[-self.max_segments :]
+                for index_file in index_files:
+                    segment = index_file.stem
+                    with open(index_file) as index:
+                        for line in index:
+                            entry = json.loads(line)
+                            # entries written before uids were indexed only have names
+                            self.add_to_index((segment, entry["o"]), entry["r"], entry.get("u", ()))
+            self.loaded = True
+
+    def positions(self, room=None, player=None, after: Optional[Position] = None, limit=None) -> List[Position]:
+        """Matching positions after the given one, a copy taken under the lock"""
+        self.load_index()
+        with self.lock:
+            if room is not None and player is not None:
+                players = set(self.by_player.get(player, ()))
+                positions = [p for p in self.by_room.get(room, ()) if p in players]
+            elif room is not None:
+                positions = self.by_room.get(room, [])
+            elif player is not None:
+                positions = self.by_player.get(player, [])
+            else:
+                positions = self.all
+            start = bisect.bisect_right(positions, after) if after is not None else 0
+            return positions[start : start + limit if limit is not None else None]
+
+    # reading
+
+    def read_lines(self, positions: Iterator[Position]) -> Iterator[bytes]:
+        """Raw NDJSON lines, keeps one segment file open at a time"""
+        current = None
+        data = None
+        try:
+            for segment, offset in positions:
+                if segment != current:
+                    if data:
+                        data.close()
+                    data = open(self.path / f"{segment}.ndjson", "rb")
+                    current = segment
+                data.seek(offset)
+                yield data.readline()
+        finally:
+            if data:
+                data.close()
+
+    def query(self, room=None, player=None, cursor=None, limit=DEFAULT_PAGE):
+        """Page of records after cursor, and the cursor of the next page,
+        ValueError for a malformed cursor"""
+        # one more to know whether there is a next page
+        page = self.positions(room, player, decode_cursor(cursor), limit + 1)
+        more = len(page) > limit
+        page = page[:limit]
+        records = [json.loads(line) for line in self.read_lines(iter(page))]
+        next_cursor = encode_cursor(page[-1]) if more else None
+        return records, next_cursor
+
+    def export_ndjson(self, out, room=None, player=None):
+        """Stream matching records to a binary file object"""
+        for line in self.read_lines(iter(self.positions(room, player))):
+            out.write(line)
+
+
+default_hand_history = HandHistoryStore()
+
+
+class HandRecorder:
+    """Collects one hand while it is played"""
+
+    def __init__(self, store: HandHistoryStore):
+        self.store = store
+        self.record: Optional[HandRecord] = None
+
+    def begin(self, room_name, playing, seats):
+        self.record = HandRecord(
+            room=room_name,
+            hand=playing.total_turns,
+            ts=time.time(),
+            seats=[
+                HandSeat(seat=i, name=seat.info.name, uid=seat.websocket_uid, stack=player.stack + (player.bet or 0))
+                for i, (seat, player) in enumerate(zip(seats, playing.players))
+                if seat and player
+            ],
+        )
+
+    def action(self, street, seat, action):
+        """Street is the number of cards on the table when the action was made"""
+        if self.record is not None:
+            self.record.actions.append([seat, street, action.action, action.amount])
+
+    def finish(self, playing):
+        record = self.record
+        self.record = None
+        if record is None or playing.victory is None:
+            return
+        record.finished = time.time()
+        record.board = list(playing.table)
+        if playing.victory.combination is not None:
+            record.shown = {i: list(playing.players[i].cards) for i in playing.not_folded_seat_index()}
+        record.winners = list(playing.victory.winners)
+        record.won = playing.victory.won
+        record.combination = playing.victory.combination
+        self.store.append(record)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export poker hand history as NDJSON")
+    parser.add_argument("--path", default=HISTORY_PATH)
+    parser.add_argument("--room")
+    parser.add_argument("--player", help="uid of the player")
+    args = parser.parse_args()
+    HandHistoryStore(args.path, max_segments=None).export_ndjson(sys.stdout.buffer, room=args.room, player=args.player)
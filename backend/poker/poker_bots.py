@@ -0,0 +1,169 @@
+"""Server-side poker bots.
+
+Policies are plain functions of a picklable BotSnapshot, so they can run
+in a thread pool or in a process pool. The engine never waits for them on
+the event loop: decisions come back through a BotChannel.
+"""
+
+import asyncio
+import logging
+import random
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from treys import Card, Deck
+
+from poker.poker_runtime_holdem import PokerAction, PokerGamePlaying, get_evaluator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = "equity"
+DEFAULT_DEADLINE = 2.0
+EQUITY_ROLLOUTS = 300
+
+
+@dataclass
+class BotSnapshot:
+    """Everything a policy may know about the game, from the bot's seat"""
+
+    seat: int
+    cards: List[str]
+    table: List[str]
+    opponents: int
+    stack: int
+    bet: int
+    pot: int
+    expected_actions: List[Dict] = field(default_factory=list)
+
+    def allowed(self, name) -> Optional[Dict]:
+        for act in self.expected_actions:
+            if act["action"] == name:
+                return act
+        return None
+
+
+@dataclass
+class BotMove:
+    seat: int
+    decision: int
+    action: PokerAction
+
+
+def snapshot_for_seat(game: PokerGamePlaying, seat: int) -> BotSnapshot:
+    player = game.players[seat]
+    opponents = sum(1 for i in game.not_folded_seat_index() if i != seat)
+    pot = game.bank + sum(p.bet or 0 for p in game.players if p)
+    return BotSnapshot(
+        seat=seat,
+        cards=list(player.cards),
+        table=list(game.table),
+        opponents=opponents,
+        stack=player.stack,
+        bet=player.bet or 0,
+        pot=pot,
+        expected_actions=[act.model_dump() for act in game.expected_actions],
+    )
+
+
+def fallback_action(snapshot: BotSnapshot) -> PokerAction:
+    """Used when a policy misses its deadline or fails"""
+    if snapshot.allowed("check"):
+        return PokerAction(action="check")
+    return PokerAction(action="fold")
+
+
+def estimate_equity(snapshot: BotSnapshot, rollouts=EQUITY_ROLLOUTS, rng=None) -> float:
+    """Monte Carlo share of the pot won against random opponent hands"""
+    if snapshot.opponents < 1:
+        return 1.0
+    rng = rng or random.Random()
+    ev = get_evaluator()
+    hand = [Card.new(c) for c in snapshot.cards]
+    board = [Card.new(c) for c in snapshot.table]
+    known = set(hand + board)
+    remaining = [c for c in Deck.GetFullDeck() if c not in known]
+    missing = 5 - len(board)
+    needed = missing + 2 * snapshot.opponents
+    won = 0.0
+    for _ in range(rollouts):
+        drawn = rng.sample(remaining, needed)
+        full_board = board + drawn[:missing]
+        mine = ev.evaluate(hand, full_board)
+        best = min(
+            ev.evaluate(drawn[missing + 2 * i : missing + 2 * i + 2], full_board)
+            for i in range(snapshot.opponents)
+        )
+        if mine < best:
+            won += 1
+        elif mine == best:
+            won += 0.5
+    return won / rollouts
+
+
+def calling_policy(snapshot: BotSnapshot) -> PokerAction:
+    """Never folds, never raises"""
+    call = snapshot.allowed("call")
+    if call:
+        return PokerAction(action="call", amount=call["amount"])
+    return PokerAction(action="check")
+
+
+def equity_policy(snapshot: BotSnapshot) -> PokerAction:
+    """Compares rollout equity with the pot odds"""
+    equity = estimate_equity(snapshot)
+    for name in ("raise", "bet"):
+        act = snapshot.allowed(name)
+        if act and equity > 0.65:
+            return PokerAction(action=name, amount=act["amount"])
+    call = snapshot.allowed("call")
+    if not call:
+        return PokerAction(action="check")
+    to_call = min(call["amount"] - snapshot.bet, snapshot.stack)
+    if equity >= to_call / (snapshot.pot + to_call):
+        return PokerAction(action="call", amount=call["amount"])
+    return PokerAction(action="fold")
+
+
+BOT_POLICIES: Dict[str, Callable[[BotSnapshot], PokerAction]] = {
+    "calling": calling_policy,
+    "equity": equity_policy,
+}
+
+
+class BotRunner:
+    """Runs bot policies off the event loop, with a deadline"""
+
+    def __init__(self, executor: Optional[Executor] = None, deadline=DEFAULT_DEADLINE):
+        self.executor = executor or ThreadPoolExecutor(max_workers=4, thread_name_prefix="poker-bot")
+        self.deadline = deadline
+
+    async def decide(self, policy_name, snapshot: BotSnapshot) -> PokerAction:
+        policy = BOT_POLICIES.get(policy_name, BOT_POLICIES[DEFAULT_POLICY])
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.executor, policy, snapshot), self.deadline
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Bot at seat {snapshot.seat} missed the {self.deadline}s deadline")
+        except Exception as e:
+            logger.error(f"Bot policy {policy_name} failed: {e}")
+        return fallback_action(snapshot)
+
+
+# shared by all rooms, so bots cannot take more workers than the pool has
+default_bot_runner = BotRunner()
+
+
+class BotChannel:
+    """In-process channel from bots to the engine"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue[BotMove] = asyncio.Queue()
+
+    def post(self, move: BotMove):
+        self.queue.put_nowait(move)
+
+    async def receive(self) -> BotMove:
+        return await self.queue.get()
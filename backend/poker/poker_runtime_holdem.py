@@ -1,9 +1,27 @@
+import logging
 import math
 from typing import List, Optional, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from treys import Deck, Card, Evaluator, evaluator
 import pprint
 
+from fragments import TrackedModel
+
+logger = logging.getLogger(__name__)
+
+# comments are a ring buffer, clients receive them incrementally by id
+MAX_COMMENTS = 64
+
+# building lookup tables is expensive, share one evaluator per process
+_evaluator = None
+
+
+def get_evaluator():
+    global _evaluator
+    if _evaluator is None:
+        _evaluator = Evaluator()
+    return _evaluator
+
 
 class UserCommandError(Exception):
     def __init__(self, message, error_type):
@@ -15,6 +33,7 @@ class UserCommandError(Exception):
 
 
 class PokerComment(BaseModel):
+    id: int = 0
     text: str
     seats: List[int]
 
@@ -29,7 +48,7 @@ class UserResponse(BaseModel):
     seat: int
 
 
-class PokerPlayer(BaseModel):
+class PokerPlayer(TrackedModel):
     stack: int
     bet: Union[int, None]
     cards: List[str]
@@ -70,9 +89,8 @@ class PokerPlayer(BaseModel):
         return False
     
     def copy_hide_cards(self):
-        copy = self.model_copy(deep=True)
-        copy.cards = [ "??" for _card in copy.cards]
-        return copy
+        # shallow, unvalidated copy, only the cards list is replaced
+        return self.model_copy(update={"cards": ["??"] * len(self.cards)})
     
     def copy_hide_cards_if_needed(self, allinRound=False, skip=False):
         if skip:
@@ -90,7 +108,7 @@ class VictoryRecord(BaseModel):
     combination: Optional[str]
 
 
-class PokerGamePlaying(BaseModel):
+class PokerGamePlaying(TrackedModel):
     players: List[Union[PokerPlayer, None]]
     dealer: int
     turn: int
@@ -101,7 +119,8 @@ class PokerGamePlaying(BaseModel):
     total_turns: int = 0
     last_round_victory: Optional[VictoryRecord] = None
     victory: Optional[VictoryRecord] = None
-    comments: List[PokerComment] = []
+    comments: List[PokerComment] = Field(default=[], exclude=True)
+    comment_seq: int = Field(default=0, exclude=True)
 
     def record_victory(self, victory):
         self.victory = victory
@@ -115,11 +134,21 @@ class PokerGamePlaying(BaseModel):
         return notAllinPlayers < 1
 
     def comment(self, text, seats=[]):
-        """Add new comment to comments list"""
+        """Add new comment to comments ring buffer"""
         if isinstance(seats, int):
             seats = [seats]
-        comment = PokerComment(text=text, seats=seats)
+        self.comment_seq += 1
+        comment = PokerComment(id=self.comment_seq, text=text, seats=seats)
         self.comments.append(comment)
+        if len(self.comments) > MAX_COMMENTS:
+            del self.comments[0]
+
+    def comments_after(self, cursor):
+        """Comments with id greater than cursor that are still in the buffer"""
+        if not self.comments or self.comments[-1].id <= cursor:
+            return []
+        first = self.comments[0].id
+        return self.comments[max(0, cursor - first + 1):]
 
     def next_dealer(self):
         self.dealer = self.dealer + 1
@@ -293,12 +322,16 @@ def win_round_wait_next(
 
 
 def win_game(game: PokerGamePlaying, winners_indices, winner_combination):
-    """Give prizes to the winners"""
-    win = int(game.bank / len(winners_indices))
-    for winner in winners_indices:
+    """Give prizes to the winners, odd chips of a split pot go one by one to
+    the winners from the left of the dealer button"""
+    win, odd = divmod(game.bank, len(winners_indices))
+    seats = len(game.players)
+    from_button = sorted(winners_indices, key=lambda i: (i - game.dealer - 1) % seats)
+    for order, winner in enumerate(from_button):
+        prize = win + (1 if order < odd else 0)
         player = game.players[winner]
-        player.stack += int(win)
-        game.comment(f"User $$ wins {win}!", winner)
+        player.stack += prize
+        game.comment(f"User $$ wins {prize}!", winner)
     game.record_victory(
         VictoryRecord(
             folded=True if winner_combination == None else False,
@@ -358,7 +391,7 @@ def showdown(game: PokerGamePlaying):
     - decide who is the winner
     - call win_game()"""
 
-    ev = Evaluator()
+    ev = get_evaluator()
 
     def evaluate_cards(board, cards: List[str]):
         hand = [Card.new(x) for x in cards]
@@ -369,13 +402,11 @@ def showdown(game: PokerGamePlaying):
     board = [Card.new(x) for x in game.table]
     players = {seat: game.players[seat].cards for seat in game.not_folded_seat_index()}
     results = {seat: evaluate_cards(board, cards) for (seat, cards) in players.items()}
-    print(game.table)
-    print(players)
-    print(results)
+    logger.debug(f"Showdown table: {game.table}, hands: {players}, results: {results}")
     sorted_results = [(seat, result) for seat, result in results.items()]
     sorted_results.sort(key=lambda item: item[1])
     winner_number = sorted_results[0][1]
-    print(sorted_results)
+    logger.debug(f"Showdown sorted: {sorted_results}")
     winners = [
         sorted_result[0]
         for sorted_result in sorted_results
@@ -401,11 +432,11 @@ def next_bettinground(game: PokerGamePlaying, deck: Deck):
     elif len(game.table) == 3:
         # turn (after flop)
         game.comment("turn")
-        game.table.append(*draw_cards(deck, 1))
+        game.table = game.table + draw_cards(deck, 1)
     elif len(game.table) == 4:
         # last round
         game.comment("river")
-        game.table.append(*draw_cards(deck, 1))
+        game.table = game.table + draw_cards(deck, 1)
     else:
         # ohoho, we came so far
         return showdown(game)
@@ -468,8 +499,8 @@ def game_next_round(game: PokerGamePlaying, deck: Deck):
     options_for_next_round(game)
 
 
-def create_deck():
-    return Deck()
+def create_deck(seed=None):
+    return Deck(seed)
 
 
 if __name__ == "__main__":
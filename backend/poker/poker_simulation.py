@@ -0,0 +1,310 @@
+"""Headless hold'em simulator.
+
+Drives game_start / game_next / game_next_round with pluggable strategies
+and reports throughput, time per phase, allocations and invariant checks.
+
+Run from the backend directory:
+
+    python -m poker.poker_simulation --hands 100000 --players 6 --workers 4 --seed 42
+"""
+
+import argparse
+import gc
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+from poker.poker_runtime_holdem import (
+    PokerAction,
+    PokerGamePlaying,
+    UserCommandError,
+    UserResponse,
+    create_deck,
+    createSimplePokerGamePlaying,
+    game_next,
+    game_next_round,
+    game_start,
+)
+
+PHASE_DEAL = "deal"
+PHASES_BY_TABLE_SIZE = {0: "preflop", 3: "flop", 4: "turn", 5: "river"}
+PHASES = [PHASE_DEAL, "preflop", "flop", "turn", "river"]
+
+# hard limit of actions per hand, protects the harness from runtime bugs
+MAX_ACTIONS_PER_HAND = 500
+MAX_VIOLATION_SAMPLES = 10
+
+Strategy = Callable[[PokerGamePlaying, int, random.Random], PokerAction]
+
+
+def _allowed(game: PokerGamePlaying, name):
+    for act in game.expected_actions:
+        if act.action == name:
+            return act
+    return None
+
+
+def _call_or_check(game: PokerGamePlaying):
+    call = _allowed(game, "call")
+    if call:
+        return PokerAction(action="call", amount=call.amount)
+    return PokerAction(action="check")
+
+
+def passive_strategy(game: PokerGamePlaying, seat: int, rng: random.Random):
+    """Never folds, never raises"""
+    return _call_or_check(game)
+
+
+def aggressive_strategy(game: PokerGamePlaying, seat: int, rng: random.Random):
+    """Bets or raises the minimum whenever possible"""
+    for name in ("raise", "bet"):
+        act = _allowed(game, name)
+        if act:
+            return PokerAction(action=name, amount=act.amount)
+    return _call_or_check(game)
+
+
+def random_strategy(game: PokerGamePlaying, seat: int, rng: random.Random):
+    """Uniform choice between the expected actions, folds are rarer"""
+    roll = rng.random()
+    if roll < 0.1:
+        return PokerAction(action="fold")
+    if roll < 0.7:
+        return _call_or_check(game)
+    player = game.players[seat]
+    for name in ("raise", "bet"):
+        act = _allowed(game, name)
+        if act:
+            top = max(act.amount, player.bet + player.stack)
+            return PokerAction(action=name, amount=rng.randint(act.amount, top))
+    return _call_or_check(game)
+
+
+STRATEGIES: Dict[str, Strategy] = {
+    "passive": passive_strategy,
+    "aggressive": aggressive_strategy,
+    "random": random_strategy,
+}
+
+
+@dataclass
+class SimulationConfig:
+    hands: int = 10000
+    players: int = 6
+    seats: int = 9
+    buy_in: int = 1500
+    small_blind: int = 15
+    strategies: List[str] = field(default_factory=lambda: ["random"])
+    seed: int = 0
+
+
+@dataclass
+class SimulationReport:
+    hands: int = 0
+    actions: int = 0
+    showdowns: int = 0
+    tables: int = 0
+    elapsed: float = 0.0
+    phase_time: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(PHASES, 0.0))
+    phase_calls: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(PHASES, 0))
+    phase_blocks: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(PHASES, 0))
+    gc_collections: int = 0
+    command_errors: int = 0
+    violations: int = 0
+    violation_samples: List[str] = field(default_factory=list)
+
+    def violation(self, text):
+        self.violations += 1
+        if len(self.violation_samples) < MAX_VIOLATION_SAMPLES:
+            self.violation_samples.append(text)
+
+    def merge(self, other: "SimulationReport"):
+        self.hands += other.hands
+        self.actions += other.actions
+        self.showdowns += other.showdowns
+        self.tables += other.tables
+        self.elapsed = max(self.elapsed, other.elapsed)
+        for phase in PHASES:
+            self.phase_time[phase] += other.phase_time[phase]
+            self.phase_calls[phase] += other.phase_calls[phase]
+            self.phase_blocks[phase] += other.phase_blocks[phase]
+        self.gc_collections += other.gc_collections
+        self.command_errors += other.command_errors
+        self.violations += other.violations
+        room = MAX_VIOLATION_SAMPLES - len(self.violation_samples)
+        self.violation_samples.extend(other.violation_samples[:room])
+        return self
+
+    def describe(self):
+        lines = [
+            f"hands: {self.hands}, actions: {self.actions}, showdowns: {self.showdowns}, tables: {self.tables}",
+            f"elapsed: {self.elapsed:.2f}s, hands/s: {self.hands / self.elapsed if self.elapsed else 0:.0f}",
+            "phase       calls      total s    us/call   blocks/call",
+        ]
+        for phase in PHASES:
+            calls = self.phase_calls[phase] or 1
+            lines.append(
+                f"{phase:<10}{self.phase_calls[phase]:>7}{self.phase_time[phase]:>13.3f}"
+                f"{self.phase_time[phase] / calls * 1e6:>11.1f}{self.phase_blocks[phase] / calls:>14.2f}"
+            )
+        lines.append(f"gc collections: {self.gc_collections}, command errors: {self.command_errors}")
+        lines.append(f"invariant violations: {self.violations}")
+        lines.extend(f"  {sample}" for sample in self.violation_samples)
+        return "\n".join(lines)
+
+
+def new_table(config: SimulationConfig):
+    seats = [None] * config.seats
+    for i in range(config.players):
+        seats[i] = f"sim{i}"
+    return createSimplePokerGamePlaying(seats, config.buy_in, config.small_blind)
+
+
+def chips_on_table(game: PokerGamePlaying):
+    return sum(p.stack + (p.bet or 0) for p in game.players if p) + game.bank
+
+
+def check_hand_invariants(game: PokerGamePlaying, expected_chips, report: SimulationReport):
+    """Called in victory state, when the bank has been paid out"""
+    stacks = sum(p.stack for p in game.players if p)
+    if stacks != expected_chips:
+        report.violation(
+            f"hand {game.total_turns}: chips not conserved, {stacks} != {expected_chips} ({game.victory})"
+        )
+    for i, player in enumerate(game.players):
+        if player and player.stack < 0:
+            report.violation(f"hand {game.total_turns}: seat {i} has negative stack {player.stack}")
+    seen = list(game.table)
+    for player in game.players:
+        if player:
+            seen.extend(player.cards)
+    if len(seen) != len(set(seen)):
+        report.violation(f"hand {game.total_turns}: duplicated cards {seen}")
+
+
+def check_turn_invariants(game: PokerGamePlaying, report: SimulationReport):
+    player = game.players[game.turn]
+    if player is None or player.folded:
+        report.violation(f"hand {game.total_turns}: turn {game.turn} points to an inactive seat")
+    if len(game.table) > 5:
+        report.violation(f"hand {game.total_turns}: {len(game.table)} cards on the table")
+
+
+class _PhaseTimer:
+    def __init__(self, report: SimulationReport):
+        self.report = report
+
+    def run(self, phase, fn, *args):
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.report.phase_time[phase] += time.perf_counter() - start
+            self.report.phase_blocks[phase] += sys.getallocatedblocks() - blocks
+            self.report.phase_calls[phase] += 1
+
+
+def simulate(config: SimulationConfig) -> SimulationReport:
+    """Play config.hands hands in this process"""
+    report = SimulationReport()
+    rng = random.Random(config.seed)
+    deck = create_deck(rng.randrange(2**32))
+    strategies = [STRATEGIES[config.strategies[i % len(config.strategies)]] for i in range(config.seats)]
+    timer = _PhaseTimer(report)
+    gc_before = sum(stat["collections"] for stat in gc.get_stats())
+    started = time.perf_counter()
+
+    game = None
+    expected_chips = 0
+    while report.hands < config.hands:
+        if game is None or sum(1 for p in game.players if p and p.stack > 0) < 2:
+            game = new_table(config)
+            expected_chips = chips_on_table(game)
+            report.tables += 1
+            timer.run(PHASE_DEAL, game_start, game, deck)
+        else:
+            # busted players leave the table
+            for i, player in enumerate(game.players):
+                if player and player.stack <= 0:
+                    game.players[i] = None
+            timer.run(PHASE_DEAL, game_next_round, game, deck)
+
+        actions = 0
+        while not game.victory:
+            if actions >= MAX_ACTIONS_PER_HAND:
+                report.violation(f"hand {game.total_turns}: no victory after {actions} actions")
+                game = None
+                break
+            check_turn_invariants(game, report)
+            seat = game.turn
+            action = strategies[seat](game, seat, rng)
+            phase = PHASES_BY_TABLE_SIZE.get(len(game.table), "river")
+            try:
+                timer.run(phase, game_next, game, deck, UserResponse(action=action, seat=seat))
+            except UserCommandError:
+                report.command_errors += 1
+                timer.run(phase, game_next, game, deck, UserResponse(action=PokerAction(action="fold"), seat=seat))
+            actions += 1
+        report.hands += 1
+        report.actions += actions
+        if game is not None:
+            if game.victory.combination is not None:
+                report.showdowns += 1
+            check_hand_invariants(game, expected_chips, report)
+            # keep measuring the next hands even if chips were lost
+            expected_chips = sum(p.stack for p in game.players if p)
+
+    report.elapsed = time.perf_counter() - started
+    report.gc_collections = sum(stat["collections"] for stat in gc.get_stats()) - gc_before
+    return report
+
+
+def simulate_parallel(config: SimulationConfig, workers: int) -> SimulationReport:
+    """Split the hands between worker processes, each with a derived seed"""
+    if workers <= 1:
+        return simulate(config)
+    chunks = []
+    for i in range(workers):
+        hands = config.hands // workers + (1 if i < config.hands % workers else 0)
+        chunk = SimulationConfig(**{**config.__dict__, "hands": hands, "seed": config.seed * 1000003 + i})
+        chunks.append(chunk)
+    started = time.perf_counter()
+    report = SimulationReport()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(simulate, chunks):
+            report.merge(result)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless hold'em simulation")
+    parser.add_argument("--hands", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=6)
+    parser.add_argument("--buy-in", type=int, default=1500)
+    parser.add_argument("--small-blind", type=int, default=15)
+    parser.add_argument("--strategy", action="append", choices=sorted(STRATEGIES), help="strategy per seat, repeat to mix")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = SimulationConfig(
+        hands=args.hands,
+        players=args.players,
+        buy_in=args.buy_in,
+        small_blind=args.small_blind,
+        strategies=args.strategy or ["random"],
+        seed=args.seed,
+    )
+    report = simulate_parallel(config, args.workers)
+    print(report.describe())
+    return 1 if report.violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
-from dataclasses import asdict
 from poker.poker_runtime_holdem import (
     PokerAction,
     PokerGamePlaying,
+    PokerPlayer,
     UserCommandError,
     UserResponse,
     create_deck,
@@ -11,6 +11,15 @@ from poker.poker_runtime_holdem import (
     game_start,
     start_round,
 )
+from poker.hand_history import MAX_PAGE, HandRecorder, decode_cursor, default_hand_history
+from poker.tournament import TableMove
+from poker.poker_bots import (
+    DEFAULT_POLICY,
+    BotChannel,
+    BotMove,
+    default_bot_runner,
+    snapshot_for_seat,
+)
 import utils
 import json
 import logging
@@ -18,17 +27,27 @@ import asyncio
 from pydantic.json import pydantic_encoder
 
 import websockets
-from game_engine import GameEngine, UserInfo
-from typing import List, Optional, Union
+from commands import CommandError, CommandRegistry
+from connection import broadcast_json
+from fragments import FragmentCache, TrackedModel, splice_object
+from game_engine import SeatedGameEngine, UserInfo
+from typing import Annotated, Any, Dict, List, Optional, Union
 from pydantic import BaseModel, Field, validator
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BUY_IN = 1500
+DEFAULT_SMALL_BLIND = 30
+SEATS = 9
+
+SeatIndex = Annotated[int, Field(ge=0, lt=SEATS)]
 
-class Seat(BaseModel):
+
+class Seat(TrackedModel):
     websocket_uid: str
     info: UserInfo
     ai: bool
+    policy: Optional[str] = None
 
     class Config:
         fields = {"info": ..., "ai": ...}
@@ -40,7 +59,7 @@ class Seat(BaseModel):
         return v
 
 
-class PokerGameSetup(BaseModel):
+class PokerGameSetup(TrackedModel):
     gameName: str = "holdem"
     seats: List[Optional[Seat]]
     windelay: int = 6
@@ -75,50 +94,124 @@ class PokerGameStatusMessage(BaseModel):
         allow_population_by_field_name = True
 
 
+class HistoryQuery(BaseModel):
+    # only the room the client is in
+    room: Optional[str] = None
+    # uid of the player, as in the seats
+    player: Optional[str] = None
+    cursor: Optional[str] = None
+    limit: int = Field(default=20, ge=1, le=MAX_PAGE)
+
+
+class AddBotRequest(BaseModel):
+    seat: Optional[SeatIndex] = None
+    policy: str = DEFAULT_POLICY
+
+
 def create_new_setup():
-    setup_data = {"gameName": "holdem", "seats": [None] * 9}
+    setup_data = {"gameName": "holdem", "seats": [None] * SEATS}
     setup = PokerGameSetup(**setup_data)
     poker_game_status_data = {"stage": "setup", "setup": setup, "playing": None}
     return PokerGameStatus(**poker_game_status_data)
 
 
-def start_game(status: PokerGameStatus):
+def start_game(status: PokerGameStatus, buy_in=DEFAULT_BUY_IN, small_blind=DEFAULT_SMALL_BLIND):
     status.stage = "playing"
-    status.playing = createSimplePokerGamePlaying(status.setup.seats, 1500, 30)
+    status.playing = createSimplePokerGamePlaying(status.setup.seats, buy_in, small_blind)
     logger.info(f"Game starting... {status.model_dump_json()}")
     return status
 
 
-class PokerGameEngine(GameEngine):
-    def __init__(self):
+class PokerGameEngine(SeatedGameEngine):
+    commands = CommandRegistry("poker", include=SeatedGameEngine.commands)
+    shared = SeatedGameEngine.shared + ("bot_runner", "history", "tournament")
+
+    def __init__(self, tick_interval=None, spectators=None, chat_window=None):
+        super().__init__(tick_interval, spectators, chat_window)
         self.state = create_new_setup()
-        self.websocket_uid_mapping = {}
         self.deck = create_deck()
+        self.bot_runner = default_bot_runner
+        self.bot_channel = BotChannel()
+        self.bot_consumer = None
+        # increased on every state change a bot could react to,
+        # bot moves computed for an older decision are dropped
+        self.decision = 0
+        self.bot_pending = -1
+        self.buy_in = DEFAULT_BUY_IN
+        self.small_blind = DEFAULT_SMALL_BLIND
+        # set when the table is a part of a TournamentCoordinator
+        self.tournament = None
+        self.table_id = None
+        self.waiting_for_players = False
+        # id of the last comment broadcast to the room
+        self.comments_sent = 0
+        self.history = default_hand_history
+        self.recorder = HandRecorder(self.history)
+        self.fragments = FragmentCache()
 
     def game_name(self):
         return "poker"
 
-    def userinfo_to_dict(self, userinfo):
-        if userinfo is None:
-            return None
-        return asdict(userinfo)
-
-    async def broadcast_room_state(self, room):
+    async def send_room_state(self, room):
         # logger.info(
         #     f"Sending POKER update to {room.users} users: {self.state.model_dump()}"
         # )
         if (self.state and self.state.playing and self.state.playing):
             logger.info(f"Broadcasting room {self.state.playing.victory}")
-        state_json = PokerGameStatusMessage(
-            **{
+        for user in self.players_of(room):
+            await self.send_status(user)
+        await self.spectator_feed.publish(room)
+        await self.broadcast_comments(room)
+
+    def comments_message(self, cursor):
+        """Comments event with everything after cursor, None if nothing is new"""
+        if not self.state.playing:
+            return None
+        comments = self.state.playing.comments_after(cursor)
+        if not comments:
+            return None
+        return {
+            "type": "game",
+            "data": {
+                "type": "comments",
+                "cursor": comments[-1].id,
+                "comments": [comment.model_dump() for comment in comments],
+            },
+        }
+
+    async def broadcast_comments(self, room):
+        message = self.comments_message(self.comments_sent)
+        if message is None:
+            return
+        self.comments_sent = self.state.playing.comment_seq
+        await broadcast_json(self.live_members_of(room), message)
+
+    async def send_comments(self, websocket, cursor):
+        message = self.comments_message(cursor)
+        if message is not None:
+            await websocket.send_json(message)
+
+    async def send_history(self, room, websocket, query: HistoryQuery):
+        """Page of the hand history of the room, optionally of one player"""
+        if query.room is not None and query.room != room.name:
+            raise CommandError("Only the history of your room is available", "forbidden")
+        try:
+            decode_cursor(query.cursor)
+        except ValueError:
+            raise CommandError(f"Invalid history cursor {query.cursor!r}", "invalid_cursor")
+        records, cursor = await asyncio.to_thread(
+            self.history.query,
+            room=room.name,
+            player=query.player,
+            cursor=query.cursor,
+            limit=query.limit,
+        )
+        await websocket.send_json(
+            {
                 "type": "game",
-                "data": {"type": "status", "personal": None, "status": self.state},
+                "data": {"type": "history", "hands": records, "cursor": cursor},
             }
-        ).model_dump_json()
-        # logger.info(state_json)
-
-        for user in room.users:
-            await self.send_status(user)
+        )
 
     def get_personal_status(self, websocket):
         seat = self.user_index_by_websocket(websocket)
@@ -132,13 +225,17 @@ class PokerGameEngine(GameEngine):
                 "type": "game",
                 "data": {"type": "error", "error": "game_false_start", "message": f"Cannot start game that is in {self.state.stage} state"},
             }
-            await websocket.send(json.dumps(error))
+            await websocket.send_json(error)
             return
-        self.state = start_game(self.state)
+        self.state = start_game(self.state, self.buy_in, self.small_blind)
+        self.comments_sent = 0
         await self.broadcast_room_state(room)
         await asyncio.sleep(1)
         game_start(self.state.playing, self.deck)
+        self.recorder.begin(room.name, self.state.playing, self.state.setup.seats)
+        self.decision += 1
         await self.broadcast_room_state(room)
+        self.ask_bot_if_needed(room)
 
     async def game_player_command(self, room, websocket, action: PokerAction, seat):
         """Handle in-game command"""
@@ -146,71 +243,219 @@ class PokerGameEngine(GameEngine):
             logger.warn(f"User not in game trying to do some action: {action}")
             return
         try:
+            street = len(self.state.playing.table)
             game_next(
                 self.state.playing, self.deck, UserResponse(action=action, seat=seat)
             )
+            self.recorder.action(street, seat, action)
+            self.decision += 1
             await self.broadcast_room_state(room)
             if self.state.playing.victory:
+                self.recorder.finish(self.state.playing)
                 # we are in victory state, we have to run next round after pause
                 await asyncio.sleep(self.state.setup.windelay)
+                if self.tournament and not await self.tournament_hand_finished(room):
+                    self.waiting_for_players = True
+                    # no hand ends here any more, moves out are applied by other tables
+                    moves = self.tournament.table_waiting(self.table_id, lambda move: self.move_out(room, move))
+                    for move in moves:
+                        await self.move_out(room, move)
+                    await self.broadcast_room_state(room)
+                    return
                 game_next_round(self.state.playing, self.deck)
+                self.recorder.begin(room.name, self.state.playing, self.state.setup.seats)
+                self.decision += 1
                 await self.broadcast_room_state(room)
+            self.ask_bot_if_needed(room)
         except UserCommandError as err:
+            if websocket is None:
+                logger.error(f"Bot at seat {seat} sent a wrong action {action}: {err}")
+                return
             error = {
                 "type": "game",
                 "data": {"type": "error", "error": err.error_type, "message": f"{err}"},
             }
-            await websocket.send(json.dumps(error))
+            await websocket.send_json(error)
+
+    async def tournament_hand_finished(self, room):
+        """Report stacks to the tournament, remove busted players and apply
+        seat moves. Returns False if the table cannot deal the next hand"""
+        seats = self.state.setup.seats
+        players = self.state.playing.players
+        stacks = {
+            seat.websocket_uid: player.stack
+            for seat, player in zip(seats, players)
+            if seat and player
+        }
+        moves = self.tournament.hand_finished(self.table_id, stacks)
+        waiting = self.tournament.waiting_moves()
+        for i, player in enumerate(players):
+            if player and player.stack <= 0:
+                self.set_seat(i, None)
+                players[i] = None
+        for move in moves:
+            await self.move_out(room, move)
+        for move_out, move in waiting:
+            await move_out(move)
+        self.state.playing.small_blind = self.tournament.small_blind()
+        return sum(1 for player in players if player) >= 2
+
+    async def move_out(self, room, move: TableMove):
+        """Release a player moved to another table and hand the seat over"""
+        seat = self.release_player(move.player_id)
+        if self.waiting_for_players:
+            await self.broadcast_room_state(room)
+        if self.tournament.move_handler and seat:
+            await self.tournament.move_handler(move, seat)
+
+    def release_player(self, websocket_uid) -> Optional[Seat]:
+        """Remove a player from the table between hands, the seat is returned"""
+        index = self.seat_index_by_uid(websocket_uid)
+        if index < 0:
+            return None
+        seat = self.seats[index]
+        self.set_seat(index, None)
+        if self.state.playing:
+            self.state.playing.players[index] = None
+        return seat
+
+    async def seat_player(self, room, seat: Seat, stack):
+        """Seat a player moved from another tournament table"""
+        seats = self.state.setup.seats
+        index = next((i for i, taken in enumerate(seats) if taken is None), -1)
+        if index < 0:
+            raise ValueError(f"No free seat for {seat.websocket_uid}")
+        self.set_seat(index, seat)
+        if self.state.playing:
+            self.state.playing.players[index] = PokerPlayer(
+                stack=stack, bet=0, cards=[], folded=True, isAllIn=False
+            )
+        if self.waiting_for_players and sum(1 for p in self.state.playing.players if p) >= 2:
+            self.waiting_for_players = False
+            self.tournament.table_dealing(self.table_id)
+            game_next_round(self.state.playing, self.deck)
+            self.recorder.begin(room.name, self.state.playing, self.state.setup.seats)
+            self.decision += 1
+            self.ask_bot_if_needed(room)
+        await self.broadcast_room_state(room)
+        return index
+
+    def ask_bot_if_needed(self, room):
+        """Request a bot decision if the turn is on an AI seat"""
+        playing = self.state.playing
+        if self.state.stage != "playing" or not playing or playing.victory:
+            return
+        seat = self.state.setup.seats[playing.turn]
+        if not (seat and seat.ai) or self.bot_pending == self.decision:
+            return
+        self.bot_pending = self.decision
+        if self.bot_consumer is None:
+            self.bot_consumer = asyncio.create_task(self.consume_bot_moves(room))
+        asyncio.create_task(self.think(playing.turn, seat.policy, self.decision))
+
+    async def think(self, seat_index, policy, decision):
+        snapshot = snapshot_for_seat(self.state.playing, seat_index)
+        action = await self.bot_runner.decide(policy, snapshot)
+        self.bot_channel.post(BotMove(seat=seat_index, decision=decision, action=action))
+
+    async def consume_bot_moves(self, room):
+        while True:
+            move = await self.bot_channel.receive()
+            if move.decision != self.decision:
+                logger.info(f"Dropping stale bot move {move}")
+                continue
+            try:
+                await self.game_player_command(room, None, move.action, move.seat)
+            except Exception as e:
+                logger.error(f"Failed to apply bot move {move}: {e}")
+
+    def stop_bots(self):
+        if self.bot_consumer is not None:
+            self.bot_consumer.cancel()
+            self.bot_consumer = None
+
+    def status_json(self, seat):
+        """PokerGameStatus as seen from the seat, spliced from cached fragments"""
+        fragments = self.fragments
+        setup = self.state.setup
+        setup_json = splice_object(
+            fragments.get("setup", setup, lambda: setup.model_dump_json(exclude={"seats"})),
+            {"seats": fragments.items("seats", setup.seats, lambda item, _: item.model_dump_json())},
+        )
+        playing = self.state.playing
+        playing_json = "null"
+        if playing:
+            hidden = None
+            if not playing.victory:
+                allinRound = playing.isAllinRound()
+                hidden = lambda i, player: i != seat and not player.is_cards_visible_to_everyone(allinRound)
+            players_json = fragments.items(
+                "players",
+                playing.players,
+                lambda player, hide: (player.copy_hide_cards() if hide else player).model_dump_json(),
+                hidden,
+            )
+            playing_json = splice_object(
+                fragments.get("playing", playing, lambda: playing.model_dump_json(exclude={"players"})),
+                {"players": players_json},
+            )
+        return splice_object(
+            "{}",
+            {"stage": json.dumps(self.state.stage), "setup": setup_json, "playing": playing_json},
+        )
+
+    def status_message(self, personal):
+        data = splice_object(
+            '{"type":"status"}',
+            {"personal": json.dumps(personal), "status": self.status_json(personal["seat"])},
+        )
+        return splice_object('{"type":"game"}', {"data": data})
+
+    def spectator_json(self):
+        return self.status_message({"seat": -1, "websocket_uid": None, "expected_actions": []})
 
     async def send_status(self, websocket):
         """Send status message to specific recipient"""
-        state_share = self.state
-        if self.state.playing and not self.state.playing.victory:
-            state_copy = self.state.model_copy(deep=True)
-            seat = self.user_index_by_websocket(websocket)
-            allinRound = self.state.playing.isAllinRound()
-            state_copy.playing.players = [player.copy_hide_cards_if_needed(allinRound, skip=i==seat) if player else None for i, player in enumerate(state_copy.playing.players)]
-            state_share = state_copy
-        state_json = PokerGameStatusMessage(
-            **{
-                "type": "game",
-                "data": {
-                    "type": "status",
-                    "personal": self.get_personal_status(websocket),
-                    "status": state_share,
-                },
-            }
-        ).model_dump_json()
-        await websocket.send(state_json)
+        if self.user_index_by_websocket(websocket) < 0:
+            await self.spectator_feed.send_to(websocket)
+            return
+        personal = self.get_personal_status(websocket)
+        await websocket.send(self.status_message(personal), kind="game.status")
 
     async def get_status(self, websocket, userinfo: UserInfo):
         logger.info(f"User {userinfo.name} requested poker game status, sending...")
         await self.send_status(websocket)
-
-    def get_websocket_uid_mapping(self, websocket):
-        """Mapping between non-serializable websocket objects
-        and serializable simplified UIDs that consist of 16
-        alphanumeric characters"""
-        if websocket in self.websocket_uid_mapping:
-            return self.websocket_uid_mapping[websocket]
-        genereated = utils.generate_random_string(16)
-        self.websocket_uid_mapping[websocket] = genereated
-        return genereated
-
-    def user_index_by_websocket(self, websocket):
-        """Get user seat, return -1 if the user has no seat"""
-        uid = self.get_websocket_uid_mapping(websocket)
-        for i, seat in enumerate(self.state.setup.seats):
-            if seat and seat.websocket_uid == uid:
-                return i
-        return -1
+        await self.send_comments(websocket, 0)
+
+    @property
+    def seats(self):
+        return self.state.setup.seats
+
+    def in_game(self):
+        return self.state.stage == "playing"
+
+    def orphan_seats(self):
+        # tournament tables seat players of other rooms
+        return [] if self.tournament else super().orphan_seats()
+
+    def stuck(self):
+        playing = self.state.playing
+        if not self.in_game() or playing is None or playing.victory or self.waiting_for_players:
+            return False
+        return not self.is_live(self.seats[playing.turn])
+
+    async def reset_game(self, room):
+        self.stop_bots()
+        self.decision += 1
+        self.waiting_for_players = False
+        self.state.stage = "setup"
+        self.state.playing = None
+        await self.broadcast_room_state(room)
 
     async def user_list_changed(self, room, added, removed):
-        for user in removed:
-            undex = self.user_index_by_websocket(user)
-            if undex >= 0:
-                self.state.setup.seats[undex] = None
-        await self.broadcast_room_state(room)
+        if not room.users:
+            self.stop_bots()
+        await super().user_list_changed(room, added, removed)
 
     async def update_setup(self, updates, room):
         if upd := updates.get("gameName"):
@@ -220,54 +465,91 @@ class PokerGameEngine(GameEngine):
     async def take_seat(self, room, websocket, userinfo: UserInfo, seat_index):
         """Handle take seat command"""
         logger.info(f"User {userinfo.name} takes seat {seat_index}")
-        self.state.setup.seats[seat_index] = Seat(
-            websocket_uid=self.get_websocket_uid_mapping(websocket),
-            info=self.userinfo_to_dict(userinfo),
-            ai=False,
+        self.set_seat(
+            seat_index,
+            Seat(
+                websocket_uid=self.get_websocket_uid_mapping(websocket),
+                info=self.userinfo_to_dict(userinfo),
+                ai=False,
+            ),
         )
         await self.broadcast_room_state(room)
 
-    async def handle_message(self, room, websocket, message, userinfo):
-        """Handle game message"""
-        if message.get("type") == "get_status":
-            await self.get_status(websocket, userinfo)
-        if message.get("type") == "action":
-            await self.game_player_command(
-                room,
-                websocket,
-                PokerAction.model_validate(message.get("data")),
-                self.user_index_by_websocket(websocket),
-            )
-        if message.get("type") == "start":
-            await self.game_start(room, websocket)
-        if message.get("type") == "change_options":
-            if self.state.stage != "setup":
-                await utils.send_error(
-                    websocket, "Cannot change options while not in setup state"
-                )
-            else:
-                await self.update_setup(message.get("data"), room)
-        if message.get("type") == "take_seat":
-            seat_to_take = message.get("data")
-            # free any seat if it was already taken by this user
-            taken = self.user_index_by_websocket(websocket)
-            if taken >= 0:
-                self.state.setup.seats[taken] = None
-            await self.take_seat(room, websocket, userinfo, seat_to_take)
-
-        if message.get("type") == "chat":
-            text = message.get("text")
-            if text:
-                for user in room.users:
-                    await user.send(
-                        json.dumps(
-                            {
-                                "type": "game",
-                                "data": {
-                                    "type": "chat",
-                                    "sender": self.userinfo_to_dict(userinfo),
-                                    "text": f"{text}",
-                                },
-                            }
-                        )
-                    )
+    async def add_bot(self, room, websocket, request: AddBotRequest):
+        """Put a bot on the given seat, or on the first free one"""
+        if self.state.stage != "setup":
+            await utils.send_error(websocket, "Cannot add bots while not in setup state")
+            return
+        seat_index = request.seat
+        policy = request.policy
+        seats = self.state.setup.seats
+        if seat_index is None:
+            seat_index = next((i for i, seat in enumerate(seats) if seat is None), -1)
+        if seat_index < 0 or seat_index >= len(seats) or seats[seat_index] is not None:
+            await utils.send_error(websocket, f"Seat {seat_index} is not available for a bot")
+            return
+        self.set_seat(
+            seat_index,
+            Seat(
+                websocket_uid=f"bot-{seat_index}",
+                info=UserInfo(name=f"Bot {seat_index + 1}"),
+                ai=True,
+                policy=policy,
+            ),
+        )
+        await self.broadcast_room_state(room)
+
+    async def remove_bot(self, room, websocket, seat_index):
+        seats = self.state.setup.seats
+        if self.state.stage != "setup" or not (seats[seat_index] and seats[seat_index].ai):
+            await utils.send_error(websocket, f"No bot to remove at seat {seat_index}")
+            return
+        self.set_seat(seat_index, None)
+        await self.broadcast_room_state(room)
+
+    # commands
+
+    @commands.handler("get_status")
+    async def handle_get_status(self, room, websocket, userinfo, _):
+        await self.get_status(websocket, userinfo)
+
+    @commands.handler("history", Optional[HistoryQuery])
+    async def handle_history(self, room, websocket, userinfo, query):
+        await self.send_history(room, websocket, query or HistoryQuery())
+
+    @commands.handler("get_comments", int, payload="cursor", default=0)
+    async def handle_get_comments(self, room, websocket, userinfo, cursor):
+        if websocket not in self.live_members_of(room):
+            raise CommandError("Comments are not sent to delayed spectators", "spectator_delayed")
+        await self.send_comments(websocket, cursor)
+
+    @commands.handler("action", PokerAction)
+    async def handle_action(self, room, websocket, userinfo, action):
+        await self.game_player_command(room, websocket, action, self.user_index_by_websocket(websocket))
+
+    @commands.handler("start")
+    async def handle_start(self, room, websocket, userinfo, _):
+        await self.game_start(room, websocket)
+
+    @commands.handler("change_options", Dict[str, Any])
+    async def handle_change_options(self, room, websocket, userinfo, options):
+        if self.state.stage != "setup":
+            await utils.send_error(websocket, "Cannot change options while not in setup state")
+        else:
+            await self.update_setup(options, room)
+
+    @commands.handler("take_seat", SeatIndex)
+    async def handle_take_seat(self, room, websocket, userinfo, seat_to_take):
+        # free any seat if it was already taken by this user
+        self.free_seat_of(websocket)
+        await self.take_seat(room, websocket, userinfo, seat_to_take)
+
+    @commands.handler("add_bot", Union[SeatIndex, AddBotRequest, None])
+    async def handle_add_bot(self, room, websocket, userinfo, request):
+        if not isinstance(request, AddBotRequest):
+            request = AddBotRequest(seat=request)
+        await self.add_bot(room, websocket, request)
+
+    @commands.handler("remove_bot", SeatIndex)
+    async def handle_remove_bot(self, room, websocket, userinfo, seat_index):
+        await self.remove_bot(room, websocket, seat_index)
@@ -0,0 +1,376 @@
+"""Multi-table tournament coordinator.
+
+Keeps track of which player is assigned to which table, eliminates busted
+players, breaks and balances tables, and follows the blind schedule.
+
+Tables are only changed between hands: seat moves are queued for the
+table the player physically sits at and handed out by hand_finished()
+of that table. A table left with one player deals no more hands, so it
+reports itself with table_waiting() and moves out of it are handed out
+by waiting_moves() right after the next hand_finished() of any table.
+Decisions are incremental: tables are kept in buckets by
+player count, so the smallest and the largest table are found without
+looking at every table.
+
+This is a library, no server command creates a tournament yet: the
+application creates the rooms, sets `tournament` and `table_id` of their
+engines and assigns `move_handler`, which moves the player's session to
+the destination room and calls `seat_player` on its engine.
+
+Benchmark:
+
+    python -m poker.tournament --tables 3000
+"""
+
+import argparse
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from poker.pokergame import Seat
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLE_SIZE = 9
+
+
+@dataclass
+class BlindLevel:
+    small_blind: int
+    duration: float  # seconds
+
+
+DEFAULT_BLIND_SCHEDULE = [
+    BlindLevel(small_blind=10, duration=600),
+    BlindLevel(small_blind=15, duration=600),
+    BlindLevel(small_blind=25, duration=600),
+    BlindLevel(small_blind=50, duration=600),
+    BlindLevel(small_blind=100, duration=600),
+    BlindLevel(small_blind=200, duration=600),
+    BlindLevel(small_blind=400, duration=600),
+]
+
+
+@dataclass
+class TableMove:
+    player_id: str
+    from_table: str
+    to_table: str
+    stack: int
+
+
+@dataclass
+class TournamentPlayer:
+    player_id: str
+    stack: int
+    table_id: Optional[str] = None  # table the player is assigned to
+    seated_at: Optional[str] = None  # table the player actually sits at
+    position: Optional[int] = None  # finishing position, set on elimination
+
+
+@dataclass
+class TournamentTable:
+    table_id: str
+    players: Set[str] = field(default_factory=set)
+    # moves out of this table, applied when its current hand is over
+    pending: Dict[str, TableMove] = field(default_factory=dict)
+
+
+class TournamentCoordinator:
+    def __init__(
+        self,
+        buy_in=1500,
+        table_size=DEFAULT_TABLE_SIZE,
+        blind_schedule: List[BlindLevel] = DEFAULT_BLIND_SCHEDULE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.buy_in = buy_in
+        self.table_size = table_size
+        self.blind_schedule = blind_schedule
+        self.clock = clock
+        self.started_at = None
+        self.players: Dict[str, TournamentPlayer] = {}
+        self.tables: Dict[str, TournamentTable] = {}
+        # table ids by number of assigned players
+        self.by_size: List[Set[str]] = [set() for _ in range(table_size + 1)]
+        self.active = 0
+        self.eliminated: List[str] = []
+        # called with a move and the seat released at the source table
+        self.move_handler: Optional[Callable[[TableMove, "Seat"], Awaitable[None]]] = None
+        # tables that cannot deal a hand, with the callback applying a move out of them
+        self.waiting: Dict[str, Callable[[TableMove], Awaitable[None]]] = {}
+        # waiting tables with pending moves
+        self.woken: Set[str] = set()
+
+    # registration and start
+
+    def register(self, player_id):
+        if self.started_at is not None:
+            raise ValueError("Tournament already started")
+        self.players[player_id] = TournamentPlayer(player_id=player_id, stack=self.buy_in)
+
+    def start(self, table_ids: List[str]) -> Dict[str, List[str]]:
+        """Seat everybody round-robin, return players per table"""
+        needed = math.ceil(len(self.players) / self.table_size)
+        if len(table_ids) < needed:
+            raise ValueError(f"{len(self.players)} players need {needed} tables, got {len(table_ids)}")
+        table_ids = table_ids[:needed]
+        for table_id in table_ids:
+            self.tables[table_id] = TournamentTable(table_id=table_id)
+        for i, player in enumerate(self.players.values()):
+            table = self.tables[table_ids[i % needed]]
+            table.players.add(player.player_id)
+            player.table_id = player.seated_at = table.table_id
+        for table in self.tables.values():
+            self.by_size[len(table.players)].add(table.table_id)
+        self.active = len(self.players)
+        self.started_at = self.clock()
+        return {table_id: sorted(self.tables[table_id].players) for table_id in table_ids}
+
+    # blinds
+
+    def level(self) -> int:
+        if self.started_at is None:
+            return 0
+        elapsed = self.clock() - self.started_at
+        for i, level in enumerate(self.blind_schedule):
+            if elapsed < level.duration:
+                return i
+            elapsed -= level.duration
+        return len(self.blind_schedule) - 1
+
+    def small_blind(self) -> int:
+        return self.blind_schedule[self.level()].small_blind
+
+    # hands
+
+    def hand_finished(self, table_id, stacks: Dict[str, int]) -> List[TableMove]:
+        """Report stacks after a hand, get the moves to apply at this table now"""
+        table = self.tables.get(table_id)
+        if table is None:
+            return []
+        for player_id, stack in stacks.items():
+            player = self.players.get(player_id)
+            if player and player.position is None:
+                player.stack = stack
+                if stack <= 0:
+                    self.eliminate(player)
+        return self._take_pending(table)
+
+    def table_waiting(self, table_id, move_out: Callable[[TableMove], Awaitable[None]]) -> List[TableMove]:
+        """Report a table that cannot deal the next hand, get the moves to
+        apply at it now. Later moves out of it are returned by waiting_moves()
+        together with move_out, which applies a move at that table"""
+        table = self.tables.get(table_id)
+        if table is None:
+            return []
+        self.waiting[table_id] = move_out
+        return self._take_pending(table)
+
+    def table_dealing(self, table_id):
+        """Report a waiting table that deals hands again"""
+        self.waiting.pop(table_id, None)
+
+    def waiting_moves(self) -> List[Tuple[Callable[[TableMove], Awaitable[None]], TableMove]]:
+        """Moves out of waiting tables, to apply right after hand_finished()"""
+        moves = []
+        for table_id in self.woken:
+            move_out = self.waiting.get(table_id)
+            if move_out is not None:
+                moves.extend((move_out, move) for move in self._take_pending(self.tables[table_id]))
+        self.woken.clear()
+        return moves
+
+    def _take_pending(self, table: TournamentTable) -> List[TableMove]:
+        moves = list(table.pending.values())
+        table.pending.clear()
+        for move in moves:
+            self.players[move.player_id].seated_at = move.to_table
+            move.stack = self.players[move.player_id].stack
+        if not table.players:
+            # broken table, nobody sits there any more
+            self.by_size[0].discard(table.table_id)
+            self.tables.pop(table.table_id)
+            self.waiting.pop(table.table_id, None)
+        return moves
+
+    def eliminate(self, player: TournamentPlayer):
+        player.position = self.active
+        self.active -= 1
+        self.eliminated.append(player.player_id)
+        table = self.tables[player.table_id]
+        self._resize(table, lambda: table.players.discard(player.player_id))
+        self.tables[player.seated_at].pending.pop(player.player_id, None)
+        logger.info(f"Player {player.player_id} eliminated at position {player.position}")
+        if self.active > 1:
+            self.rebalance()
+
+    def winner(self) -> Optional[str]:
+        if self.active != 1:
+            return None
+        return next(p.player_id for p in self.players.values() if p.position is None)
+
+    # balancing
+
+    def _resize(self, table: TournamentTable, change):
+        self.by_size[len(table.players)].discard(table.table_id)
+        change()
+        self.by_size[len(table.players)].add(table.table_id)
+
+    def _smallest(self, exclude=None) -> Optional[TournamentTable]:
+        """Smallest table that still has players, empty tables are broken"""
+        for bucket in self.by_size[1:]:
+            for table_id in bucket:
+                if table_id != exclude:
+                    return self.tables[table_id]
+        return None
+
+    def _largest(self) -> Optional[TournamentTable]:
+        for bucket in reversed(self.by_size[1:]):
+            for table_id in bucket:
+                return self.tables[table_id]
+        return None
+
+    def _tables_count(self):
+        return len(self.tables) - len(self.by_size[0])
+
+    def _move(self, player_id, destination: TournamentTable):
+        player = self.players[player_id]
+        source = self.tables[player.table_id]
+        self._resize(source, lambda: source.players.discard(player_id))
+        self._resize(destination, lambda: destination.players.add(player_id))
+        player.table_id = destination.table_id
+        seated = self.tables[player.seated_at]
+        if player.seated_at == destination.table_id:
+            # moved back before the previous move was applied
+            seated.pending.pop(player_id, None)
+        else:
+            seated.pending[player_id] = TableMove(
+                player_id=player_id,
+                from_table=player.seated_at,
+                to_table=destination.table_id,
+                stack=player.stack,
+            )
+            if player.seated_at in self.waiting:
+                self.woken.add(player.seated_at)
+
+    def rebalance(self):
+        """Break one table if the others have room, then even out table sizes"""
+        needed = math.ceil(self.active / self.table_size)
+        if self._tables_count() > needed:
+            broken = self._smallest()
+            leaving = list(broken.players)
+            for player_id in leaving:
+                self._move(player_id, self._smallest(exclude=broken.table_id))
+            logger.info(f"Table {broken.table_id} broken, {len(leaving)} players moved")
+        while True:
+            largest = self._largest()
+            smallest = self._smallest()
+            if len(largest.players) - len(smallest.players) <= 1:
+                break
+            self._move(next(iter(largest.players)), smallest)
+
+    # leaderboard
+
+    def leaderboard(self, top: Optional[int] = None) -> List[Dict]:
+        active = sorted(
+            (p for p in self.players.values() if p.position is None),
+            key=lambda p: p.stack,
+            reverse=True,
+        )
+        board = [
+            {"player_id": p.player_id, "stack": p.stack, "table": p.table_id, "position": i + 1}
+            for i, p in enumerate(active)
+        ]
+        if top is not None and len(board) >= top:
+            return board[:top]
+        for player_id in reversed(self.eliminated):
+            p = self.players[player_id]
+            board.append({"player_id": p.player_id, "stack": 0, "table": None, "position": p.position})
+            if top is not None and len(board) >= top:
+                break
+        return board
+
+    def describe(self):
+        return f"tournament[{self.active}/{len(self.players)} players, {self._tables_count()} tables, level {self.level()}]"
+
+
+def benchmark(tables, table_size=DEFAULT_TABLE_SIZE, seed=0):
+    """Bust random players until one is left, applying moves between hands.
+    Tables left with one player wait, as the engines do, until a move
+    fills or breaks them"""
+    rng = random.Random(seed)
+    coordinator = TournamentCoordinator(table_size=table_size)
+    for i in range(tables * table_size):
+        coordinator.register(f"p{i}")
+    # players physically sitting at each table, as the engines would see them
+    seated = {table_id: set(players) for table_id, players in coordinator.start([f"t{i}" for i in range(tables)]).items()}
+    dealing = set(seated)
+
+    async def move_out(move):
+        pass  # the benchmark applies moves itself
+
+    def apply(table_id, moves):
+        nonlocal moves_count
+        for move in moves:
+            seated[table_id].discard(move.player_id)
+            seated[move.to_table].add(move.player_id)
+            moves_count += 1
+            if len(seated[move.to_table]) >= 2 and move.to_table not in dealing:
+                coordinator.table_dealing(move.to_table)
+                dealing.add(move.to_table)
+        if not seated[table_id] and table_id not in coordinator.tables:
+            del seated[table_id]
+            dealing.discard(table_id)
+
+    hands = 0
+    moves_count = 0
+    elapsed = 0.0
+    max_spread = 0
+    while coordinator.winner() is None:
+        table_id = rng.choice(list(dealing))
+        players = seated[table_id]
+        stacks = {player_id: coordinator.players[player_id].stack for player_id in players}
+        alive = [p for p in players if coordinator.players[p].position is None]
+        # one player busts, sometimes two lose an all-in against a third
+        for player_id in rng.sample(alive, min(len(alive) - 1, 2 if rng.random() < 0.2 else 1)):
+            stacks[player_id] = 0
+        start = time.perf_counter()
+        applied = coordinator.hand_finished(table_id, stacks)
+        waiting = coordinator.waiting_moves()
+        elapsed += time.perf_counter() - start
+        hands += 1
+        for player_id, stack in stacks.items():
+            if stack <= 0:
+                players.discard(player_id)
+        apply(table_id, applied)
+        for _, move in waiting:
+            apply(move.from_table, [move])
+        if table_id in seated and len(players) < 2 and coordinator.winner() is None:
+            dealing.discard(table_id)
+            apply(table_id, coordinator.table_waiting(table_id, move_out))
+        if hands % 997 == 0:
+            sizes = [len(t.players) for t in coordinator.tables.values() if t.players]
+            max_spread = max(max_spread, max(sizes) - min(sizes))
+    return {
+        "players": tables * table_size,
+        "tables": tables,
+        "hands": hands,
+        "moves": moves_count,
+        "us_per_hand": round(elapsed / hands * 1e6, 1),
+        "max_spread": max_spread,
+        "winner": coordinator.winner(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tournament coordinator benchmark")
+    parser.add_argument("--tables", type=int, default=2000)
+    parser.add_argument("--table-size", type=int, default=DEFAULT_TABLE_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(benchmark(args.tables, table_size=args.table_size, seed=args.seed))
@@ -0,0 +1,95 @@
+"""Token bucket rate limits of inbound commands, per connection.
+
+Every connection has one bucket per command type ("init.create",
+"game.chat", ...). A bucket refills at `rate` tokens per second up to
+`burst`, every command takes one token. Commands without their own limit
+share the "*" bucket. A command that finds its bucket empty is refused
+with a "rate_limited" error telling the client when to retry.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from commands import CommandError
+
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    # command: (tokens per second, burst)
+    "game.chat": (2, 5),
+    "init.create": (0.5, 3),
+    "init.change_info": (1, 5),
+    "init.subscribe": (2, 8),
+    "*": (20, 40),
+}
+
+
+def command_key(message) -> str:
+    """Type of an inbound message, e.g. "game.chat" """
+    kind = message.get("type", "other")
+    if kind == "init":
+        return f"init.{message.get('command')}"
+    data = message.get("data")
+    if kind == "game" and isinstance(data, dict):
+        return f"game.{data.get('type')}"
+    return kind
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now) -> float:
+        """Take a token, returns 0 or the seconds until one is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def parse_limit(text: str) -> Tuple[str, Tuple[float, float]]:
+    """"game.chat=2/5" -> ("game.chat", (2.0, 5.0))"""
+    key, _, value = text.partition("=")
+    rate, _, burst = value.partition("/")
+    return key, (float(rate), float(burst or rate))
+
+
+@dataclass
+class RateLimits:
+    limits: Dict[str, Tuple[float, float]] = field(default_factory=lambda: dict(DEFAULT_LIMITS))
+    throttled: Dict[str, int] = field(default_factory=dict)
+
+    def check(self, connection, message):
+        """Take a token for the message from the buckets of the connection,
+        raises CommandError when the client has to slow down"""
+        buckets = connection.buckets
+        if buckets is None:
+            buckets = connection.buckets = {}
+        key = command_key(message)
+        if key not in self.limits:
+            key = "*"
+        limit = self.limits.get(key)
+        if limit is None:
+            return
+        now = time.monotonic()
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*limit, now)
+        wait = bucket.take(now)
+        if wait:
+            self.throttled[key] = self.throttled.get(key, 0) + 1
+            raise CommandError(
+                f"Too many {key} commands, retry in {wait:.2f}s",
+                "rate_limited",
+                command=key,
+                retry_after=round(wait, 3),
+            )
+
+    def describe(self):
+        return dict(self.throttled)
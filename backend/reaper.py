@@ -0,0 +1,165 @@
+"""Reaper of orphaned room state.
+
+Disconnects clean up after themselves, the reaper catches what slips
+through: members whose session is gone, engine indexes of people who left
+the room, seats of people who left (between games), games that wait for a
+seat nobody can act on, and rooms left empty. Every pass also estimates
+the memory of every room by walking its objects with sys.getsizeof, so a
+room that keeps growing shows up before the process runs out of memory.
+"""
+
+import asyncio
+import logging
+import sys
+import time
+import types
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Dict, Set
+
+from connection import Connection, RoomChannel
+
+logger = logging.getLogger(__name__)
+
+# not followed when measuring a room: code, members and running tasks
+OPAQUE = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    asyncio.Future,
+    asyncio.Handle,
+    Connection,
+    RoomChannel,
+)
+
+
+@dataclass
+class ReaperPolicy:
+    # seconds between passes
+    interval: float = 30.0
+    # seconds a game may wait for a seat nobody can act on before it is reset
+    stuck_after: float = 120.0
+
+
+def deep_sizeof(obj, skip: Set[int]) -> int:
+    """Bytes of the object and everything it references, objects whose id
+    is in skip are not counted, neither are their references"""
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in skip or isinstance(obj, OPAQUE):
+            continue
+        skip.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+def room_memory(room) -> int:
+    """Estimated bytes held by a room and its engine, without its members
+    and state shared with other rooms"""
+    engine = room.game_engine
+    skip = {id(getattr(engine, name, None)) for name in engine.shared}
+    return deep_sizeof(room, skip)
+
+
+class Reaper:
+    def __init__(self, policy: ReaperPolicy = None):
+        self.policy = policy or ReaperPolicy()
+        # room name -> when it was first seen stuck
+        self.stuck_since: Dict[str, float] = {}
+        # room name -> estimated bytes, from the last pass
+        self.memory: Dict[str, int] = {}
+        self.freed = Counter()
+        self.passes = 0
+        self.seconds = 0.0
+
+    async def run(self, server):
+        while True:
+            await asyncio.sleep(self.policy.interval)
+            try:
+                await self.sweep(server)
+            except Exception as e:
+                logger.error(f"Reaper pass failed: {e}")
+
+    def orphan_members(self, server, room):
+        """Members whose session is gone, or does not point back to the
+        room, with whether the session is still connected"""
+        for member in list(room.users):
+            if isinstance(member, RoomChannel):
+                session = member.connection
+                if session not in server.sessions:
+                    yield member, False
+                elif session.watched().get(room.name) is not member:
+                    yield member, True
+            elif member not in server.sessions:
+                yield member, False
+            elif member.room is not room:
+                yield member, True
+
+    async def sweep(self, server):
+        start = time.perf_counter()
+        now = time.monotonic()
+        removed = self.freed["rooms"]
+        for room in list(server.rooms):
+            engine = room.game_engine
+            for member, connected in list(self.orphan_members(server, room)):
+                logger.warning(f"Reaping member {member} of room {room.name}")
+                if connected:
+                    # its uid and seat belong to the room it is in now, the
+                    # engine indexes of this room are freed below
+                    room.users.pop(member, None)
+                else:
+                    await server.remove_member(room, member)
+                self.freed["members"] += 1
+            if room not in server.rooms:
+                continue
+            if engine.stuck():
+                since = self.stuck_since.setdefault(room.name, now)
+                if now - since >= self.policy.stuck_after:
+                    logger.warning(f"Resetting stuck game in room {room.name}")
+                    await engine.reset_game(room)
+                    self.freed["stuck_games"] += 1
+                    self.stuck_since.pop(room.name)
+            else:
+                self.stuck_since.pop(room.name, None)
+            freed = engine.reap_orphans(room)
+            if freed:
+                logger.info(f"Freed orphaned state of room {room.name}: {freed}")
+                self.freed.update(freed)
+                if freed.get("seats"):
+                    await engine.broadcast_room_state(room)
+            if room.should_be_removed():
+                await server.remove_room(room)
+                self.freed["rooms"] += 1
+        if self.freed["rooms"] != removed:
+            await server.broadcast_rooms()
+        names = {room.name for room in server.rooms}
+        self.stuck_since = {name: since for name, since in self.stuck_since.items() if name in names}
+        self.memory = {room.name: room_memory(room) for room in server.rooms}
+        self.passes += 1
+        self.seconds += time.perf_counter() - start
+
+    def describe(self):
+        largest = sorted(self.memory.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            "passes": self.passes,
+            "ms": round(self.seconds * 1000, 1),
+            "freed": dict(self.freed),
+            "stuck": len(self.stuck_since),
+            "room_bytes": sum(self.memory.values()),
+            "largest_rooms": dict(largest),
+        }
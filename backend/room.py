@@ -1,7 +1,8 @@
 import asyncio
+import uuid
 from dataclasses import dataclass
-import json
 import logging
+from connection import batched, broadcast_json
 from game_engine import UserInfo, ChatGameEngine, GameEngine
 import utils
 
@@ -13,66 +14,61 @@ def generate_user_info():
 class Room:
     def __init__(self, name, game_engine):
         self.name = name
-        self.users = {}  # Use a dictionary to store user information
+        # members (sessions and room channels) -> stable id, presence events refer to it
+        self.users = {}
+        self.next_member_id = 1
         self.game_engine: GameEngine = game_engine
+        # chat history of this room, a room created later with the same name starts empty
+        self.history_key = f"{name}/{uuid.uuid4().hex[:12]}"
 
     def should_be_removed(self):
         return len(self.users) == 0
 
-    async def add(self, websocket, info: UserInfo):
-        self.users[websocket] = info
-        await self.game_engine.user_list_changed(self, [websocket], [])
-        await self.notify_user_list_change()
+    async def add(self, websocket):
+        member_id = self.users[websocket] = self.next_member_id
+        self.next_member_id += 1
+        others = [user for user in self.users if user is not websocket]
+        # the state broadcast of the engine and the join event go out as one frame
+        async with batched(self.users):
+            await self.game_engine.user_list_changed(self, [websocket], [])
+            await broadcast_json(others, {"type": "user_joined", "data": self.member(member_id, websocket.info)})
 
     async def remove(self, websocket):
-        if websocket in self.users:
-            self.users.pop(websocket)
-        await self.game_engine.user_list_changed(self, [], [websocket])
-        await self.notify_user_list_change()
+        member_id = self.users.pop(websocket, None)
+        async with batched(self.users):
+            await self.game_engine.user_list_changed(self, [], [websocket])
+            if member_id is not None:
+                await broadcast_json(self.users, {"type": "user_left", "data": {"id": member_id}})
 
-    async def update_info(self, websocket, info: UserInfo):
+    async def update_info(self, websocket):
         if websocket in self.users:
-            self.users[websocket] = info
-            await self.notify_user_list_change()
+            member = self.member(self.users[websocket], websocket.info)
+            await broadcast_json(self.users, {"type": "user_updated", "data": member})
         else:
             logger.error(f"User {websocket} is not in a group {self.name} but trying to update it's info")
 
+    @staticmethod
+    def member(member_id, info: UserInfo):
+        return {
+            "id": member_id,
+            "name": info.name,
+            "gender": info.gender,
+            "avatar": info.avatar,
+        }
+
     async def send_game_message(self, websocket, message):
-        # logger.warn(f"websocket: {websocket}")
-        userinfo = self.users.get(websocket)
-        await self.game_engine.handle_message(self, websocket, message, userinfo)
+        await self.game_engine.handle_message(self, websocket, message, websocket.info)
 
     def status(self, websocket):
+        """Full member list, sent on entry. Later changes are sent as
+        user_joined, user_left and user_updated events"""
         if not websocket in self.users:
             logger.critical(f"Status error: user {websocket.remote_address} is not in a room '{self.name}'")
-        user_list = [
-            {
-                "name": user_info.name,
-                "gender": user_info.gender,
-                "avatar": user_info.avatar,
-            }
-            for user_info in self.users.values()
-        ]
         return {
             "game": self.game_engine.game_name(),
-            "users": user_list
+            "member_id": self.users.get(websocket),
+            "users": [self.member(member_id, user.info) for user, member_id in self.users.items()],
         }
 
-    async def notify_user_list_change(self):
-        user_list = [
-            {
-                "name": user_info.name,
-                "gender": user_info.gender,
-                "avatar": user_info.avatar,
-            }
-            for user_info in self.users.values()
-        ]
-        await asyncio.gather(
-            *(
-                user.send(json.dumps({"type": "user_list", "data": user_list}))
-                for user in self.users
-            )
-        )
-
     def describe(self):
         return f"{self.name}[{len(self.users)}:{self.game_engine.game_name()}]"
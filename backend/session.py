@@ -0,0 +1,119 @@
+"""Per-connection state.
+
+A Session is the connection of one client together with everything the
+server keeps about it: identity, the room it entered, the rooms it
+watches, its seat and its outbound queue. The server, rooms and engines
+hold the session itself instead of dicts keyed by connection.
+
+Memory of idle sessions, compared with the connection and server dicts
+they replace:
+
+    python session.py --connections 50000
+"""
+
+import argparse
+import statistics
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from connection import Connection, RoomChannel
+from game_engine import UserInfo
+import utils
+
+
+class Session(Connection):
+    __slots__ = ("info", "room", "channels", "uid", "seat", "last_seen", "released")
+
+    def __init__(self, websocket, info: UserInfo):
+        super().__init__(websocket)
+        self.info = info
+        self.room = None
+        # watched rooms, room name -> RoomChannel, None until the first subscription
+        self.channels: Optional[Dict[str, RoomChannel]] = None
+        # serializable id of the session in seats, given by the first engine that needs it
+        self.uid: Optional[str] = None
+        # seat in self.room, -1 without one
+        self.seat = -1
+        # monotonic time of the last inbound message, see lifecycle.Lifecycle
+        self.last_seen = 0.0
+        # set when the lifecycle releases it, its messages are not handled any more
+        self.released = False
+
+    def watched(self) -> Dict[str, RoomChannel]:
+        return self.channels or {}
+
+    def __repr__(self):
+        return f"Session({self.remote_address}, {self.info.name})"
+
+
+# measurement
+
+
+class _Websocket:
+    """Stands in for an accepted websocket"""
+
+    subprotocol = None
+    extensions = ()
+    remote_address = ("127.0.0.1", 0)
+
+
+@dataclass
+class _BaselineUserInfo:
+    """UserInfo before sessions, without slots"""
+
+    name: str
+    gender: int = 0
+    avatar: str = ""
+
+
+class _BaselineConnection(Connection):
+    """Connection before sessions, which created the rate limit buckets up front"""
+
+    __slots__ = ()
+
+    def __init__(self, websocket):
+        super().__init__(websocket)
+        self.buckets = {}
+
+
+def _measure(count, make):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = make(count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size / count
+
+
+def _baseline(count):
+    # an idle lobby connection before sessions: the connection plus its
+    # entries in the server's userRoomMapping and userInfoMapping
+    room_mapping, info_mapping = {}, {}
+    for _ in range(count):
+        connection = _BaselineConnection(_Websocket)
+        room_mapping[connection] = None
+        info_mapping[connection] = _BaselineUserInfo(f"Unknown_{utils.generate_random_string()}")
+    return room_mapping, info_mapping
+
+
+def _sessions(count):
+    sessions = set()
+    for _ in range(count):
+        sessions.add(Session(_Websocket, UserInfo(f"Unknown_{utils.generate_random_string()}")))
+    return sessions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory per idle connection")
+    parser.add_argument("--connections", type=int, default=50_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    baseline = [_measure(args.connections, _baseline) for _ in range(args.runs)]
+    sessions = [_measure(args.connections, _sessions) for _ in range(args.runs)]
+    print(f"bytes per idle connection, {args.connections} connections, {args.runs} runs, mean and stdev")
+    print(f"before sessions {statistics.mean(baseline):.0f} +- {statistics.pstdev(baseline):.1f}")
+    print(f"sessions        {statistics.mean(sessions):.0f} +- {statistics.pstdev(sessions):.1f}")
+    print(f"saved           {(1 - statistics.mean(sessions) / statistics.mean(baseline)) * 100:.0f}%")
@@ -0,0 +1,141 @@
+"""Microbenchmark of outbound status messages at 9 seats.
+
+Compares the validating construction of status messages with the
+trusted construction path and with the spliced fragments the engines
+send. Run from the backend directory:
+
+    python status_benchmark.py --rounds 200
+"""
+
+import argparse
+import asyncio
+import time
+
+from codec import codec_for
+from dixit.dixitmanager import DixitGameEngine
+from dixit.dixitprojection import DixitPublicSetup, project_public
+from game_engine import UserInfo
+from poker.poker_runtime_holdem import game_start
+from poker.pokergame import (
+    PokerGameEngine,
+    PokerGameStatusMessage,
+    PokerGameStatusMessageData,
+    start_game,
+)
+
+SEATS = 9
+
+
+class _Recipient:
+    """Stands in for a websocket, keeps only the size of the last frame"""
+
+    def __init__(self):
+        self.codec = codec_for(None)
+        self.size = 0
+        # what engines read from a session
+        self.uid = None
+        self.seat = -1
+
+    async def send(self, message, kind=None):
+        self.size = len(self.codec.from_json(message))
+
+    async def send_frame(self, frame, kind=None):
+        self.size = len(frame)
+
+
+class _Room:
+    def __init__(self, users):
+        self.name = "benchmark"
+        self.users = users
+
+
+def _timed(rounds, fn):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+async def _seat_everybody(engine, room):
+    for i, user in enumerate(room.users):
+        await engine.take_seat(room, user, UserInfo(name=f"player{i}"), i)
+
+
+def _poker_status(engine, user, construct):
+    state = engine.state
+    seat = engine.user_index_by_websocket(user)
+    allinRound = state.playing.isAllinRound()
+    players = [
+        player.copy_hide_cards_if_needed(allinRound, skip=i == seat) if player else None
+        for i, player in enumerate(state.playing.players)
+    ]
+    personal = engine.get_personal_status(user)
+    if construct:
+        status = state.model_copy(update={"playing": state.playing.model_copy(update={"players": players})})
+        data = PokerGameStatusMessageData.model_construct(type="status", status=status, personal=personal)
+        return PokerGameStatusMessage.model_construct(type="game", data=data).model_dump_json(warnings=False)
+    status = state.model_copy(deep=True)
+    status.playing.players = players
+    return PokerGameStatusMessage(
+        **{"type": "game", "data": {"type": "status", "personal": personal, "status": status}}
+    ).model_dump_json()
+
+
+async def benchmark_poker(rounds):
+    engine = PokerGameEngine()
+    room = _Room([_Recipient() for _ in range(SEATS)])
+    await _seat_everybody(engine, room)
+    engine.state = start_game(engine.state)
+    game_start(engine.state.playing, engine.deck)
+
+    def validated():
+        for user in room.users:
+            _poker_status(engine, user, construct=False)
+
+    def constructed():
+        for user in room.users:
+            _poker_status(engine, user, construct=True)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        # one field changed between broadcasts, as after a typical action
+        engine.state.playing.turn = engine.state.playing.turn
+        await engine.send_room_state(room)
+    spliced = (time.perf_counter() - start) / rounds * 1e6
+    return {
+        "validated": _timed(rounds, validated),
+        "constructed": _timed(rounds, constructed),
+        "spliced": spliced,
+        "frame bytes": room.users[0].size,
+    }
+
+
+async def benchmark_dixit(rounds):
+    engine = DixitGameEngine()
+    room = _Room([_Recipient() for _ in range(SEATS)])
+    await _seat_everybody(engine, room)
+    engine.state.playing.status = "phase1"
+
+    def validated():
+        DixitPublicSetup(**project_public(engine.state).model_dump()).model_dump_json()
+
+    def constructed():
+        project_public(engine.state).model_dump_json()
+
+    return {
+        "validated": _timed(rounds, validated),
+        "constructed": _timed(rounds, constructed),
+    }
+
+
+async def main(rounds):
+    print(f"us per broadcast to {SEATS} seats")
+    print("poker", {k: round(v) for k, v in (await benchmark_poker(rounds)).items()})
+    print("dixit public view", {k: round(v) for k, v in (await benchmark_dixit(rounds)).items()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Status message construction benchmark")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
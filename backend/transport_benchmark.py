@@ -0,0 +1,56 @@
+"""Round trips through a running server, to compare transports.
+
+Every client sends get_user_info and waits for the status answer, in a
+loop. Start the server with a rate limit that does not get in the way,
+once per transport, and run the benchmark against each:
+
+    python main.py --rate-limit "*=1000000/1000000" [--transport aiohttp] [--uvloop]
+    python transport_benchmark.py --clients 50 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import websockets
+
+REQUEST = json.dumps({"type": "init", "command": "get_user_info"})
+
+
+async def _client(url, requests, latencies):
+    async with websockets.connect(url, compression=None) as ws:
+        # status, then the room list a second later
+        await ws.recv()
+        await ws.recv()
+        for _ in range(requests):
+            start = time.perf_counter()
+            await ws.send(REQUEST)
+            while json.loads(await ws.recv())["type"] != "status":
+                pass
+            latencies.append(time.perf_counter() - start)
+
+
+async def main(url, clients, requests):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(url, requests, latencies) for _ in range(clients)))
+    # the first second is the server's room list delay
+    elapsed = time.perf_counter() - start - 1
+    latencies.sort()
+    print(f"{clients} clients x {requests} round trips to {url}")
+    print(
+        f"{len(latencies) / elapsed:.0f} round trips/s, "
+        f"p50 {statistics.median(latencies) * 1000:.2f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transport round trip benchmark")
+    parser.add_argument("--url", default="ws://localhost:8765/")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.clients, args.requests))
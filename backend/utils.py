@@ -18,5 +18,8 @@ def list_files_sync(path):
     path = Path(path)
     return [str(entry) for entry in filter(Path.is_file, path.iterdir())]
 
-async def send_error(websocket, text):
-    await websocket.send(json.dumps({"type": "error", "message": text}))
+async def send_error(websocket, text, error=None, **details):
+    message = {"type": "error", "message": text}
+    if error is not None:
+        message["error"] = error
+    await websocket.send_json({**message, **details})
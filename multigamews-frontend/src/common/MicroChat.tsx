@@ -7,10 +7,12 @@ export interface MessageInfo {
 
 interface MicroChatProps {
     message: MessageInfo | null;
+    // messages sent before the user came in
+    history?: MessageInfo[];
     send: (text: string) => void
 }
 
-const MicroChat: React.FC<MicroChatProps> = ({ message, send }) => {
+const MicroChat: React.FC<MicroChatProps> = ({ message, history, send }) => {
     const [setMessages, setSetMessages] = useState<MessageInfo[]>([]);
     const [txt, setTxt] = useState<string>('');
 
@@ -23,6 +25,11 @@ const MicroChat: React.FC<MicroChatProps> = ({ message, send }) => {
             setSetMessages([...setMessages, message]);
     }, [message]);
 
+    useEffect(() => {
+        if (history)
+            setSetMessages((messages) => [...history, ...messages]);
+    }, [history]);
+
     const handleSend = () => {
         send(txt)
         setTxt("")
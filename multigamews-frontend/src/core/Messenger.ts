@@ -1,21 +1,56 @@
+import { Decoder, encode } from '@msgpack/msgpack';
+
 type StringToFunctionMap = Record<string, (data: any) => void>;
 
+// offered to the server, it picks the first one it supports
+export const PROTOCOLS = ["msgpack.v1", "json.fast", "json"]
+
 class Messenger {
     websocket: WebSocket;
     subscriptionsOnMessageTypes: StringToFunctionMap = {}
     subscriptionsOnRequestTypes: StringToFunctionMap = {}
+    // messages of watched rooms, tagged with the room name
+    subscriptionsOnRooms: StringToFunctionMap = {}
     onUnknownType?: (data: any) => void
     counter = 0
+    // integer keys of msgpack.v1 frames, received in the first frame
+    wireKeys: string[] = []
+    decoder = new Decoder({ mapKeyConverter: (key) => typeof key === "number" ? this.wireKeys[key] : key })
 
     constructor(ws: WebSocket) {
         this.websocket = ws
+        ws.binaryType = "arraybuffer"
         ws.onmessage = this.handleMessage.bind(this)
     }
 
+    private isBinary() {
+        return this.websocket.protocol === "msgpack.v1"
+    }
+
+    private decode(data: any) {
+        if (typeof data === "string") {
+            return JSON.parse(data)
+        }
+        return this.decoder.decode(new Uint8Array(data))
+    }
+
     public onMessageType(name: string, action: (data: any) => void) {
         this.subscriptionsOnMessageTypes[name] = action
     }
 
+    public onRoomMessage(room: string, action: (data: any) => void) {
+        this.subscriptionsOnRooms[room] = action
+    }
+
+    public subscribe(room: string) {
+        this.send({ "type": "init", "command": "subscribe", "name": room })
+    }
+
+    public unsubscribe(room: string) {
+        delete this.subscriptionsOnRooms[room]
+        this.send({ "type": "init", "command": "unsubscribe", "name": room })
+    }
+
     public incCounter() {
         this.counter += 1
     }
@@ -29,9 +64,29 @@ class Messenger {
     }
 
     public handleMessage(e: MessageEvent<any>) {
-        const message = JSON.parse(e.data);
+        const message: any = this.decode(e.data);
         console.log('Received WebSocket message:', message);
+        this.dispatch(message)
+    }
+
+    private dispatch(message: any) {
         const messageType = message.type
+        if (messageType === "codec") {
+            this.wireKeys = message.keys
+            return
+        }
+        if (messageType === "batch") {
+            // several messages sent together, handled in order
+            message.data.forEach((item: any) => this.dispatch(item))
+            return
+        }
+        if (message.room !== undefined) {
+            const found = this.subscriptionsOnRooms[message.room]
+            if (found != undefined) {
+                found(message)
+            }
+            return
+        }
         if (messageType) {
             const found = this.subscriptionsOnMessageTypes[messageType]
             if (found != undefined) {
@@ -64,7 +119,7 @@ class Messenger {
 
     public send(data: any) {
         if (this.websocket?.readyState === WebSocket.OPEN) {
-            this.websocket.send(JSON.stringify(data));
+            this.websocket.send(this.isBinary() ? encode(data) : JSON.stringify(data));
             console.log('Sent WebSocket message:', data);
             return true;
         } else {
@@ -8,6 +8,7 @@ interface ChatGameProps {
 
 const ChatGame: React.FC<ChatGameProps> = ({ msg }) => {
     const [lastMsg, setLastMsg] = useState<MessageInfo | null>(null)
+    const [history, setHistory] = useState<MessageInfo[]>([])
 
     useEffect(() => {
         if (msg != null) {
@@ -16,7 +17,11 @@ const ChatGame: React.FC<ChatGameProps> = ({ msg }) => {
                 if (data.type === 'chat') {
                     setLastMsg({ "text": data.text, "sender": data.sender.name })
                 }
+                if (data.type === 'chat_history') {
+                    setHistory(data.messages.map((m: any) => ({ "text": m.text, "sender": m.sender?.name })))
+                }
             })
+            msg.send({ type: 'game', data: { type: 'chat_history' } })
         }
     }, [msg]);
 
@@ -26,7 +31,7 @@ const ChatGame: React.FC<ChatGameProps> = ({ msg }) => {
 
     return (
         <div className='game-main-container slide-in-blurred-top'>
-            <MicroChat message={lastMsg} send={handleSend} />
+            <MicroChat message={lastMsg} history={history} send={handleSend} />
         </div>
     );
 };
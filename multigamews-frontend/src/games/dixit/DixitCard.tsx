@@ -1,6 +1,19 @@
 import React, { ReactNode } from 'react';
 import '../DixitCard.css'
 
+// versioned URLs received in prefetch hints, by card file name
+const cardUrls: Record<string, string> = {}
+
+export const prefetchCards = (cards: { card: string, url: string }[]) => {
+    cards.forEach(({ card, url }) => {
+        cardUrls[card] = url
+        const img = new Image()
+        img.src = url
+    })
+}
+
+const cardUrl = (card: string) => cardUrls[card] || `dixit_cards/${card}`
+
 interface AppProps {
     card: string;
     onClick?: (card: string) => void
@@ -13,7 +26,7 @@ const App: React.FC<AppProps> = ({ card, onClick, addon }) => {
     }
 
     return (
-        <div className='dixit-card' style={{ backgroundImage: `url("dixit_cards/${card}")` }} onClick={() => onClick && onClick(card)}>
+        <div className='dixit-card' style={{ backgroundImage: `url("${cardUrl(card)}")` }} onClick={() => onClick && onClick(card)}>
             {addon ? renderAddon(addon) : null}
         </div>
     );
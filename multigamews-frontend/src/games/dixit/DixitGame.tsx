@@ -5,7 +5,7 @@ import { UserInfo } from '../../menu/AppWrapper';
 import './DixitGame.css'
 import DixitSeat from './DixitSeat';
 import DixitPlayerThumbnail from './DixitPlayerThumbnail';
-import DixitCard from './DixitCard';
+import DixitCard, { prefetchCards } from './DixitCard';
 
 interface DixitGameProps {
     msg: Messenger | null;
@@ -20,9 +20,9 @@ export interface Seat {
 export interface DixitPlayer {
     seat: number;
     pts: number;
-    cards: string[];
     acted: boolean;
-    guess: string | null;
+    guessed: boolean;
+    cards_count: number;
 }
 
 export interface DixitGameState {
@@ -30,8 +30,9 @@ export interface DixitGameState {
     players: (DixitPlayer | null)[];
     current_player: number;
     table: TableCardHandle[];
+    table_count: number;
     last_round_result: DixitResult | null;
-    deck: string[];
+    deck_count: number;
 }
 
 export interface DixitAction {
@@ -66,6 +67,9 @@ export interface DixitGameStatusMessageData {
 interface DixitGameStatusPersonal {
     websocket_uid: string;
     seat: number;
+    cards: string[];
+    played: string | null;
+    guess: string | null;
 }
 
 interface DixitGameStatusMessage {
@@ -121,6 +125,9 @@ const DixitGame: React.FC<DixitGameProps> = ({ msg, user }) => {
                     setStatus(data.status)
                     setPersonal(data.personal)
                 }
+                if (data.type === 'prefetch') {
+                    prefetchCards(data.cards)
+                }
                 if (data.type === 'chat') {
                     setLastMsg({ "text": data.text, "sender": data.sender.name })
                 }
@@ -182,7 +189,7 @@ const DixitGame: React.FC<DixitGameProps> = ({ msg, user }) => {
             <h2>Phase 2</h2>
             {status.playing?.current_player == personal?.seat ? "Pick a card and describe it" : `Player ${status.seats[status.playing?.current_player || 0]?.info?.name} (${status.playing?.current_player}) should pick a card`}
             <div className='dixit-cards'>
-                {status.playing && personal && status.playing.players[personal.seat]?.cards.map(card => <DixitCard key={card} onClick={handleCardClick} card={card}></DixitCard>)}
+                {personal?.cards.map(card => <DixitCard key={card} onClick={handleCardClick} card={card}></DixitCard>)}
             </div>
             <p className='debug'>
                 {`status.playing?.current_player = ${status.playing?.current_player}`}<br />
@@ -198,14 +205,14 @@ const DixitGame: React.FC<DixitGameProps> = ({ msg, user }) => {
                 <h2>Phase 2</h2>
                 <p>Wait until other users pick their variants</p>
                 <p>Chosen: </p>
-                <DixitCard card={status.playing?.table[0].card || ""} />
+                <DixitCard card={personal?.played || ""} />
             </div>
         } else {
             return <div className='fullw'>
                 <h2>Phase 2</h2>
                 <p>Choose your variant</p>
                 <div className={'dixit-cards ' + (getSelf()?.acted ? 'faded' : '')}>
-                    {status.playing && personal && status.playing.players[personal.seat]?.cards.map(card => <DixitCard key={card} onClick={handleCardClick} card={card}></DixitCard>)}
+                    {personal?.cards.map(card => <DixitCard key={card} onClick={handleCardClick} card={card}></DixitCard>)}
                 </div>
             </div>
         }
@@ -236,7 +243,7 @@ const DixitGame: React.FC<DixitGameProps> = ({ msg, user }) => {
             return <div className='fullw'>
                 <h2>Phase 3</h2>
                 <p>Choose a card on the table</p>
-                <div className={'dixit-cards ' + (getSelf()?.guess ? 'faded' : '')}>
+                <div className={'dixit-cards ' + (personal?.guess ? 'faded' : '')}>
                     {status.playing?.table.map(cardHandle => <DixitCard key={cardHandle.card} card={cardHandle.card} onClick={handleCardClick} />)}
                 </div>
             </div>
@@ -10,7 +10,7 @@ interface DixitPlayerThumbnailProps {
 }
 
 const DixitPlayerThumbnail: React.FC<DixitPlayerThumbnailProps> = ({ player, seat, me }) => {
-    const clazz = (player.acted || player.guess) ? "faded" : "";
+    const clazz = (player.acted || player.guessed) ? "faded" : "";
     const meclass = (me) ? "me" : "";
     return (
         <div className={`dixit-thumbnail ${clazz} ${meclass}`} style={{ backgroundImage: `url("${seat?.info?.avatar}")` }}>
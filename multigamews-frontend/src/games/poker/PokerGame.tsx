@@ -34,7 +34,6 @@ interface PokerGamePlaying {
     table: string[]
     bank: number
     expected_actions: PokerAction[]
-    comments: PokerComment[]
     last_round_victory: VictoryRecord | null
 }
 
@@ -54,6 +53,8 @@ const PokerGame: React.FC<PokerGameProps> = ({ msg, user }) => {
     const [lastMsg, setLastMsg] = useState<MessageInfo | null>(null)
     const [status, setStatus] = useState<PokerGameStatus>({ stage: "loading", setup: genLoadingSetup() })
     const [personal, setPersonal] = useState<PersonalGameStatus | null>(null)
+    // latest batch of comments, the server sends only new ones
+    const [comments, setComments] = useState<PokerComment[]>([])
     const parentRef = useRef<HTMLDivElement>(null);
 
     const move = () => {
@@ -74,6 +75,9 @@ const PokerGame: React.FC<PokerGameProps> = ({ msg, user }) => {
                     setStatus(data.status)
                     setPersonal(data.personal)
                 }
+                if (data.type === 'comments') {
+                    setComments(data.comments)
+                }
                 if (data.type === 'chat') {
                     setLastMsg({ "text": data.text, "sender": data.sender.name })
                 }
@@ -90,6 +94,10 @@ const PokerGame: React.FC<PokerGameProps> = ({ msg, user }) => {
         msg?.send({ type: 'game', data: { type: 'take_seat', data: seat } })
     }
 
+    const handleAddBot = (seat: number) => {
+        msg?.send({ type: 'game', data: { type: 'add_bot', data: { seat } } })
+    }
+
     const getPlayer = () => {
         const i = personal?.seat
         let player = null
@@ -107,6 +115,7 @@ const PokerGame: React.FC<PokerGameProps> = ({ msg, user }) => {
                 return <div key={i} className='poker-seat poker-setup-seat'>
                     <p>{i + 1}</p>
                     {selectSeat && <button className='poker-take-seat-button' onClick={() => handleTakeSeat(i)}>Take</button>}
+                    {selectSeat && <button className='poker-take-seat-button' onClick={() => handleAddBot(i)}>Bot</button>}
                 </div>
             } else {
                 let player = null
@@ -122,7 +131,7 @@ const PokerGame: React.FC<PokerGameProps> = ({ msg, user }) => {
 
     const renderSeatsAndTable = () => {
         if (status.playing) {
-            return [...renderSeats(false), <PokerTable players={status.setup.seats} data={status.playing.comments} tableCards={status.playing.table} bank={status.playing.bank} victory={status.playing.last_round_victory} />]
+            return [...renderSeats(false), <PokerTable players={status.setup.seats} data={comments} tableCards={status.playing.table} bank={status.playing.bank} victory={status.playing.last_round_victory} />]
         }
         else {
             return renderSeats(false)
@@ -8,6 +8,7 @@ import Tablebet from './Tablebet';
 export interface Seat {
     info: UserInfo | null
     ai: boolean
+    policy?: string | null
 }
 
 export interface PokerAction {
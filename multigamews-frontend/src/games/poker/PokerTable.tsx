@@ -13,6 +13,7 @@ interface PokerTableProps {
 }
 
 export interface PokerComment {
+    id: number;
     text: string;
     seats: number[];
 }
@@ -42,12 +43,9 @@ const processComment = (data: PokerComment, players: Seat[]) => {
 
 const PokerTable: React.FC<PokerTableProps> = ({ tableCards, bank, data, players, victory }) => {
     const [messages, setMessages] = useState<string[]>(data.map((a) => processComment(a, players || [])))
-    const [lastLength, setLastLength] = useState<number>(0)
 
     useEffect(() => {
-        const news = data.slice(lastLength)
-        setLastLength(data.length)
-        setMessages(news.map(a => processComment(a, players || [])))
+        setMessages(data.map(a => processComment(a, players || [])))
     }, [data])
 
     const genClass = (baseClass: string) => {
@@ -3,7 +3,7 @@ import Modal from '../common/Modal';
 import WebSocketTest from '../common/WebSocketTest';
 import './AppWrapper.css'
 import RoomsLobby from './RoomsLobby';
-import Messenger from '../core/Messenger';
+import Messenger, { PROTOCOLS } from '../core/Messenger';
 import CurrentRoomWidget from './CurrentRoomWidget';
 import ChatGame from '../games/Chat';
 import PokerGame from '../games/poker/PokerGame';
@@ -42,7 +42,7 @@ const AppWrapper: React.FC<AppWrapperProps> = ({ }) => {
         const webSocketPort = 8765;
         const webSocketUrl = `ws://${urlWithoutPort}:${webSocketPort}`;
 
-        const newWs = new WebSocket(webSocketUrl);
+        const newWs = new WebSocket(webSocketUrl, PROTOCOLS);
 
         newWs.onopen = () => {
             console.log('WebSocket connection opened');
@@ -64,6 +64,22 @@ const AppWrapper: React.FC<AppWrapperProps> = ({ }) => {
             console.log("Status updated")
         })
 
+        // the full member list comes with the status, changes come as events
+        const updateUsers = (update: (users: any[]) => any[]) =>
+            setCurrentRoomInfo((info: any) => info && { ...info, users: update(info.users) })
+
+        msgr.onMessageType("user_joined", (message) => {
+            updateUsers((users) => [...users, message.data])
+        })
+
+        msgr.onMessageType("user_left", (message) => {
+            updateUsers((users) => users.filter((user) => user.id !== message.data.id))
+        })
+
+        msgr.onMessageType("user_updated", (message) => {
+            updateUsers((users) => users.map((user) => user.id === message.data.id ? message.data : user))
+        })
+
 
         msgr.onMessageType("game", (message) => {
             console.warn("Game message received")